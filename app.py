@@ -1,7 +1,98 @@
 import streamlit as st
 import pandas as pd
-from src.stamprally_analyze import build_graph, draw_graph, draw_agraph
+import numpy as np
+from src.adjacency import SparseAdjacency
+from src.stamprally_analyze import count_transitions, graph_from_counts
+from src.stamprally_render import draw_agraph, graph_tables, render_graph_image, submit_render
+from src.graph_lod import reduce_graph, DEFAULT_MAX_EDGES, DEFAULT_MAX_NODES
+from src.time_filter import build_time_index, concat_time_indexes, time_filter_mask
+from src.transition_cube import build_transition_cube, query_transition_cube
+from src.result_cache import ResultCache, content_key
+from src.layout import get_layout, dump_layout, load_layout
+from src.shards import OverlappingShardsError, merge_partials, shard_partial
+from src.stream_ingest import stream_counts
+from src.visitor_sketch import (
+    SKETCH_VERSION, build_visitor_sketches, merge_visitor_registers, precision_for_error, query_visitor_sketches,
+    standard_error, visitor_estimates,
+)
+from src.routes import mine_routes, visit_orders, routes_frame
+from src.table_view import show_table
+from src.export import spool_export, write_combined_csv, write_export_bundle
+from src.profiling import Profiler, configure_perf_log
+from src.ingest import default_cache_dir, load_stamps
+from src.job_runner import Job, LatestJobRunner
 import datetime
+import hashlib
+import importlib.util
+import os
+
+# バックグラウンドの計算がこの秒数以内に終われば、前の結果を挟まずにそのまま表示する
+BACKGROUND_WAIT_SECONDS = 0.3
+
+@st.cache_resource
+def get_result_cache():
+    # 同じファイルを開いた全セッションで共有するキャッシュ
+    max_mb = int(os.environ.get("STAMPRALLY_CACHE_MB", "512"))
+    return ResultCache(max_bytes=max_mb * 1024 * 1024, disk_dir=os.environ.get("STAMPRALLY_CACHE_DIR") or None)
+
+def load_dataset(uploaded_file, profiler=None, key=None):
+    profiler = profiler or Profiler()
+
+    # CSVファイルの読み込み（同じ内容のファイルは保存しておいた Arrow 形式から読み込む）
+    try:
+        loaded = load_stamps(uploaded_file, cache_dir=default_cache_dir(), key=key, profiler=profiler)
+    except ValueError as e:
+        return {'error': str(e)}
+    df = loaded['df']
+
+    with profiler.stage("time_index", rows=len(df)):
+        time_index = build_time_index(df["timestamp"])
+    return {'df': df, 'time_index': time_index, 'bad_rows': loaded['bad_rows'],
+            'timestamp_format': loaded['timestamp_format']}
+
+def combine_datasets(parsed, shard_hashes, profiler=None):
+    # ファイルごとに読み込んだデータを連結し、各ファイルの行の範囲を 'shards' に残す。
+    # 時刻索引はファイルごとに作ったものをつなぐだけにする（DataFrame の連結は行数に比例してやり直す）
+    profiler = profiler or Profiler()
+    with profiler.stage("combine", rows=sum(len(item['df']) for item in parsed)):
+        df = pd.concat([item['df'] for item in parsed], ignore_index=True)
+        # カテゴリが異なるファイルを連結すると通常の列になるので、カテゴリ型に戻す
+        for column in ("user_id", "point"):
+            if not isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype("category")
+        time_index = concat_time_indexes([item['time_index'] for item in parsed])
+    bounds = np.cumsum([0] + [len(item['df']) for item in parsed])
+    return {'df': df, 'time_index': time_index,
+            'shards': list(zip(shard_hashes, bounds[:-1].tolist(), bounds[1:].tolist()))}
+
+@st.fragment(run_every=0.5)
+def watch_job(job, showing_previous=False):
+    # 計算中の進捗を表示し、完了したらページ全体を描き直す
+    if job.done():
+        st.rerun(scope="app")
+    text = f"新しい条件で集計しています…（{job.message}）"
+    if showing_previous:
+        text += "　完了するまで前の条件の結果を表示しています。"
+    st.progress(job.progress, text=text)
+
+def show_profile(profiler, job_profiler=None):
+    # 段階ごとの処理時間（キャッシュから取得した段階は計測されない）。job_profiler は表示している結果を
+    # 計算した（バックグラウンドの）計算の記録
+    with st.sidebar.expander("計測結果", expanded=True):
+        sections = [("今回の実行", profiler)]
+        if job_profiler is not None and job_profiler.enabled:
+            sections.append(("表示している結果の計算", job_profiler))
+        for title, section in sections:
+            if len(sections) > 1:
+                st.markdown(f"**{title}**")
+            if not section.records:
+                st.caption("計算した段階はありません（すべてキャッシュから取得）。")
+                continue
+            st.dataframe(pd.DataFrame(section.records), hide_index=True)
+            st.caption(f"合計 {section.total_seconds():.3f} 秒（実行ID {section.context['run_id']}）")
+        if profiler.trace_memory:
+            st.caption("process_peak_mb はプロセス全体のピークメモリで、同時に動いている他のセッションや"
+                       "スレッドの処理の分も含みます。")
 
 def main():
     # ページ設定
@@ -23,16 +114,22 @@ def main():
     # サイドバーでファイルアップロードと時刻範囲選択UIを常に表示
     with st.sidebar:
         st.header("データ入力")
-        uploaded_file = st.file_uploader("CSVファイルを選択してください", type=["csv"])
+        # 日ごと・端末ごとに分かれたファイルは、まとめて選択すると 1 つのデータとして分析する
+        uploaded_files = st.file_uploader("CSVファイルを選択してください（複数可）", type=["csv"],
+                                          accept_multiple_files=True)
 
         # Check if a new file has been uploaded or the file has been cleared
         if 'last_uploaded_file_name' not in st.session_state:
             st.session_state.last_uploaded_file_name = None
 
-        if uploaded_file is not None and st.session_state.last_uploaded_file_name != uploaded_file.name:
-            st.session_state.pos = None
-            st.session_state.last_uploaded_file_name = uploaded_file.name
-        elif uploaded_file is None and st.session_state.last_uploaded_file_name is not None:
+        uploaded_names = tuple(f.name for f in uploaded_files)
+        previous_names = st.session_state.last_uploaded_file_name
+        if uploaded_names and previous_names != uploaded_names:
+            # ファイルを追加・削除しただけなら座標を引き継ぐ（新しいポイントだけを配置する）
+            if not previous_names or not set(previous_names) & set(uploaded_names):
+                st.session_state.pos = None
+            st.session_state.last_uploaded_file_name = uploaded_names
+        elif not uploaded_names and previous_names is not None:
             # File was cleared
             st.session_state.pos = None
             st.session_state.last_uploaded_file_name = None
@@ -50,6 +147,31 @@ def main():
             default=list(weekdays_map.keys()) # デフォルトは全選択
         )
 
+        # 曜日×時刻ごとの遷移数をアップロード時に事前集計し、フィルタ変更時の再計算を省く
+        use_cube = st.checkbox("集計キューブで高速化", value=False)
+
+        # グラフ画像の形式（SVG は生成が軽く、ブラウザで拡大しても粗くならない）
+        image_format = st.radio("グラフ画像の形式", options=["png", "svg"], horizontal=True)
+        # 画像の描画を別スレッドで行い、先に表を表示する
+        render_in_background = st.checkbox("グラフ画像をバックグラウンドで描画", value=False)
+        # 絞り込み・集計を別スレッドで行い、計算中は前の結果を表示する（条件を変えると古い計算は取り消す）
+        run_in_background = st.checkbox("条件変更時の再計算をバックグラウンドで行う", value=True)
+        # エッジに隣り合うスタンプ間の所要時間（中央値）も表示する
+        show_travel_time = st.checkbox("所要時間を表示", value=False)
+        # ユニーク訪問者数を HyperLogLog で近似する（ポイント × 時間帯ごとのスケッチを合併する）
+        approx_visitors = st.checkbox("訪問者数を近似する（HyperLogLog）", value=False)
+        # 問い合わせ結果のレジスタは (ポイント数 + 1) × 2**precision バイトになるので、0.5%（precision 16）は選べない
+        approx_error = st.select_slider("近似の誤差（標準誤差）", options=[0.01, 0.02, 0.05], value=0.02,
+                                        format_func=lambda e: f"{e:.1%}", disabled=not approx_visitors)
+
+        # 保存しておいたノード座標の読み込み
+        layout_file = st.file_uploader("ノード座標（JSON）を読み込む", type=["json"])
+
+        # 段階ごとの処理時間・メモリの計測（STAMPRALLY_PROFILE=1 で既定をオンにする）
+        profile_enabled = st.checkbox("パフォーマンス計測", value=os.environ.get("STAMPRALLY_PROFILE") == "1")
+        profile_memory = st.checkbox("ピークメモリ（プロセス全体）も計測する（処理が遅くなります）", value=False,
+                                     disabled=not profile_enabled)
+
     # time_rangeからstartとendの時刻を取得
     start_time = time_range[0]
     end_time = time_range[1]
@@ -57,60 +179,236 @@ def main():
     # 選択された曜日を数値に変換
     selected_weekdays_numbers = [weekdays_map[day] for day in selected_weekdays_names]
 
-    # レイアウトの初期化と再計算ボタン
+    # レイアウトの初期化
     if 'pos' not in st.session_state:
         st.session_state.pos = None
 
     # ファイルが選択されていない場合はメッセージを表示
-    if uploaded_file is None:
+    if not uploaded_files:
         st.info("👈 サイドバーからCSVファイルを選択してください")
         return
 
     # ファイルが選択された場合の処理
-    # CSVファイルの読み込み
-    df = pd.read_csv(uploaded_file)
-
-    # 必要な列の確認
-    if "user_id" not in df.columns or "point" not in df.columns:
-        st.error("CSVファイルに'user_id'または'point'列が存在しません。")
+    # 各段階の結果はファイル内容のハッシュとフィルタ条件をキーにキャッシュする
+    cache = get_result_cache()
+    # ファイルごとの内容のハッシュ（同じアップロードでは計算し直さない）
+    file_hashes = st.session_state.setdefault('file_hashes', {})
+    for f in uploaded_files:
+        if f.file_id not in file_hashes:
+            file_hashes[f.file_id] = hashlib.sha256(f.getvalue()).hexdigest()
+    shard_hashes = [file_hashes[f.file_id] for f in uploaded_files]
+    st.session_state.file_hash = (shard_hashes[0] if len(shard_hashes) == 1
+                                  else content_key(*shard_hashes))
+    file_key = content_key(st.session_state.file_hash)
+
+    # 計測結果は STAMPRALLY_PERF_LOG を指定していれば JSON Lines でも保存する
+    configure_perf_log()
+    profile_context = {'file': st.session_state.file_hash[:12], 'files': len(uploaded_files)}
+    profiler = Profiler(enabled=profile_enabled, trace_memory=profile_memory, context=profile_context)
+
+    # CSVの読み込みと時刻索引の作成（ファイルごとにキャッシュし、新しいファイルだけを並列に読み込む）
+    parsed = cache.get_or_compute_many(
+        "parse", [content_key(h) for h in shard_hashes],
+        [lambda f=f, h=h: load_dataset(f, profiler, key=h) for f, h in zip(uploaded_files, shard_hashes)])
+    errors = [f"{f.name}: {item['error']}" for f, item in zip(uploaded_files, parsed) if 'error' in item]
+    if errors:
+        st.error("\n\n".join(errors))
+        if profile_enabled:
+            show_profile(profiler)
         return
-
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    if len(parsed) == 1:
+        dataset = parsed[0]
     else:
-        st.error("CSVファイルに'timestamp'列が存在しません。")
-        return
-
-    # 時刻のみを取得する関数
-    def get_time_only(dt):
-        return dt.time()
-
-    # 曜日を取得する関数
-    def get_weekday_number(dt):
-        return dt.weekday()
-
-    # 選択された時刻範囲でデータをフィルタリング（日付は無視）
-    time_filtered_df = df[df["timestamp"].apply(lambda x: start_time <= get_time_only(x) <= end_time)]
-    
-    # 選択された曜日でデータをフィルタリング
-    if selected_weekdays_numbers: # 選択された曜日がある場合のみフィルタリング
-        filtered_df = time_filtered_df[time_filtered_df["timestamp"].apply(lambda x: get_weekday_number(x) in selected_weekdays_numbers)]
+        dataset = cache.get_or_compute("dataset", file_key, lambda: combine_datasets(parsed, shard_hashes, profiler))
+    df = dataset['df']
+    time_index = dataset['time_index']
+
+    # 読み込めなかった行（時刻を解釈できない・必須の値が空）は集計から除き、別の表で示す
+    bad_rows = pd.concat([item['bad_rows'].assign(ファイル=f.name) for f, item in zip(uploaded_files, parsed)],
+                         ignore_index=True)
+    if len(bad_rows):
+        st.warning(f"{len(bad_rows):,} 行を読み込めなかったため、集計から除きました。")
+        with st.expander("読み込めなかった行"):
+            show_table(bad_rows, key="bad_rows")
+
+    # 選択された時刻範囲（日付は無視）と曜日でデータをフィルタリング
+    # 曜日が選択されていない場合は曜日で絞り込まない
+    filter_key = content_key(st.session_state.file_hash, start_time, end_time, sorted(set(selected_weekdays_numbers)))
+    approx_precision = precision_for_error(approx_error) if approx_visitors else None
+
+    # 絞り込みからグラフの構築・訪問者数の推定まで。条件は投入した時点の値に固定する
+    # （バックグラウンドで実行中に画面側の変数が変わっても影響を受けない）。job.step の時点で打ち切れる。
+    # 計測は計算ごとのプロファイラに記録し、その結果を表示するときに一緒に表示する
+    def analyze(job, file_hash=st.session_state.file_hash, filter_key=filter_key, start_time=start_time,
+                end_time=end_time, weekdays=tuple(selected_weekdays_numbers), precision=approx_precision):
+        profiler = Profiler(enabled=profile_enabled, trace_memory=profile_memory,
+                            context={**profile_context, 'job': job.key[:12]})
+        job.step(0.0, "絞り込み")
+
+        def apply_filter():
+            with profiler.stage("filter", rows=len(df)) as record:
+                mask = time_filter_mask(time_index, start_time, end_time, list(weekdays))
+                record["rows"] = int(mask.sum())
+            return mask
+
+        def filter_shards():
+            # 複数ファイル: ファイルごとのマスク（ファイルと条件ごとにキャッシュ）をつなぐ
+            def make_mask(source):
+                with profiler.stage("filter", rows=len(source['df'])) as record:
+                    mask = time_filter_mask(source['time_index'], start_time, end_time, list(weekdays))
+                    record["rows"] = int(mask.sum())
+                return mask
+
+            keys = [content_key(h, start_time, end_time, sorted(set(weekdays))) for h, _, _ in dataset['shards']]
+            return np.concatenate(cache.get_or_compute_many(
+                "shard_mask", keys, [lambda source=source: make_mask(source) for source in parsed]))
+
+        # キャッシュにはマスクだけを置き、行は必要になったときに取り出す
+        mask = cache.get_or_compute("filter_mask", filter_key,
+                                    filter_shards if 'shards' in dataset else apply_filter)
+        # 絞り込まない場合は行を取り出さずに読み込んだデータをそのまま使う
+        unfiltered = bool(mask.all())
+        filtered_df = df if unfiltered else df[mask]
+        result = {'file_hash': file_hash, 'filter_key': filter_key, 'count_key': filter_key,
+                  'start_time': start_time, 'end_time': end_time, 'precision': precision,
+                  'filtered_df': filtered_df, 'total_users': None, 'profiler': profiler}
+        if filtered_df.empty:
+            return result
+
+        # グラフの構築（キューブを使っても使わなくても結果は同じなので同じキーで共有する）。
+        # 近似モードでは正確な訪問者数を数えない（訪問者数はスケッチから推定する）
+        job.step(0.2, "グラフの構築")
+        visitors = precision is None
+        counts_key = content_key(filter_key, visitors)
+
+        def make_cube():
+            job.step(0.25, "集計キューブの作成")
+            with profiler.stage("build_cube", rows=len(df)):
+                return build_transition_cube(df, time_index)
+
+        def make_counts():
+            if use_cube:
+                cube = cache.get_or_compute("cube", file_key, make_cube)
+                job.step(0.5, "集計キューブの問い合わせ")
+                with profiler.stage("query_cube", rows=len(filtered_df)):
+                    return query_transition_cube(cube, time_index, start_time, end_time,
+                                                 list(weekdays), mask=mask, visitors=visitors)
+            if 'shards' in dataset:
+                # 複数ファイル: ファイルごとの部分集計（ファイルと条件ごとにキャッシュ）を合併する。
+                # ファイルを 1 つ追加しても、集計し直すのはそのファイルだけ
+                shards = dataset['shards']
+
+                def make_partial(start, stop):
+                    job.step(0.3, "ファイルごとの集計")
+                    with profiler.stage("shard_partial", rows=stop - start):
+                        return shard_partial(df.iloc[start:stop][mask[start:stop]], visitors=visitors)
+
+                partials = cache.get_or_compute_many(
+                    "shard", [content_key(h, start_time, end_time, sorted(set(weekdays)), visitors)
+                              for h, _, _ in shards],
+                    [lambda start=start, stop=stop: make_partial(start, stop) for _, start, stop in shards])
+                job.step(0.5, "ファイルごとの集計の合併")
+                try:
+                    with profiler.stage("merge_shards", rows=len(shards)):
+                        return merge_partials(partials)
+                except OverlappingShardsError:
+                    # 同じユーザーのスタンプがファイル間で入り組んでいる場合は連結したデータから数え直す
+                    pass
+            if unfiltered:
+                # 絞り込まない場合はチャンクごとに集計し、行数に比例する作業用の配列を作らない
+                with profiler.stage("stream_counts", rows=len(df)):
+                    return stream_counts(df, visitors=visitors)
+            with profiler.stage("count_transitions", rows=len(filtered_df)):
+                return count_transitions(filtered_df, visitors=visitors)
+
+        # 集計結果から移動者数の疎行列を直接作り、networkx のグラフは配置・描画のためにだけ作る
+        counts = cache.get_or_compute("counts", counts_key, make_counts)
+        adjacency = cache.get_or_compute("adjacency", filter_key, lambda: SparseAdjacency.from_counts(counts))
+
+        def make_graph():
+            job.step(0.6, "グラフの作成")
+            with profiler.stage("graph_from_counts", rows=len(counts["edge_weight"])):
+                return graph_from_counts(counts)
+
+        G, node_counts, point_to_id = cache.get_or_compute("graph", counts_key, make_graph)
+        result.update({'G': G, 'adjacency': adjacency, 'node_counts': node_counts, 'point_to_id': point_to_id})
+
+        # 近似モード: 訪問者数をスケッチから求め、以降の表示・キャッシュのキーも切り替える
+        if precision is not None:
+            job.step(0.7, "訪問者数の推定")
+            count_key = content_key(filter_key, precision)
+            sources = parsed if 'shards' in dataset else [dataset]
+
+            def make_sketch(source):
+                job.step(0.75, "スケッチの作成")
+                with profiler.stage("build_sketch", rows=len(source['df'])):
+                    return build_visitor_sketches(source['df'], source['time_index'], precision)
+
+            def query_visitors():
+                # ファイルごとのスケッチ（条件によらず 1 回だけ作る）を問い合わせて合併する
+                sketches = cache.get_or_compute_many(
+                    "sketch", [content_key(h, precision, SKETCH_VERSION) for h in shard_hashes],
+                    [lambda source=source: make_sketch(source) for source in sources])
+                job.step(0.9, "スケッチの問い合わせ")
+                # 分の途中で終わる範囲だけ、その秒の行を時刻索引から取り出して足す
+                with profiler.stage("query_sketch", rows=len(filtered_df)):
+                    return visitor_estimates(merge_visitor_registers([
+                        query_visitor_sketches(sketch, start_time, end_time, list(weekdays),
+                                               df=source['df'], time_index=source['time_index'])
+                        for sketch, source in zip(sketches, sources)]))
+
+            estimates, total_users = cache.get_or_compute("visitors", count_key, query_visitors)
+            result.update({'count_key': count_key, 'total_users': total_users,
+                           'node_counts': {n: estimates.get(n, 0) for n in G.nodes()}})
+        return result
+
+    analysis_key = content_key(filter_key, use_cube, approx_precision)
+    if run_in_background:
+        # 条件が変わるたびに新しい計算を投入し、古い計算は取り消す。すぐに終わらなければ
+        # 最後に完了した結果を表示しておき、完了したら描き直す
+        runner = st.session_state.setdefault('analysis_runner', LatestJobRunner())
+        job = runner.submit(analysis_key, analyze)
+        analysis = runner.wait(job, timeout=BACKGROUND_WAIT_SECONDS)
+        if analysis is None:
+            _, analysis = runner.latest()
+            if analysis is not None and analysis['file_hash'] != st.session_state.file_hash:
+                analysis = None
+            watch_job(job, showing_previous=analysis is not None)
+            if analysis is None:
+                if profile_enabled:
+                    show_profile(profiler)
+                return
     else:
-        filtered_df = time_filtered_df
+        analysis = analyze(Job(analysis_key))
+
+    # 表示する結果の条件（計算中は前の条件の結果を表示する）
+    filter_key = analysis['filter_key']
+    count_key = analysis['count_key']
+    start_time, end_time = analysis['start_time'], analysis['end_time']
+    precision = analysis['precision']
+    filtered_df = analysis['filtered_df']
+    total_users = analysis['total_users']
 
     # フィルタ後にデータが空の場合はメッセージ表示して早期終了
     if filtered_df.empty:
         st.warning("選択した時刻範囲に該当するデータがありません。別の範囲を選択してください。")
         st.subheader("利用したデータ")
         st.write(filtered_df)
-        st.session_state.pos = None
     else:
-        # グラフの構築
-        G, node_counts, point_to_id = build_graph(filtered_df)
+        G, node_counts, point_to_id = analysis['G'], analysis['node_counts'], analysis['point_to_id']
 
         # グラフの描画
         st.subheader("人流グラフ")
 
+        # 読み込んだ座標を反映（同じファイルはアップロードごとに1回だけ）
+        if layout_file is not None and st.session_state.get('layout_file_id') != layout_file.file_id:
+            loaded = load_layout(layout_file.getvalue().decode("utf-8"))
+            st.session_state.pos = {**(st.session_state.pos or {}), **loaded}
+            for node_id in loaded:
+                st.session_state.pop(f"pos_x_{node_id}", None)
+                st.session_state.pop(f"pos_y_{node_id}", None)
+            st.session_state.layout_file_id = layout_file.file_id
+
         # 座標編集ウィジェットからの更新を st.session_state.pos に反映
         if st.session_state.get('pos'):
             for node_id in st.session_state.pos.keys():
@@ -122,11 +420,46 @@ def main():
                         st.session_state[widget_key_y]
                     )
 
-        graph_data = draw_graph(G, node_counts, point_to_id, pos=st.session_state.pos)
-        st.session_state.pos = graph_data['pos']
+        # ノード座標: これまでの座標を引き継ぎ、新しく現れたポイントだけを配置する
+        # （フィルタで消えたポイントの座標も残しておくので、条件を戻しても配置は変わらない）
+        with profiler.stage("layout", rows=G.number_of_nodes()):
+            pos = get_layout(G, st.session_state.pos, namespace=st.session_state.file_hash)
+        st.session_state.pos = {**(st.session_state.pos or {}), **pos}
+
+        def make_tables():
+            with profiler.stage("graph_tables", rows=G.number_of_nodes()):
+                return graph_tables(G, node_counts)
+
+        graph_data = cache.get_or_compute("tables", count_key, make_tables)
+
+        # 画像は描画し終えたものだけをキャッシュに置く（描画中の Future は置かない）
+        image_key = content_key(count_key, sorted(pos.items()), image_format, show_travel_time)
+        found, image = cache.get("image", image_key)
+        if not found:
+            render_args = (G, node_counts, point_to_id, pos, image_format, show_travel_time, profiler)
+            if render_in_background:
+                def store_image(future):
+                    if future.exception() is None:
+                        cache.put("image", image_key, future.result().getvalue())
+
+                image = submit_render(*render_args)
+                image.add_done_callback(store_image)
+            else:
+                image = render_graph_image(*render_args).getvalue()
+                cache.put("image", image_key, image)
 
-        # 画像の表示
-        st.image(graph_data['image'], width='content')
+        # 画像の表示（バックグラウンド描画の場合は表を表示した後で埋める）
+        image_slot = st.empty()
+
+        def show_graph_image():
+            data = image.result().getvalue() if hasattr(image, 'result') else image
+            if image_format == "svg":
+                image_slot.image(data.decode("utf-8"), width='content')
+            else:
+                image_slot.image(data, width='content')
+
+        if not render_in_background:
+            show_graph_image()
 
         # ノード座標の編集UI
         with st.expander("ノード座標の編集"):
@@ -139,6 +472,13 @@ def main():
                 col2.write("**X座標**")
                 col3.write("**Y座標**")
 
+                st.download_button(
+                    label="ノード座標を保存（JSON）",
+                    data=dump_layout(st.session_state.pos),
+                    file_name="stamprally_layout.json",
+                    mime="application/json"
+                )
+
                 for node_id, coords in sorted(st.session_state.pos.items()):
                     if node_id not in G.nodes:
                         continue
@@ -165,7 +505,42 @@ def main():
                             label_visibility="collapsed"
                         )
 
-        draw_agraph(G, node_counts, point_to_id)
+        # インタラクティブ表示: 大きなグラフは主要なポイントと移動数の多いエッジだけに簡略化し、
+        # 残りのポイントはクラスタにまとめる（座標は固定し、ブラウザ側の力学計算を止める）
+        lod_col1, lod_col2, lod_col3 = st.columns([2, 1, 1])
+        use_lod = lod_col1.checkbox("インタラクティブ表示を簡略化（大きなグラフ向け）", value=True)
+        lod_max_edges = int(lod_col2.number_input("表示するエッジ数", min_value=10, max_value=5000,
+                                                  value=DEFAULT_MAX_EDGES, step=10, disabled=not use_lod))
+        lod_max_nodes = int(lod_col3.number_input("個別に表示するポイント数", min_value=5, max_value=1000,
+                                                  value=DEFAULT_MAX_NODES, step=5, disabled=not use_lod))
+        expanded = st.session_state.setdefault('lod_expanded', [])
+
+        lod = None
+        if use_lod:
+            def make_lod():
+                with profiler.stage("reduce_graph", rows=G.number_of_edges()):
+                    return reduce_graph(G, node_counts, pos, max_nodes=lod_max_nodes, max_edges=lod_max_edges,
+                                        expanded=expanded)
+
+            lod = cache.get_or_compute(
+                "lod", content_key(count_key, sorted(pos.items()), lod_max_nodes, lod_max_edges, expanded),
+                make_lod)
+            if lod['clusters'] or lod['hidden_edges']:
+                st.caption(f"{len(lod['clusters'])} 個のクラスタ（クリックで展開）、"
+                           f"省略したエッジ {lod['hidden_edges']:,} 本")
+            if expanded and st.button("展開したクラスタを閉じる"):
+                st.session_state.lod_expanded = []
+                st.rerun()
+
+        with profiler.stage("draw_agraph", rows=G.number_of_edges()):
+            clicked = draw_agraph(G, node_counts, point_to_id, show_travel_time=show_travel_time, lod=lod)
+
+        # クラスタがクリックされたら、そのメンバーを個別に表示して描き直す
+        # （コンポーネントは最後にクリックされたノードを返し続けるので、同じクリックは 1 回だけ扱う）
+        if lod is not None and clicked in lod['clusters'] and clicked != st.session_state.get('lod_clicked'):
+            st.session_state.lod_clicked = clicked
+            st.session_state.lod_expanded = sorted(set(expanded) | set(lod['clusters'][clicked]), key=str)
+            st.rerun()
 
         # データの表示
         st.subheader("人流データ")
@@ -175,7 +550,11 @@ def main():
 
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("総ユーザー数", filtered_df['user_id'].nunique())
+            if total_users is None:
+                st.metric("総ユーザー数", filtered_df['user_id'].nunique())
+            else:
+                st.metric("総ユーザー数", f"≈ {total_users:,}",
+                          help=f"HyperLogLog による近似値（標準誤差 ±{standard_error(precision):.1%}）")
         with col2:
             st.metric("総スタンプ数", len(filtered_df))
         with col3:
@@ -183,70 +562,102 @@ def main():
 
         # ポイントごとの訪問者数
         st.subheader("ポイントごとの訪問者数")
-        st.dataframe(graph_data['nodes_data'])
+        # 表はサーバー側で検索・並べ替えし、表示するページの行だけをブラウザに送る
+        if precision is not None:
+            st.caption(f"訪問者数は HyperLogLog による近似値です（標準誤差 ±{standard_error(precision):.1%}、"
+                       f"約 95% の確率で ±{2 * standard_error(precision):.1%} 以内）")
+        show_table(graph_data['nodes_data'], key="nodes", cache=cache, data_key=count_key)
 
         # ポイント間の移動者数
         st.subheader("ポイント間の移動者数 (行:from. 列:to)")
-        st.dataframe(graph_data['edges_matrix'])
+        adjacency = analysis['adjacency']
+        matrix_page_size = 50
+        row_page, col_page = 0, 0
+        if adjacency.page_count(matrix_page_size) > 1:
+            # ポイントが多い場合は疎行列から表示する範囲だけを切り出す
+            page_col1, page_col2 = st.columns(2)
+            row_page = page_col1.number_input("行ページ", min_value=1, max_value=adjacency.page_count(matrix_page_size), value=1) - 1
+            col_page = page_col2.number_input("列ページ", min_value=1, max_value=adjacency.page_count(matrix_page_size), value=1) - 1
+        st.dataframe(adjacency.page(row_page, matrix_page_size, col_page, matrix_page_size))
+
+        # ポイント間の所要時間（隣り合うスタンプの時間差。中央値・90%点は誤差 2% 以内の近似）
+        st.subheader("ポイント間の所要時間")
+        show_table(graph_data['travel_times'], key="travel_times", cache=cache, data_key=filter_key)
+
+        # 複数ステップのルートと訪問順全体の上位
+        st.subheader("よく使われるルート")
+        route_col1, route_col2 = st.columns(2)
+        route_stops = int(route_col1.number_input("ルートのポイント数", min_value=2, max_value=8, value=3))
+        route_top = int(route_col2.number_input("表示する件数", min_value=1, max_value=100, value=10))
+
+        def make_routes():
+            with profiler.stage("routes", rows=len(filtered_df)):
+                return {
+                    'routes': routes_frame(mine_routes(filtered_df, route_stops, route_top)),
+                    'orders': routes_frame(visit_orders(filtered_df, route_top)),
+                }
+
+        routes_data = cache.get_or_compute("routes", content_key(filter_key, route_stops, route_top), make_routes)
+        st.dataframe(routes_data['routes'], hide_index=True)
+        with st.expander("訪問順（最初から最後まで）の上位"):
+            st.dataframe(routes_data['orders'], hide_index=True)
 
         st.subheader("利用したデータ")
-        st.dataframe(filtered_df)
-
-        # --- ダウンロード機能: フィルタ済データと表示している人流データを1つのCSVにまとめてダウンロード ---
-        def make_combined_csv(filtered_df, nodes_df, edges_df, analysis_time_str, total_users, total_stamps, total_moves):
-            # nodes_df と edges_df は pandas.DataFrame と仮定
-            parts = []
-
-            # --- Analysis summary ---
-            parts.append('# Analysis summary')
-            # 保存しやすいように key,value 形式のCSVを作る
-            summary_df = pd.DataFrame([
-                ["analysis_time", analysis_time_str],
-                ["total_users", total_users],
-                ["total_stamps", total_stamps],
-                ["total_moves", total_moves]
-            ], columns=["metric", "value"])
-            parts.append(summary_df.to_csv(index=False))
-
-            # nodes data セクション
-            parts.append('# Nodes (ポイントごとの訪問者数)')
-            parts.append(nodes_df.to_csv(index=False))
-
-            # edges matrix セクション
-            parts.append('\n# Edges (ポイント間の移動者数 行:from 列:to)')
-            # edges_df をそのままCSV化（indexを含める）
-            parts.append(edges_df.to_csv())
-
-            # 元データ（フィルタ済）セクション
-            parts.append('\n# Filtered raw data (利用したデータ)')
-            parts.append(filtered_df.to_csv(index=False))
-
-            # 結合してバイト列に変換（Excelで開いて文字化けしないようにBOM付きUTF-8にする）
-            csv_text = "\n".join(parts)
-            return csv_text.encode('utf-8-sig')
-
-        try:
-            nodes_df = graph_data.get('nodes_data') if 'graph_data' in locals() else None
-            edges_df = graph_data.get('edges_matrix') if 'graph_data' in locals() else None
-            # 分析サマリ値を計算
-            analysis_time_str = f"{start_time.strftime('%H:%M:%S')} から {end_time.strftime('%H:%M:%S')}"
+        show_table(filtered_df, key="filtered", cache=cache, data_key=filter_key)
+
+        if render_in_background:
+            show_graph_image()
+
+        # --- ダウンロード機能: フィルタ済データと表示している人流データをまとめてダウンロード ---
+        # ファイルはボタンが押されたときにだけ、行を少しずつ書き出して作る（密なエッジ表も行単位で作る）
+        nodes_df = graph_data['nodes_data']
+        adjacency = analysis['adjacency']
+        travel_df = graph_data['travel_times']
+        # 分析サマリ値を計算
+        analysis_time_str = f"{start_time.strftime('%H:%M:%S')} から {end_time.strftime('%H:%M:%S')}"
+        if total_users is None:
             total_users = int(filtered_df['user_id'].nunique())
-            total_stamps = int(len(filtered_df))
-            total_moves = int(G.number_of_edges())
-
-            if nodes_df is not None and edges_df is not None:
-                csv_bytes = make_combined_csv(filtered_df, nodes_df, edges_df, analysis_time_str, total_users, total_stamps, total_moves)
-                st.download_button(
-                    label="CSVをダウンロード（人流データ＋利用データ）",
-                    data=csv_bytes,
-                    file_name="stamprally_combined.csv",
-                    mime="text/csv"
-                )
-            else:
-                # 万が一 graph_data が無い場合はダウンロードを出さない
-                st.info("ダウンロード可能な人流データがまだ生成されていません。")
-        except Exception as e:
-            st.error(f"ダウンロード用CSV生成中にエラーが発生しました: {e}")
+        total_stamps = int(len(filtered_df))
+        total_moves = int(adjacency.nnz)
+
+        export_options = {"CSV（1ファイル）": None, "ZIP（セクションごとのCSV）": "csv"}
+        if importlib.util.find_spec("pyarrow") is not None:
+            export_options["ZIP（セクションごとのParquet）"] = "parquet"
+        export_choice = st.radio("ダウンロード形式", options=list(export_options), horizontal=True)
+        bundle_format = export_options[export_choice]
+
+        def build_export():
+            # 一時ファイルに書き出して渡す（st.download_button は受け取ったファイルを 1 回だけ読み込んで保持する）
+            with profiler.stage("export", rows=len(filtered_df)):
+                if bundle_format is None:
+                    return spool_export(write_combined_csv, filtered_df, nodes_df, adjacency, analysis_time_str,
+                                        total_users, total_stamps, total_moves, travel_df=travel_df)
+                return spool_export(write_export_bundle, filtered_df, nodes_df, adjacency, analysis_time_str,
+                                    total_users, total_stamps, total_moves, file_format=bundle_format,
+                                    travel_df=travel_df)
+
+        if bundle_format is None:
+            st.download_button(
+                label="CSVをダウンロード（人流データ＋利用データ）",
+                data=build_export,
+                file_name="stamprally_combined.csv",
+                mime="text/csv"
+            )
+        else:
+            st.download_button(
+                label="ZIPをダウンロード（人流データ＋利用データ）",
+                data=build_export,
+                file_name=f"stamprally_export_{bundle_format}.zip",
+                mime="application/zip"
+            )
+
+    if profile_enabled:
+        show_profile(profiler, analysis['profiler'])
+
+    # キャッシュの利用状況
+    stats = cache.stats()
+    st.sidebar.caption(f"キャッシュ: ヒット {stats['hits'] + stats['disk_hits']} / ミス {stats['misses']}"
+                       f"（{stats['entries']} 件, {stats['bytes'] / 1024 / 1024:.1f} MB）")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+"""パイプラインの各段階の処理時間とメモリ使用量を計測する。
+
+    python benchmarks/bench_pipeline.py --scales 10000,100000,1000000
+    python benchmarks/bench_pipeline.py --save-baseline      # 基準値を更新
+    python benchmarks/bench_pipeline.py --compare            # 基準値と比較（悪化したら終了コード 1）
+
+データは src.synthetic で決まった乱数から作るので、同じ規模なら毎回同じ入力になる。
+"""
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import argparse
+import datetime
+import gc
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from src.adjacency import SparseAdjacency
+from src.export import make_combined_csv
+from src.ingest import load_stamps
+from src.layout import compute_layout
+from src.stamprally_analyze import build_graph
+from src.stamprally_render import draw_graph
+from src.stream_ingest import stream_counts
+from src.synthetic import write_stamp_log_csv
+from src.time_filter import build_time_index, time_filter_mask
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+MEAN_STAMPS = 5.0
+N_POINTS = 30
+# これより短い処理時間の差は計測誤差として扱う
+NOISE_FLOOR_SEC = 0.05
+
+
+def _read_csv(ctx):
+    ctx["df"] = pd.read_csv(ctx["path"])
+    return len(ctx["df"])
+
+
+def _to_datetime(ctx):
+    ctx["df"]["timestamp"] = pd.to_datetime(ctx["df"]["timestamp"], errors="coerce")
+    return len(ctx["df"])
+
+
+def _read_stamps(ctx):
+    # アプリと同じ読み込み（pyarrow エンジン・書式の判定・カテゴリ型と Arrow 形式での保存）。
+    # read_csv + to_datetime と比べる
+    ctx["arrow_key"] = f"bench-{time.perf_counter_ns()}"
+    return len(load_stamps(ctx["path"], cache_dir=_arrow_dir(ctx), key=ctx["arrow_key"])["df"])
+
+
+def _load_arrow(ctx):
+    # 同じファイルをもう一度開いた場合（保存した Arrow 形式をメモリマップで読み込む）
+    return len(load_stamps(ctx["path"], cache_dir=_arrow_dir(ctx), key=ctx["arrow_key"])["df"])
+
+
+def _arrow_dir(ctx):
+    return os.path.join(os.path.dirname(ctx["path"]), "datasets")
+
+
+def _time_index(ctx):
+    ctx["time_index"] = build_time_index(ctx["df"]["timestamp"])
+    return len(ctx["df"])
+
+
+def _filter(ctx):
+    mask = time_filter_mask(ctx["time_index"], datetime.time(10, 0), datetime.time(15, 0), [5, 6])
+    ctx["filtered_df"] = ctx["df"][mask]
+    return len(ctx["filtered_df"])
+
+
+def _build_graph(ctx):
+    G, node_counts, point_to_id, counts = build_graph(ctx["filtered_df"], return_counts=True)
+    ctx["graph"] = (G, node_counts, point_to_id)
+    ctx["adjacency"] = SparseAdjacency.from_counts(counts)
+    return len(ctx["filtered_df"])
+
+
+def _layout(ctx):
+    ctx["pos"] = compute_layout(ctx["graph"][0])
+    return ctx["graph"][0].number_of_nodes()
+
+
+def _draw_graph(ctx):
+    G, node_counts, point_to_id = ctx["graph"]
+    ctx["graph_data"] = draw_graph(G, node_counts, point_to_id, pos=ctx["pos"])
+    return G.number_of_edges()
+
+
+def _export_csv(ctx):
+    filtered_df = ctx["filtered_df"]
+    data = make_combined_csv(filtered_df, ctx["graph_data"]["nodes_data"], ctx["adjacency"].to_frame(),
+                             "10:00:00 から 15:00:00", int(filtered_df["user_id"].nunique()), len(filtered_df),
+                             ctx["adjacency"].nnz)
+    return len(data)
+
+
+def _stream_counts(ctx):
+    counts = stream_counts(ctx["path"])
+    return int(counts["edge_weight"].sum())
+
+
+STAGES = [
+    ("read_csv", _read_csv),
+    ("to_datetime", _to_datetime),
+    ("read_stamps", _read_stamps),
+    ("load_arrow", _load_arrow),
+    ("time_index", _time_index),
+    ("filter", _filter),
+    ("build_graph", _build_graph),
+    ("layout", _layout),
+    ("draw_graph", _draw_graph),
+    ("export_csv", _export_csv),
+    ("stream_counts", _stream_counts),
+]
+
+
+def run_scale(rows, repeat=1, memory=True, tmp_dir=None):
+    """rows 行程度のデータで全段階を実行し、段階ごとの結果を返す。"""
+    results = {}
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        path = os.path.join(work_dir, "stamps.csv")
+        n_rows = write_stamp_log_csv(path, n_users=max(1, int(rows / MEAN_STAMPS)), n_points=N_POINTS,
+                                     mean_stamps=MEAN_STAMPS, seed=0)
+
+        # 処理時間: repeat 回のうち最速の値
+        timings = {name: float("inf") for name, _ in STAGES}
+        for _ in range(repeat):
+            ctx = {"path": path}
+            for name, stage in STAGES:
+                gc.collect()
+                start = time.perf_counter()
+                items = stage(ctx)
+                timings[name] = min(timings[name], time.perf_counter() - start)
+                results[name] = {"items": items}
+
+        # ピークメモリ: tracemalloc は処理を遅くするので、時間とは別に計測する
+        if memory:
+            ctx = {"path": path}
+            for name, stage in STAGES:
+                gc.collect()
+                tracemalloc.start()
+                stage(ctx)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results[name]["peak_mb"] = round(peak / 1024 / 1024, 2)
+
+        for name, seconds in timings.items():
+            results[name]["seconds"] = round(seconds, 4)
+    return {"rows": n_rows, "stages": results}
+
+
+def compare(current, baseline, tolerance):
+    """基準値より tolerance 倍を超えて悪化した段階を列挙する。"""
+    regressions = []
+    for scale, result in current["scales"].items():
+        base = baseline.get("scales", {}).get(scale)
+        if base is None:
+            continue
+        for name, stage in result["stages"].items():
+            base_stage = base["stages"].get(name)
+            if base_stage is None:
+                continue
+            slower = stage["seconds"] > base_stage["seconds"] * tolerance
+            if slower and stage["seconds"] - base_stage["seconds"] > NOISE_FLOOR_SEC:
+                regressions.append((scale, name, "seconds", base_stage["seconds"], stage["seconds"]))
+            if "peak_mb" in stage and "peak_mb" in base_stage and stage["peak_mb"] > base_stage["peak_mb"] * tolerance + 1:
+                regressions.append((scale, name, "peak_mb", base_stage["peak_mb"], stage["peak_mb"]))
+    return regressions
+
+
+def format_table(report):
+    lines = [f"{'scale':>10} {'stage':<14} {'seconds':>9} {'peak MB':>9} {'items':>10}"]
+    for scale, result in report["scales"].items():
+        for name, stage in result["stages"].items():
+            peak = stage.get("peak_mb", float("nan"))
+            lines.append(f"{scale:>10} {name:<14} {stage['seconds']:>9.4f} {peak:>9.2f} {stage['items']:>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default=",".join(str(s) for s in DEFAULT_SCALES),
+                        help="計測する行数（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=1, help="処理時間を計測する回数（最速の値を採用）")
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリを計測しない")
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準値の JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--compare", action="store_true", help="基準値と比較し、悪化していれば終了コード 1 を返す")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="悪化とみなす倍率")
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "scales": {},
+    }
+    for rows in (int(s) for s in args.scales.split(",") if s):
+        report["scales"][str(rows)] = run_scale(rows, repeat=args.repeat, memory=not args.no_memory)
+    print(format_table(report))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for scale, name, metric, before, after in regressions:
+            print(f"REGRESSION scale={scale} stage={name} {metric}: {before} -> {after}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
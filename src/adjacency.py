@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class SparseAdjacency:
+    """ポイント間の移動者数を CSR 形式の疎行列で保持する。
+
+    行・列の並びは points の順（グラフのノード順）。メモリは遷移の種類数に比例し、
+    密な表や networkx のグラフは to_frame / to_networkx で必要なときだけ作る。
+    """
+
+    def __init__(self, points, matrix):
+        self.points = np.asarray(points)
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.int64)
+
+    @classmethod
+    def from_edges(cls, points, src, dst, weights):
+        n = len(points)
+        matrix = sparse.coo_matrix((np.asarray(weights, dtype=np.int64), (src, dst)), shape=(n, n))
+        return cls(points, matrix.tocsr())
+
+    @classmethod
+    def from_counts(cls, counts):
+        # count_transitions の結果から作る（行・列は出現順）
+        order = counts["node_order"]
+        position = np.full(len(counts["points"]), -1, dtype=np.int64)
+        position[order] = np.arange(len(order))
+        return cls.from_edges(counts["points"][order], position[counts["edge_from"]],
+                              position[counts["edge_to"]], counts["edge_weight"])
+
+    @classmethod
+    def from_graph(cls, G):
+        points = list(G.nodes())
+        code = {p: i for i, p in enumerate(points)}
+        edges = list(G.edges(data="weight", default=1))
+        src = np.fromiter((code[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+        dst = np.fromiter((code[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((w for _, _, w in edges), dtype=np.int64, count=len(edges))
+        return cls.from_edges(points, src, dst, weights)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    @property
+    def nbytes(self):
+        """ポイント名と疎行列の配列のバイト数（キャッシュ容量の見積もりに使う）。"""
+        matrix = self.matrix
+        return int(self.points.nbytes + matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes)
+
+    def edges(self):
+        """(From, To, 移動者数) の縦持ちの表を返す。"""
+        coo = self.matrix.tocoo()
+        return pd.DataFrame({
+            'From': self.points[coo.row],
+            'To': self.points[coo.col],
+            '移動者数': coo.data,
+        })
+
+    def to_networkx(self):
+        import networkx as nx
+
+        G = nx.DiGraph()
+        G.add_nodes_from(self.points)
+        coo = self.matrix.tocoo()
+        G.add_weighted_edges_from(zip(self.points[coo.row], self.points[coo.col], coo.data.tolist()))
+        return G
+
+    def to_frame(self):
+        """行:from 列:to の密な表を返す（ポイント数の 2 乗のメモリを使う）。"""
+        return self.page(0, page_size=max(len(self.points), 1), col_page=0, col_page_size=max(len(self.points), 1))
+
+    def page(self, page, page_size=50, col_page=0, col_page_size=50):
+        """行・列をページ単位で切り出した密な表を返す。"""
+        rows = slice(page * page_size, (page + 1) * page_size)
+        cols = slice(col_page * col_page_size, (col_page + 1) * col_page_size)
+        block = self.matrix[rows, cols].toarray()
+        return pd.DataFrame(block, index=pd.Index(self.points[rows]), columns=pd.Index(self.points[cols]))
+
+    def page_count(self, page_size=50):
+        return max(1, -(-len(self.points) // page_size))
@@ -0,0 +1,313 @@
+"""Streamlit を使わずに、複数の CSV × 時刻範囲 × 曜日の組み合わせをまとめて分析する。
+
+    python -m src.batch data/ out/ --time 09:00-12:00 --time 13:00-17:00 --weekdays all --weekdays sat,sun
+    python -m src.batch data/ out/ --image png --combined --workers 8
+    python -m src.batch daily/ out/ --shards
+
+出力は out/<CSVファイル名>/<時刻範囲>_<曜日>/ に nodes.csv（ポイントごとの訪問者数）、
+edges.csv（ポイント間の移動者数）、travel_times.csv（所要時間）、必要なら graph.png / graph.svg と combined.csv を書き、
+全ジョブの一覧を out/summary.csv にまとめる。
+--shards を付けると、ディレクトリ内の CSV（日ごとのファイルなど）を 1 つのデータとして扱い、
+出力は out/<ディレクトリ名>/ に書く。
+
+処理は 2 段階に分けてプロセスプールで並列に行う。
+1. CSV ごとに 1 回だけ読み込み、DataFrame と時刻索引を pickle で作業ディレクトリに置き、全期間のノード座標を求める
+   （--shards でもシャードの CSV はそれぞれ別のタスクで読み込む）
+2. 各ジョブはその pickle を読み込んで（プロセス内でも使い回す）フィルタと集計だけを行う。
+   シャードはシャードごとにフィルタして部分集計を作り、src.shards.merge_partials で合併する
+CSV の解析はファイル数分しか行われず、ジョブ数が多いほどコア数に応じて速くなる。
+"""
+import argparse
+import datetime
+import os
+import pickle
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from src.adjacency import SparseAdjacency
+from src.export import write_combined_csv
+from src.ingest import read_stamps
+from src.layout import compute_layout
+from src.shards import OverlappingShardsError, merge_partials, shard_partial, shard_paths
+from src.stamprally_analyze import build_graph, count_transitions, graph_from_counts
+from src.time_filter import build_time_index, time_filter_mask
+from src.travel_time import travel_time_frame
+
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# プロセスごとに読み込んだデータセット（pickle のパス、シャードはパスのタプル → データ）。直近のものだけ残す
+_DATASET_CACHE_SIZE = 2
+_loaded = {}
+
+
+def parse_time_range(text):
+    """'09:00-12:00' を (datetime.time, datetime.time) にする。終了時刻も範囲に含む。"""
+    start, sep, end = text.partition("-")
+    if not sep:
+        raise ValueError(f"時刻範囲は 'HH:MM-HH:MM' の形式で指定してください: {text!r}")
+    return datetime.time.fromisoformat(start.strip()), datetime.time.fromisoformat(end.strip())
+
+
+def parse_weekdays(text):
+    """'all'、'5,6'、'sat,sun' のような指定を曜日番号（月曜=0）のリストにする。'all' は空リスト。"""
+    text = text.strip().lower()
+    if text in ("", "all"):
+        return []
+    days = set()
+    for item in text.split(","):
+        item = item.strip()
+        if item.isdigit() and 0 <= int(item) <= 6:
+            days.add(int(item))
+        elif item[:3] in WEEKDAY_NAMES:
+            days.add(WEEKDAY_NAMES.index(item[:3]))
+        else:
+            raise ValueError(f"曜日を解釈できません: {item!r}")
+    return sorted(days)
+
+
+def job_label(start_time, end_time, weekdays):
+    """出力ディレクトリ名（例: '0900-1200_sat-sun'）。"""
+    days = "-".join(WEEKDAY_NAMES[d] for d in weekdays) if weekdays else "all"
+    return f"{start_time.strftime('%H%M')}-{end_time.strftime('%H%M')}_{days}"
+
+
+def load_stamp_csv(path):
+    """CSV を読み込み、timestamp を日時に変換した DataFrame を返す。必要な列が無ければ ValueError。
+
+    読み込めない行は除く（src.ingest.read_stamps を参照）。
+    """
+    return read_stamps(path)["df"]
+
+
+def _prepare(path, work_dir, with_layout, shard=False):
+    # 第 1 段階: CSV を解析して作業ディレクトリに保存する
+    try:
+        df = load_stamp_csv(path)
+    except ValueError as e:
+        return {"path": path, "error": str(e)}
+    dataset = {"df": df, "time_index": build_time_index(df["timestamp"])}
+    fd, cache_path = tempfile.mkstemp(suffix=".pkl", dir=work_dir)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(dataset, f, protocol=pickle.HIGHEST_PROTOCOL)
+    item = {"path": path, "dataset": cache_path, "pos": None}
+    if with_layout and shard:
+        # シャードの座標は全シャードの部分集計を合併してから決める
+        item["partial"] = shard_partial(df)
+    elif with_layout:
+        # 全期間のグラフで座標を決めておくと、どの条件の画像でもポイントの位置がそろう
+        item["pos"] = compute_layout(build_graph(df)[0])
+    return item
+
+
+def _combine_prepared(paths, prepared, with_layout):
+    # シャードごとに準備した結果を、指定されたデータセット（CSV またはシャードのリスト）の単位にまとめる
+    prepared = iter(prepared)
+    for path in paths:
+        if not isinstance(path, (list, tuple)):
+            yield next(prepared)
+            continue
+        items = [next(prepared) for _ in path]
+        errors = [item["error"] for item in items if "error" in item]
+        if errors:
+            yield {"path": path, "error": errors[0]}
+            continue
+        cache_paths = [item["dataset"] for item in items]
+        pos = None
+        if with_layout:
+            try:
+                counts = merge_partials([item["partial"] for item in items])
+            except OverlappingShardsError:
+                counts = count_transitions(pd.concat([_read_pickle(p)["df"] for p in cache_paths],
+                                                     ignore_index=True))
+            pos = compute_layout(graph_from_counts(counts)[0])
+        yield {"path": path, "dataset": cache_paths, "pos": pos}
+
+
+def _read_pickle(cache_path):
+    with open(cache_path, "rb") as f:
+        return pickle.load(f)
+
+
+def _load(dataset_ref):
+    # dataset_ref が pickle のパスのリスト（シャード）なら、データセットのリストを 1 つの項目として残す
+    key = tuple(dataset_ref) if isinstance(dataset_ref, list) else dataset_ref
+    dataset = _loaded.get(key)
+    if dataset is None:
+        if isinstance(dataset_ref, list):
+            dataset = [_read_pickle(p) for p in dataset_ref]
+        else:
+            dataset = _read_pickle(dataset_ref)
+        _loaded[key] = dataset
+        while len(_loaded) > _DATASET_CACHE_SIZE:
+            _loaded.pop(next(iter(_loaded)))
+    return dataset
+
+
+def _filter_and_count(shards, start_time, end_time, weekdays):
+    # シャードごとにフィルタして部分集計を作り、合併する（重なりがあれば連結したデータから数え直す）
+    parts = [dataset["df"][time_filter_mask(dataset["time_index"], start_time, end_time, weekdays)]
+             for dataset in shards]
+    filtered_df = pd.concat(parts, ignore_index=True)
+    try:
+        counts = merge_partials([shard_partial(part) for part in parts])
+    except OverlappingShardsError:
+        counts = count_transitions(filtered_df)
+    return filtered_df, counts
+
+
+def dataset_name(path):
+    """出力ディレクトリ名。CSV はファイル名、シャードのリストは置かれたディレクトリ名。"""
+    if isinstance(path, (list, tuple)):
+        return os.path.basename(os.path.dirname(os.path.abspath(path[0])))
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def nodes_frame(G, node_counts):
+    """ポイントごとの訪問者数（アプリの表と同じ列・並び）。"""
+    return pd.DataFrame({
+        'ポイント': list(G.nodes()),
+        '訪問者数': [node_counts.get(n, 0) for n in G.nodes()]
+    }).sort_values('訪問者数', ascending=False)
+
+
+def run_job(job):
+    """第 2 段階: 1 つの条件でフィルタ・集計し、結果のファイルを書いてサマリの 1 行を返す。
+
+    書き込みや画像の描画に失敗しても例外は送出せず、error に理由を入れた行を返す（他のジョブは続ける）。
+    """
+    started = time.perf_counter()
+    start_time, end_time, weekdays = job["start_time"], job["end_time"], job["weekdays"]
+    row = {
+        "file": job["file"],
+        "label": job["label"],
+        "start_time": start_time.strftime("%H:%M:%S"),
+        "end_time": end_time.strftime("%H:%M:%S"),
+        "weekdays": ",".join(WEEKDAY_NAMES[d] for d in weekdays) or "all",
+    }
+    try:
+        row.update(_write_job(job))
+        row["error"] = ""
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["seconds"] = round(time.perf_counter() - started, 4)
+    return row
+
+
+def _write_job(job):
+    # run_job の本体。サマリの users・stamps・moves を返す
+    start_time, end_time, weekdays = job["start_time"], job["end_time"], job["weekdays"]
+
+    if isinstance(job["dataset"], list):
+        filtered_df, counts = _filter_and_count(_load(job["dataset"]), start_time, end_time, weekdays)
+    else:
+        dataset = _load(job["dataset"])
+        filtered_df = dataset["df"][time_filter_mask(dataset["time_index"], start_time, end_time, weekdays)]
+        counts = count_transitions(filtered_df)
+    adjacency = SparseAdjacency.from_counts(counts)
+    G, node_counts, point_to_id = graph_from_counts(counts)
+    nodes_df = nodes_frame(G, node_counts)
+
+    out_dir = job["out_dir"]
+    os.makedirs(out_dir, exist_ok=True)
+    nodes_df.to_csv(os.path.join(out_dir, "nodes.csv"), index=False, encoding="utf-8-sig")
+    adjacency.edges().to_csv(os.path.join(out_dir, "edges.csv"), index=False, encoding="utf-8-sig")
+    travel_df = travel_time_frame(G)
+    travel_df.to_csv(os.path.join(out_dir, "travel_times.csv"), index=False, encoding="utf-8-sig")
+
+    if job["image_format"] and G.number_of_nodes():
+        from src.stamprally_render import render_graph_image
+        pos = compute_layout(G, job["pos"])
+        image = render_graph_image(G, node_counts, point_to_id, pos, job["image_format"])
+        with open(os.path.join(out_dir, f"graph.{job['image_format']}"), "wb") as f:
+            f.write(image.getvalue())
+
+    total_users = int(filtered_df["user_id"].nunique())
+    if job["combined"]:
+        analysis_time_str = f"{start_time.strftime('%H:%M:%S')} から {end_time.strftime('%H:%M:%S')}"
+        with open(os.path.join(out_dir, "combined.csv"), "wb") as f:
+            write_combined_csv(f, filtered_df, nodes_df, adjacency, analysis_time_str,
+                               total_users, len(filtered_df), adjacency.nnz, travel_df=travel_df)
+
+    return {"users": total_users, "stamps": len(filtered_df), "moves": adjacency.nnz}
+
+
+def run_batch(paths, out_dir, time_ranges, weekday_sets, image_format=None, combined=False,
+              workers=None, work_dir=None):
+    """paths の各 CSV（CSV のパスのリストはシャードを連結した 1 つのデータ）について time_ranges × weekday_sets の全組み合わせを実行し、サマリの DataFrame を返す。"""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp, ProcessPoolExecutor(max_workers=workers) as pool:
+        # シャードのリストも 1 ファイルずつ別のタスクで解析する
+        files = [(p, True) if isinstance(path, (list, tuple)) else (p, False)
+                 for path in paths for p in (path if isinstance(path, (list, tuple)) else [path])]
+        prepared = _combine_prepared(paths, pool.map(
+            _prepare, [f for f, _ in files], [tmp] * len(files), [bool(image_format)] * len(files),
+            [shard for _, shard in files]), bool(image_format))
+
+        jobs = []
+        for item in prepared:
+            name = dataset_name(item["path"])
+            if "error" in item:
+                rows.append({"file": name, "error": item["error"]})
+                continue
+            for start_time, end_time in time_ranges:
+                for weekdays in weekday_sets:
+                    label = job_label(start_time, end_time, weekdays)
+                    jobs.append({
+                        "file": name, "label": label, "dataset": item["dataset"], "pos": item["pos"],
+                        "start_time": start_time, "end_time": end_time, "weekdays": weekdays,
+                        "out_dir": os.path.join(out_dir, name, label),
+                        "image_format": image_format, "combined": combined,
+                    })
+
+        # ジョブはファイル順に並んでいるので、まとめて渡すと同じプロセスが同じデータを使い回せる
+        chunksize = max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))
+        rows.extend(pool.map(run_job, jobs, chunksize=chunksize))
+
+    summary = pd.DataFrame(rows, columns=["file", "label", "start_time", "end_time", "weekdays",
+                                          "users", "stamps", "moves", "seconds", "error"])
+    summary.to_csv(os.path.join(out_dir, "summary.csv"), index=False, encoding="utf-8-sig")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV ファイル、または CSV を置いたディレクトリ")
+    parser.add_argument("output", help="結果を書き出すディレクトリ")
+    parser.add_argument("--time", action="append", dest="times", metavar="HH:MM-HH:MM",
+                        help="分析対象時刻範囲（複数指定可、既定は終日）")
+    parser.add_argument("--weekdays", action="append", metavar="DAYS",
+                        help="分析対象曜日（'all'、'5,6'、'sat,sun' など。複数指定可、既定は all）")
+    parser.add_argument("--image", choices=["png", "svg"], help="グラフ画像も書き出す")
+    parser.add_argument("--combined", action="store_true", help="アプリと同じ形式の combined.csv も書き出す")
+    parser.add_argument("--shards", action="store_true",
+                        help="ディレクトリ内の CSV を日ごとなどに分かれた 1 つのデータとして扱う")
+    parser.add_argument("--workers", type=int, help="プロセス数（既定は CPU コア数）")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.input):
+        paths = shard_paths(args.input)
+    else:
+        paths = [args.input]
+    if not paths:
+        parser.error(f"CSV ファイルが見つかりません: {args.input}")
+    if args.shards:
+        paths = [paths]
+
+    try:
+        time_ranges = [parse_time_range(t) for t in (args.times or ["00:00:00-23:59:59"])]
+        weekday_sets = [parse_weekdays(w) for w in (args.weekdays or ["all"])]
+    except ValueError as e:
+        parser.error(str(e))
+
+    summary = run_batch(paths, args.output, time_ranges, weekday_sets, image_format=args.image,
+                        combined=args.combined, workers=args.workers)
+    print(summary.to_string(index=False))
+    return 1 if summary["error"].fillna("").astype(bool).any() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import codecs
+import io
+import os
+import tempfile
+import zipfile
+
+import pandas as pd
+
+# 1 回に CSV へ変換する行数（これ以上の行をまとめて文字列にしない）
+EXPORT_CHUNK_ROWS = 50_000
+BUNDLE_FORMATS = ("csv", "parquet")
+
+
+def _datetime_format(df):
+    # 日時の表記は pandas が列全体を見て決める（全て 0 時なら日付のみ、など）。
+    # チャンクごとに決めさせると表記が揺れるので、先に列全体で書式を決めておく
+    formats = set()
+    for _, s in df.select_dtypes(include=["datetime"]).items():
+        values = s.dropna()
+        if values.empty:
+            continue
+        if (values == values.dt.normalize()).all():
+            formats.add("%Y-%m-%d")
+        elif (values.dt.microsecond != 0).any() or (values.dt.nanosecond != 0).any():
+            formats.add("%Y-%m-%d %H:%M:%S.%f")
+        else:
+            formats.add("%Y-%m-%d %H:%M:%S")
+    return formats.pop() if len(formats) == 1 else None
+
+
+def _iter_frames(df, chunk_rows):
+    if len(df) == 0:
+        yield df
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _iter_matrix(edges, chunk_rows):
+    # edges は密な DataFrame か SparseAdjacency。疎行列なら行ごとに必要な分だけ密にする
+    if isinstance(edges, pd.DataFrame):
+        yield from _iter_frames(edges, chunk_rows)
+        return
+    n = max(len(edges.points), 1)
+    for page in range(edges.page_count(chunk_rows)):
+        yield edges.page(page, chunk_rows, 0, n)
+
+
+def _sections(filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps, total_moves, chunk_rows,
+              travel_df=None):
+    # (ファイル名, 見出し, index を書くか, DataFrame のチャンクを返す関数)
+    summary_df = pd.DataFrame([
+        ["analysis_time", analysis_time_str],
+        ["total_users", total_users],
+        ["total_stamps", total_stamps],
+        ["total_moves", total_moves]
+    ], columns=["metric", "value"])
+    sections = [
+        ("summary", "# Analysis summary", False, lambda: iter([summary_df])),
+        ("nodes", "# Nodes (ポイントごとの訪問者数)", False, lambda: _iter_frames(nodes_df, chunk_rows)),
+        ("edges", "\n# Edges (ポイント間の移動者数 行:from 列:to)", True, lambda: _iter_matrix(edges, chunk_rows)),
+    ]
+    if travel_df is not None:
+        sections.append(("travel_times", "\n# Travel times (ポイント間の所要時間)", False,
+                         lambda: _iter_frames(travel_df, chunk_rows)))
+    sections.append(("filtered_data", "\n# Filtered raw data (利用したデータ)", False,
+                     lambda: _iter_frames(filtered_df, chunk_rows)))
+    return sections
+
+
+def _iter_csv_text(frames, index, date_format):
+    for i, chunk in enumerate(frames):
+        yield chunk.to_csv(index=index, header=(i == 0), date_format=date_format)
+
+
+def iter_combined_csv(filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps, total_moves,
+                      chunk_rows=EXPORT_CHUNK_ROWS, travel_df=None):
+    """make_combined_csv と同じ内容を、chunk_rows 行ずつのバイト列として順に返す。
+
+    edges には密な DataFrame のほか SparseAdjacency も渡せる（密な表は chunk_rows 行ずつ作る）。
+    travel_df（所要時間の表）を渡すと、エッジの後にそのセクションを加える。
+    """
+    # Excelで開いて文字化けしないようにBOM付きUTF-8にする
+    yield codecs.BOM_UTF8
+    date_format = _datetime_format(filtered_df)
+    sections = _sections(filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps,
+                         total_moves, chunk_rows, travel_df)
+    for i, (_, heading, index, frames) in enumerate(sections):
+        yield (("\n" if i else "") + heading + "\n").encode("utf-8")
+        for text in _iter_csv_text(frames(), index, date_format):
+            yield text.encode("utf-8")
+
+
+def write_combined_csv(f, filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps, total_moves,
+                       chunk_rows=EXPORT_CHUNK_ROWS, travel_df=None):
+    """iter_combined_csv の内容をバイナリファイル f に順に書く。"""
+    for chunk in iter_combined_csv(filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps,
+                                   total_moves, chunk_rows, travel_df):
+        f.write(chunk)
+
+
+def make_combined_csv(filtered_df, nodes_df, edges_df, analysis_time_str, total_users, total_stamps, total_moves,
+                      travel_df=None):
+    """分析サマリ・ノード・エッジ・フィルタ済データを 1 つの CSV（BOM 付き UTF-8 のバイト列）にまとめる。"""
+    return b"".join(iter_combined_csv(filtered_df, nodes_df, edges_df, analysis_time_str,
+                                      total_users, total_stamps, total_moves, travel_df=travel_df))
+
+
+def _write_parquet_section(f, frames, index):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in frames:
+            # Parquet の列名は文字列、列の型は 1 つに揃える必要がある
+            chunk = chunk.rename(columns=str)
+            if "value" in chunk.columns and chunk["value"].dtype == object:
+                chunk = chunk.astype({"value": str})
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=index)
+                writer = pq.ParquetWriter(f, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=index)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_export_bundle(f, filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps, total_moves,
+                        file_format="csv", chunk_rows=EXPORT_CHUNK_ROWS, travel_df=None):
+    """セクションごとに 1 ファイル（summary / nodes / edges / [travel_times] / filtered_data）の ZIP を f に書く。
+
+    file_format は "csv"（BOM 付き UTF-8）か "parquet"（pyarrow が必要）。
+    各ファイルは chunk_rows 行ずつ圧縮しながら書くので、全体を一度にメモリに載せない。
+    """
+    if file_format not in BUNDLE_FORMATS:
+        raise ValueError(f"file_format は {BUNDLE_FORMATS} のいずれかです: {file_format!r}")
+    date_format = _datetime_format(filtered_df)
+    sections = _sections(filtered_df, nodes_df, edges, analysis_time_str, total_users, total_stamps,
+                         total_moves, chunk_rows, travel_df)
+    with zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, _, index, frames in sections:
+            with zf.open(f"{name}.{file_format}", "w", force_zip64=True) as entry:
+                if file_format == "parquet":
+                    _write_parquet_section(entry, frames(), index)
+                    continue
+                entry.write(codecs.BOM_UTF8)
+                for text in _iter_csv_text(frames(), index, date_format):
+                    entry.write(text.encode("utf-8"))
+
+
+class _TemporaryFileReader(io.BufferedReader):
+    # 閉じたら（参照が無くなったら）一時ファイルを消す。Windows では開いている間は消せないので閉じてから消す
+    def close(self):
+        super().close()
+        try:
+            os.remove(self.name)
+        except OSError:
+            pass
+
+
+def spool_export(write, *args, **kwargs):
+    """write(f, *args, **kwargs)（write_combined_csv など）で一時ファイルに書き出し、先頭から読むファイルを返す。
+
+    書き出した内容はメモリに溜めずにディスクに置く。返したファイルを閉じると一時ファイルも消える。
+    """
+    fd, path = tempfile.mkstemp(prefix="stamprally_export_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f, *args, **kwargs)
+        return _TemporaryFileReader(io.FileIO(path, "rb"))
+    except BaseException:
+        os.remove(path)
+        raise
@@ -0,0 +1,127 @@
+"""インタラクティブ表示（streamlit_agraph）用にグラフを簡略化する。
+
+ポイント・遷移が多いとブラウザ側（vis.js）の描画と力学計算が重くなるため、
+訪問者数の多いポイントだけを個別に表示し、残りは座標の近いものどうしをクラスタにまとめる。
+エッジはクラスタ単位に合算したうえで、移動数の多いものから max_edges 本だけ残す。
+座標は計算済みのレイアウトから画面の座標（ピクセル）に変換して渡す。
+"""
+import math
+
+import numpy as np
+
+CLUSTER_PREFIX = "cluster:"
+# 個別に表示するポイント数・表示するエッジ数・クラスタ数の既定値
+DEFAULT_MAX_NODES = 50
+DEFAULT_MAX_EDGES = 200
+DEFAULT_MAX_CLUSTERS = 16
+
+
+def _cluster_id(cell, taken):
+    # ポイント名と重ならないクラスタのID
+    cluster_id = f"{CLUSTER_PREFIX}{cell}"
+    while cluster_id in taken:
+        cluster_id += "#"
+    return cluster_id
+
+
+def _grid_cells(coords, n_cells):
+    # 座標を g×g の格子に分け、各点が入るマス目の番号を返す
+    g = max(1, math.ceil(math.sqrt(n_cells)))
+    low, high = coords.min(axis=0), coords.max(axis=0)
+    span = np.where(high > low, high - low, 1.0)
+    ij = np.minimum(((coords - low) / span * g).astype(np.int64), g - 1)
+    return ij[:, 0] * g + ij[:, 1]
+
+
+def screen_positions(pos, nodes, size=600):
+    """レイアウトの座標を、中心が原点で一辺 size ピクセルに収まる画面座標にする（y は下向き）。"""
+    coords = np.array([pos[n] for n in nodes], dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return {}
+    center = (coords.min(axis=0) + coords.max(axis=0)) / 2
+    extent = float((coords.max(axis=0) - coords.min(axis=0)).max()) or 1.0
+    scaled = (coords - center) / extent * size
+    return {n: (float(x), float(-y)) for n, (x, y) in zip(nodes, scaled)}
+
+
+def reduce_graph(G, node_counts, pos, max_nodes=DEFAULT_MAX_NODES, max_edges=DEFAULT_MAX_EDGES,
+                 max_clusters=DEFAULT_MAX_CLUSTERS, expanded=()):
+    """表示用に簡略化したグラフを返す。
+
+    訪問者数の多い max_nodes 個のポイントと expanded に含まれるポイントは個別に表示し、
+    残りは座標の格子（最大 max_clusters マス）ごとに 1 つのクラスタにまとめる。
+
+    戻り値の dict:
+        nodes    : 表示するノードのリスト。各要素は id, label, count, members, x, y を持つ dict
+                   （count はクラスタの場合メンバーの訪問者数の合計）
+        edges    : (from, to, 属性の dict) のリスト。移動数の降順で最大 max_edges 本
+        clusters : クラスタのID → メンバーのポイント名のリスト
+        hidden_edges : 省略したエッジの本数（クラスタ内の移動を含む）
+    """
+    nodes = list(G.nodes())
+    expanded = set(expanded)
+    ranked = sorted(nodes, key=lambda n: -node_counts.get(n, 0))
+    shown = set(ranked[:max_nodes]) | (expanded & set(nodes))
+    low = [n for n in nodes if n not in shown]
+
+    # 個別に表示しないポイントを、座標の近いものどうしでまとめる（1 個だけのマスはそのまま表示）
+    representative = {n: n for n in shown}
+    clusters = {}
+    if low:
+        cells = _grid_cells(np.array([pos[n] for n in low], dtype=np.float64), max_clusters)
+        members_of = {}
+        for n, cell in zip(low, cells.tolist()):
+            members_of.setdefault(cell, []).append(n)
+        taken = set(nodes)
+        for cell, members in sorted(members_of.items()):
+            if len(members) == 1:
+                representative[members[0]] = members[0]
+                continue
+            cluster_id = _cluster_id(cell, taken)
+            clusters[cluster_id] = members
+            for n in members:
+                representative[n] = cluster_id
+
+    screen = screen_positions(pos, nodes)
+    result_nodes = []
+    for n in nodes:
+        if representative[n] == n:
+            x, y = screen[n]
+            count = node_counts.get(n, 0)
+            result_nodes.append({"id": n, "label": f"{n}\n{count}人", "count": count,
+                                 "members": [n], "x": x, "y": y})
+    for cluster_id, members in clusters.items():
+        # クラスタはメンバーの訪問者数で重み付けした重心に置く
+        weights = np.array([max(node_counts.get(n, 0), 1) for n in members], dtype=np.float64)
+        xy = np.array([screen[n] for n in members]) * weights[:, None]
+        x, y = xy.sum(axis=0) / weights.sum()
+        count = int(sum(node_counts.get(n, 0) for n in members))
+        result_nodes.append({"id": cluster_id, "label": f"他 {len(members)} ポイント\n延べ {count}人",
+                             "count": count, "members": members, "x": float(x), "y": float(y)})
+
+    # エッジをクラスタ単位に合算する（クラスタ内の移動は表示しない）
+    merged = {}
+    for u, v, data in G.edges(data=True):
+        ru, rv = representative[u], representative[v]
+        if ru == rv and (ru != u or rv != v):
+            continue
+        merged.setdefault((ru, rv), []).append(data)
+
+    edges = []
+    for (u, v), parts in merged.items():
+        if len(parts) == 1:
+            data = dict(parts[0])
+        else:
+            # 平均所要時間は件数で重み付けして合算できるが、中央値・90%点は合算できない
+            travel_count = sum(d.get("travel_count", 0) for d in parts)
+            travel_total = sum(d["travel_mean"] * d["travel_count"] for d in parts if d.get("travel_count"))
+            data = {"weight": sum(d.get("weight", 0) for d in parts), "travel_count": travel_count,
+                    "travel_mean": travel_total / travel_count if travel_count else float("nan"),
+                    "travel_median": float("nan"), "travel_p90": float("nan")}
+        data["merged_edges"] = len(parts)
+        edges.append((u, v, data))
+    edges.sort(key=lambda e: -e[2].get("weight", 0))
+    edges = edges[:max_edges]
+
+    return {"nodes": result_nodes, "edges": edges, "clusters": clusters,
+            "hidden_edges": G.number_of_edges() - sum(d["merged_edges"] for _, _, d in edges)}
@@ -0,0 +1,200 @@
+"""スタンプの CSV の読み込み。
+
+pyarrow があれば pyarrow エンジンで読み込み、timestamp の書式は先頭の一部の値から 1 回だけ判定して
+書式を指定して変換する（要素ごとの書式推定を避ける）。user_id と point はカテゴリ型にする。
+UTC からの時差（"+09:00"、"Z" など）の付いた時刻は、時差を除いて書かれている現地の時刻として扱う
+（時刻範囲での絞り込みは現地の時刻で行うため）。どちらのエンジンでも時差の無い日時型になる。
+時刻を解釈できない行や、user_id・point・timestamp が空の行は集計から除き、bad_rows の表にまとめる。
+
+cache_dir と key（ファイル内容のハッシュ）を渡すと、読み込んだ結果を Arrow 形式で保存し、
+同じファイルを再び開いたときはメモリマップで開いて、日時の列とカテゴリの符号はコピーせずにそのまま使う
+（DataFrame にするときにコピーするのはカテゴリの値の文字列だけ。これらの列は読み取り専用になる）。
+"""
+import importlib.util
+import os
+import tempfile
+
+import pandas as pd
+
+from src.profiling import Profiler
+
+REQUIRED_COLUMNS = ("user_id", "point", "timestamp")
+# 判定に使う先頭の値の数
+FORMAT_SAMPLE_SIZE = 1000
+# 候補の書式（上から順に試す）。ISO8601 は "2025-11-01 10:00"、"2025-11-01T10:00:00.5" なども含む
+TIMESTAMP_FORMATS = (
+    "ISO8601",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d %H:%M:%S.%f",
+    "%Y%m%d%H%M%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%Y年%m月%d日 %H:%M:%S",
+    "%Y年%m月%d日 %H:%M",
+)
+# どの書式でも解釈できないときの要素ごとの推定
+MIXED_FORMAT = "mixed"
+# 時刻の末尾の UTC からの時差
+UTC_OFFSET_PATTERN = r"\s*(?:Z|[+-]\d{2}:?\d{2})$"
+# 保存する形式の版（読み込み方を変えたら上げて、古い保存結果を使わないようにする）
+CACHE_VERSION = 3
+
+
+def has_pyarrow():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def default_cache_dir():
+    """読み込んだデータの保存先（STAMPRALLY_CACHE_DIR があればその下）。"""
+    base = os.environ.get("STAMPRALLY_CACHE_DIR") or tempfile.gettempdir()
+    return os.path.join(base, "stamprally_datasets")
+
+
+def detect_timestamp_format(values, sample_size=FORMAT_SAMPLE_SIZE):
+    """空でない先頭 sample_size 個の値を最も多く解釈できる書式を返す（どれも解釈できなければ MIXED_FORMAT）。"""
+    sample = pd.Series(values).dropna().astype(str).str.strip()
+    sample = sample[sample != ""].head(sample_size)
+    if sample.empty:
+        return TIMESTAMP_FORMATS[0]
+    best, best_count = MIXED_FORMAT, 0
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            count = int(pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum())
+        except ValueError:
+            continue
+        if count == len(sample):
+            return fmt
+        if count > best_count:
+            best, best_count = fmt, count
+    return best
+
+
+def strip_utc_offsets(values, sample_size=FORMAT_SAMPLE_SIZE):
+    """先頭 sample_size 個の値に UTC からの時差が付いていれば、すべての値から時差を除いた文字列を返す。"""
+    values = pd.Series(values)
+    sample = values.dropna().astype(str).head(sample_size)
+    if not sample.str.contains(UTC_OFFSET_PATTERN, regex=True).any():
+        return values
+    return values.astype("string").str.strip().str.replace(UTC_OFFSET_PATTERN, "", regex=True)
+
+
+def _read_csv(source, engine, **kwargs):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return pd.read_csv(source, engine=engine, **kwargs)
+
+
+def read_stamps(source, profiler=None):
+    """CSV を読み込み、次の dict を返す。必要な列が無ければ ValueError。
+
+        df               : 有効な行（timestamp は日時型、user_id と point はカテゴリ型）
+        bad_rows         : 除いた行（レコード番号・理由と元の値）
+        timestamp_format : 判定した timestamp の書式
+    """
+    profiler = profiler or Profiler()
+    engine = "pyarrow" if has_pyarrow() else "c"
+    with profiler.stage("read_csv") as record:
+        df = _read_csv(source, engine)
+        record["rows"] = len(df)
+
+    if "user_id" not in df.columns or "point" not in df.columns:
+        raise ValueError("CSVファイルに'user_id'または'point'列が存在しません。")
+    if "timestamp" not in df.columns:
+        raise ValueError("CSVファイルに'timestamp'列が存在しません。")
+
+    raw = df["timestamp"]
+    with profiler.stage("to_datetime", rows=len(df)):
+        if isinstance(raw.dtype, pd.DatetimeTZDtype):
+            # pyarrow は時差付きの時刻を UTC に直してしまうので、この列だけ文字列として読み直す
+            # （pyarrow エンジンでは dtype は変換後に適用されるため C エンジンで読む）
+            raw = _read_csv(source, "c", usecols=["timestamp"], dtype={"timestamp": "string"})["timestamp"]
+        if pd.api.types.is_datetime64_any_dtype(raw):
+            # pyarrow が日時として読み込んだ場合はそのまま使う
+            timestamp_format = TIMESTAMP_FORMATS[0]
+            timestamps = raw
+        else:
+            local = strip_utc_offsets(raw)
+            timestamp_format = detect_timestamp_format(local)
+            timestamps = pd.to_datetime(local, format=timestamp_format, errors="coerce")
+
+    # 理由は 1 行につき最初に当てはまるものだけを記録する
+    reasons = pd.Series(pd.NA, index=df.index, dtype="object")
+    reasons[(timestamps.isna() & raw.notna()).to_numpy()] = "timestamp を解釈できません"
+    for column in reversed(REQUIRED_COLUMNS):
+        reasons[df[column].isna().to_numpy()] = f"{column} が空です"
+    bad = reasons.notna().to_numpy()
+
+    bad_rows = df[bad].astype("string")
+    bad_rows.insert(0, "理由", reasons[bad].astype("string"))
+    # ヘッダーを除いて何件目のレコードか（1 始まり）。引用符の中に改行があるとファイルの行番号とはずれるので、
+    # 行番号としては示さない
+    bad_rows.insert(0, "レコード番号", df.index[bad] + 1)
+
+    df = df[~bad].reset_index(drop=True)
+    df["timestamp"] = timestamps[~bad].reset_index(drop=True)
+    with profiler.stage("categorize", rows=len(df)):
+        for column in ("user_id", "point"):
+            df[column] = df[column].astype("category")
+    return {"df": df, "bad_rows": bad_rows.reset_index(drop=True), "timestamp_format": timestamp_format}
+
+
+def _cache_paths(cache_dir, key):
+    name = f"{key}.v{CACHE_VERSION}"
+    return os.path.join(cache_dir, f"{name}.arrow"), os.path.join(cache_dir, f"{name}.bad.arrow")
+
+
+def _write_arrow(path, df, metadata=None):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    # 書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _read_arrow(path):
+    import pyarrow as pa
+
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    # 列ごとに別のブロックにすると、列をまとめるためのコピーをせずにマップした領域をそのまま参照できる
+    return table.to_pandas(split_blocks=True), table.schema.metadata or {}
+
+
+def load_stamps(source, cache_dir=None, key=None, profiler=None):
+    """read_stamps と同じ結果を返す。cache_dir と key を渡すと Arrow 形式で保存したものを再利用する。"""
+    profiler = profiler or Profiler()
+    if not (cache_dir and key and has_pyarrow()):
+        return read_stamps(source, profiler)
+
+    data_path, bad_path = _cache_paths(cache_dir, key)
+    if os.path.exists(data_path) and os.path.exists(bad_path):
+        with profiler.stage("read_arrow") as record:
+            df, metadata = _read_arrow(data_path)
+            bad_rows, _ = _read_arrow(bad_path)
+            record["rows"] = len(df)
+        return {"df": df, "bad_rows": bad_rows,
+                "timestamp_format": metadata.get(b"timestamp_format", b"").decode("utf-8")}
+
+    result = read_stamps(source, profiler)
+    with profiler.stage("write_arrow", rows=len(result["df"])):
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            _write_arrow(bad_path, result["bad_rows"])
+            _write_arrow(data_path, result["df"], {"timestamp_format": result["timestamp_format"]})
+        except OSError:
+            # 保存できなくても読み込んだ結果はそのまま使う
+            pass
+    return result
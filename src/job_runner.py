@@ -0,0 +1,106 @@
+"""フィルタ変更時の再計算をバックグラウンドで行い、最新の条件の結果だけを残す。
+
+LatestJobRunner.submit は計算をセッション専用の作業スレッドに投入し、それより前に投入した古い計算を取り消す。
+まだ始まっていない計算は実行せず、実行中の計算は Job.step を呼んだ時点で JobCancelled により打ち切る。
+作業スレッドはセッションごとに 1 本なので、他のセッションの（取り消された）計算が終わるのを待つことはない。
+画面には最後に完了した結果を表示しておき、新しい結果ができたら差し替える。
+"""
+import concurrent.futures
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """新しい計算が投入されたため、古い計算を打ち切った"""
+
+
+class Job:
+    """投入した 1 つの計算。compute(job) には自分自身が渡される。"""
+
+    def __init__(self, key):
+        self.key = key
+        self.progress = 0.0
+        self.message = ""
+        self.future = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def step(self, progress, message=""):
+        """進捗（0〜1）を記録する。取り消されていれば JobCancelled を送出する。"""
+        if self._cancelled.is_set():
+            raise JobCancelled(self.key)
+        self.progress = progress
+        self.message = message
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def failed(self):
+        """取り消されたか、例外で終わった。"""
+        if self.cancelled:
+            return True
+        return self.done() and (self.future.cancelled() or self.future.exception() is not None)
+
+
+class LatestJobRunner:
+    """最新の計算だけを実行し、最後に完了した計算の結果を保持する（セッションごとに 1 つ）。
+
+    executor を省略すると、このランナー専用の作業スレッド 1 本で実行する（ランナーを捨てるとスレッドも終わる）。
+    """
+
+    def __init__(self, executor=None):
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="stamprally-job")
+        self._lock = threading.Lock()
+        self.current = None
+        self.completed_key = None
+        self.completed_value = None
+
+    def submit(self, key, compute):
+        """key の計算を投入して Job を返す。同じ key の計算が実行中・完了済みならそれを返す（失敗した計算はやり直す）。"""
+        with self._lock:
+            if self.current is not None and self.current.key == key and not self.current.failed():
+                return self.current
+            if self.current is not None:
+                self.current.cancel()
+            job = Job(key)
+            self.current = job
+        job.future = self._executor.submit(self._run, job, compute)
+        return job
+
+    def _run(self, job, compute):
+        job.step(0.0)
+        value = compute(job)
+        with self._lock:
+            # 後から投入された計算が先に終わっていれば、古い結果で上書きしない
+            if self.current is job:
+                self.completed_key, self.completed_value = job.key, value
+        job.progress = 1.0
+        return value
+
+    def wait(self, job, timeout=None):
+        """job の完了を timeout 秒まで待ち、完了していれば結果を返す（未完了なら None）。
+
+        取り消された計算は None を返し、計算中の例外（JobCancelled 以外）はそのまま送出する。
+        """
+        try:
+            return job.future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Python 3.10 以前では組み込みの TimeoutError とは別の例外
+            return None
+        except Exception:
+            if job.cancelled:
+                return None
+            raise
+
+    def latest(self):
+        """最後に完了した計算の (key, 結果)。まだ無ければ (None, None)。"""
+        with self._lock:
+            return self.completed_key, self.completed_value
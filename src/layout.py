@@ -0,0 +1,203 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# これを超えるノード数では、スペクトル配置を初期値にして、反発力を格子で近似した力学計算を行う
+# （networkx の spring_layout は 1 反復ごとに全ノードの組の距離を計算する）
+LARGE_GRAPH_NODES = 300
+LARGE_GRAPH_ITERATIONS = 50
+# 新しく現れたノードだけを配置するときの反復回数
+INCREMENTAL_ITERATIONS = 30
+
+_LAYOUT_CACHE_SIZE = 64
+_layout_cache = OrderedDict()
+_layout_cache_lock = threading.Lock()
+
+
+def point_set_key(nodes, namespace=None):
+    """ノード（ポイント）の集合を表すキー。並び順には依存しない。"""
+    h = hashlib.sha256(repr(namespace).encode("utf-8"))
+    for n in sorted(repr(n) for n in nodes):
+        h.update(n.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _grid_spring_layout(G, pos, iterations=LARGE_GRAPH_ITERATIONS, fixed=(), seed=42):
+    """Fruchterman-Reingold の力学計算。反発力は格子で近似し、1 反復を O(ノード数 + エッジ数) で行う。
+
+    ノードを一辺 2k（k は理想のエッジ長）の格子に分け、各ノードは自分と周囲 8 個のセルにあるノードから、
+    セルの重心に集めた反発力だけを受ける（それより遠いノードの反発力は無視する）。
+    引力は networkx の spring_layout と同様にエッジの weight に比例する。fixed のノードは動かさない。
+    """
+    nodes = list(G.nodes())
+    n = len(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array([pos[node] for node in nodes], dtype=float).reshape(n, 2)
+    movable = np.ones(n, dtype=bool)
+    movable[[index[node] for node in fixed if node in index]] = False
+    if n < 2 or not movable.any():
+        return dict(zip(nodes, xy))
+
+    edges = [(index[u], index[v], w) for u, v, w in G.edges(data="weight", default=1) if u != v]
+    src = np.array([u for u, _, _ in edges], dtype=np.int64)
+    dst = np.array([v for _, v, _ in edges], dtype=np.int64)
+    weight = np.array([w for _, _, w in edges], dtype=float)
+
+    # 座標を単位正方形の大きさに合わせ、理想のエッジ長 k を決める（重なったノードは少しずらす）
+    rng = np.random.default_rng(seed)
+    origin = xy.min(axis=0)
+    span = max(float(np.ptp(xy, axis=0).max()), 1e-9)
+    xy = (xy - origin) / span
+    xy[movable] += rng.normal(scale=1e-4, size=(int(movable.sum()), 2))
+    k = np.sqrt(1.0 / n)
+    cell = 2 * k
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+    for _ in range(iterations):
+        # 反発力: セルごとのノード数と重心を求め、周囲のセルの重心から受ける力を足す
+        cells = np.floor(xy / cell).astype(np.int64)
+        cells -= cells.min(axis=0)
+        width = int(cells[:, 1].max()) + 3
+        keys = (cells[:, 0] + 1) * width + cells[:, 1] + 1
+        cell_keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse).astype(float)
+        sums = np.stack([np.bincount(inverse, weights=xy[:, 0]), np.bincount(inverse, weights=xy[:, 1])], axis=1)
+
+        disp = np.zeros_like(xy)
+        for dx, dy in offsets:
+            neighbor = keys + dx * width + dy
+            found = np.searchsorted(cell_keys, neighbor)
+            found = np.minimum(found, len(cell_keys) - 1)
+            hit = cell_keys[found] == neighbor
+            count = np.where(hit, counts[found], 0.0)
+            total = np.where(hit[:, None], sums[found], 0.0)
+            if dx == 0 and dy == 0:
+                # 自分のセルは自分自身を除く
+                count = count - 1
+                total = total - xy
+            has = count > 0
+            centroid = total[has] / count[has, None]
+            delta = xy[has] - centroid
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 0.01 * k)
+            disp[has] += delta * (count[has] * k * k / distance ** 2)[:, None]
+
+        # 引力: エッジの両端を weight に比例した力で引き寄せる
+        if len(src):
+            delta = xy[src] - xy[dst]
+            distance = np.maximum(np.linalg.norm(delta, axis=1), 0.01 * k)
+            force = delta * (weight * distance / k)[:, None]
+            np.add.at(disp, src, -force)
+            np.add.at(disp, dst, force)
+
+        length = np.maximum(np.linalg.norm(disp, axis=1), 1e-12)
+        step = disp * (np.minimum(length, temperature) / length)[:, None]
+        xy[movable] += step[movable]
+        temperature -= cooling
+
+    if not movable.all():
+        # 固定したノードがあるときは元の座標系に戻し、固定ノードの座標は入力のまま返す
+        xy = xy * span + origin
+        xy[~movable] = [pos[node] for node in nodes if not movable[index[node]]]
+        return dict(zip(nodes, xy))
+    return dict(zip(nodes, _rescale(xy)))
+
+
+def _rescale(xy):
+    # networkx の spring_layout と同じく、原点を中心に [-1, 1] に収める
+    xy = xy - xy.mean(axis=0)
+    scale = np.abs(xy).max()
+    return xy / scale if scale > 0 else xy
+
+
+def _full_layout(G, seed):
+    import networkx as nx
+
+    if G.number_of_nodes() <= LARGE_GRAPH_NODES:
+        return nx.spring_layout(G, seed=seed)
+    # 大きなグラフ: スペクトル配置（疎行列の固有ベクトル計算）で大まかな形を決めてから、格子で近似した力学計算で広げる
+    initial = nx.spectral_layout(G.to_undirected())
+    return _grid_spring_layout(G, initial, seed=seed)
+
+
+def _place_new_nodes(G, known, seed):
+    # 新しいノードは配置済みの隣接ノードの重心に、隣接ノードが無ければ外周に置く
+    rng = np.random.default_rng(seed)
+    coords = np.array(list(known.values()), dtype=float)
+    center = coords.mean(axis=0)
+    radius = max(float(np.abs(coords - center).max()), 0.5) * 1.2
+    initial = dict(known)
+    new_nodes = [n for n in G.nodes() if n not in known]
+    for i, n in enumerate(new_nodes):
+        neighbors = [known[m] for m in set(G.predecessors(n)) | set(G.successors(n)) if m in known]
+        if neighbors:
+            base = np.mean(neighbors, axis=0)
+        else:
+            angle = 2 * np.pi * i / len(new_nodes)
+            base = center + radius * np.array([np.cos(angle), np.sin(angle)])
+        initial[n] = base + rng.normal(scale=0.05, size=2)
+    return initial
+
+
+def compute_layout(G, previous=None, seed=42):
+    """ノード座標を求める。
+
+    previous に含まれるノードはその座標をそのまま使い（ウォームスタート）、
+    新しく現れたノードだけを力学計算で配置する。previous が無い場合は全体を配置する。
+    """
+    import networkx as nx
+
+    nodes = list(G.nodes())
+    previous = previous or {}
+    known = {n: np.asarray(previous[n], dtype=float) for n in nodes if n in previous}
+    if len(known) == len(nodes):
+        return known
+    if not known:
+        return _full_layout(G, seed)
+
+    initial = _place_new_nodes(G, known, seed)
+    if len(nodes) > LARGE_GRAPH_NODES:
+        return _grid_spring_layout(G, initial, iterations=INCREMENTAL_ITERATIONS, fixed=list(known), seed=seed)
+    return nx.spring_layout(G, pos=initial, fixed=list(known), iterations=INCREMENTAL_ITERATIONS, seed=seed)
+
+
+def get_layout(G, previous=None, namespace=None, seed=42):
+    """ポイント集合ごとにキャッシュしたレイアウトを返す。
+
+    優先順位は previous（利用者が編集した座標など）、同じポイント集合のキャッシュ、
+    新規ノードの増分配置の順。フィルタ条件を変えても全体の再配置は起きない。
+    """
+    key = point_set_key(G.nodes(), namespace)
+    merged = {}
+    with _layout_cache_lock:
+        cached = _layout_cache.get(key)
+        if cached is not None:
+            _layout_cache.move_to_end(key)
+            merged.update(cached)
+    if previous:
+        merged.update(previous)
+
+    pos = compute_layout(G, merged, seed=seed)
+    with _layout_cache_lock:
+        _layout_cache[key] = dict(pos)
+        while len(_layout_cache) > _LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    return pos
+
+
+def dump_layout(pos):
+    """座標を JSON 文字列にする（ポイント名が数値でも復元できるよう [名前, x, y] の配列で保存）。"""
+    def plain(n):
+        if isinstance(n, np.generic):
+            return n.item()
+        return n if isinstance(n, (str, int, float)) else str(n)
+    return json.dumps([[plain(n), float(x), float(y)] for n, (x, y) in pos.items()], ensure_ascii=False)
+
+
+def load_layout(text):
+    return {n: np.array([x, y]) for n, x, y in json.loads(text)}
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger("stamprally.perf")
+
+
+class _NullRecord(dict):
+    # 計測しないときに stage() が返す記録。書き込みは捨てる
+    def __setitem__(self, key, value):
+        pass
+
+
+class _NullStage:
+    def __enter__(self):
+        return _NULL_RECORD
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_RECORD = _NullRecord()
+_NULL_STAGE = _NullStage()
+
+# tracemalloc はプロセスに 1 つしかないので、メモリを計測中の段階の数を数え、
+# 最初の段階で開始して最後の段階が終わったら止める（セッション・スレッドをまたいで共有する）
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+# このモジュールが tracemalloc を開始したかどうか（外で開始されたものは止めない）
+_tracing_started = False
+
+
+def _acquire_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_users += 1
+
+
+def _release_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+class _Stage:
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.record = {"stage": name, "rows": rows}
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            _acquire_tracing()
+        self.start = time.perf_counter()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["seconds"] = round(time.perf_counter() - self.start, 6)
+        if self.profiler.trace_memory:
+            # ピークを段階ごとに戻す（reset_peak）と他の段階の計測を壊すので戻さない。値はプロセス全体のもの
+            _, peak = tracemalloc.get_traced_memory()
+            _release_tracing()
+            self.record["process_peak_mb"] = round(peak / 1024 / 1024, 3)
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        self.profiler._finish(self.record)
+        return False
+
+
+class Profiler:
+    """パイプラインの段階ごとに処理時間・行数・ピークメモリを記録する。
+
+        with profiler.stage("build_graph", rows=len(df)) as record:
+            ...
+            record["rows"] = len(result)   # 処理後に分かる行数は後から設定できる
+
+    enabled=False のときは何も記録せず、stage() は共有の空のコンテキストを返すだけになる。
+    記録は JSON 1 行のログとして "stamprally.perf" ロガーにも出力する。
+
+    trace_memory=True のときの process_peak_mb は tracemalloc で測ったプロセス全体のピークで、
+    同時に計測中の段階（入れ子の段階や、他のセッション・スレッドの段階）の確保も含む。
+    tracemalloc はどの段階も計測していない間は止めておく。
+    """
+
+    def __init__(self, enabled=False, trace_memory=False, context=None):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.context = dict(context or {})
+        self.context.setdefault("run_id", uuid.uuid4().hex[:12])
+        self.records = []
+
+    def stage(self, name, rows=None):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, rows)
+
+    def _finish(self, record):
+        self.records.append(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({**self.context, **record}, ensure_ascii=False, default=str))
+
+    def total_seconds(self):
+        return sum(r["seconds"] for r in self.records)
+
+
+def configure_perf_log(path=None):
+    """STAMPRALLY_PERF_LOG（または path）のファイルに計測結果を JSON Lines で追記する。"""
+    path = path or os.environ.get("STAMPRALLY_PERF_LOG")
+    if not path or any(getattr(h, "baseFilename", None) == os.path.abspath(path) for h in logger.handlers):
+        return
+    handler = logging.FileHandler(path, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
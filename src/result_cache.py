@@ -0,0 +1,228 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+
+def content_key(*parts):
+    """バイト列（アップロードされたファイル等）とパラメータから SHA-256 のキーを作る。"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(b"b")
+            h.update(part)
+        else:
+            h.update(b"r")
+            h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _sparse_nbytes(matrix):
+    # scipy の疎行列が持つ配列のバイト数（CSR/CSC は data・indices・indptr、COO は data・row・col）
+    parts = ("data", "indices", "indptr", "row", "col", "coords")
+    total = 0
+    for name in parts:
+        part = getattr(matrix, name, None)
+        if isinstance(part, np.ndarray):
+            total += part.nbytes
+        elif isinstance(part, tuple):
+            total += sum(p.nbytes for p in part if isinstance(p, np.ndarray))
+    return total
+
+
+def estimate_size(value):
+    # キャッシュ容量の管理に使うおおよそのバイト数
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, Future):
+        # 完了していれば結果の大きさ、未完了なら大きさは分からない（キャッシュには完了した結果を入れる）
+        if value.done() and not value.cancelled() and value.exception() is None:
+            return estimate_size(value.result())
+        return sys.getsizeof(value)
+    if hasattr(value, "number_of_nodes") and hasattr(value, "number_of_edges"):
+        # networkx のグラフ（ノード・エッジ 1 つあたりの概算）
+        return 500 * (value.number_of_nodes() + value.number_of_edges())
+    # 読み込み済みのモジュールだけを確認する（ここで scipy や matplotlib を読み込まない）
+    scipy_sparse = sys.modules.get("scipy.sparse")
+    if scipy_sparse is not None and scipy_sparse.issparse(value):
+        return _sparse_nbytes(value)
+    figure = sys.modules.get("matplotlib.figure")
+    if figure is not None and isinstance(value, figure.Figure):
+        # 描画先のバッファ（RGBA）の大きさで見積もる
+        width, height = value.get_size_inches()
+        return int(width * value.dpi) * int(height * value.dpi) * 4
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, (int, np.integer)):
+        # SparseAdjacency など、nbytes で大きさを示すオブジェクト
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """パイプラインの各段階の結果を保持する、容量上限付きの LRU キャッシュ。
+
+    キーは (段階名, content_key(...)) の組。上限を超えると古いものから追い出し、
+    disk_dir を指定した場合は追い出した結果を pickle としてディスクに退避する。
+    複数のセッション（スレッド）から共有できる。
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, disk_dir=None, max_disk_bytes=2 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._counts = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get_or_compute(self, stage, key, compute):
+        """キャッシュにあればそれを返し、無ければ compute() を実行して保存する。"""
+        found, value = self.get(stage, key)
+        if found:
+            return value
+        value = compute()
+        self.put(stage, key, value)
+        return value
+
+    def get_or_compute_many(self, stage, keys, computes, workers=None):
+        """keys の各キーについて get_or_compute と同じことを行い、結果をキーの順に返す。
+
+        キャッシュに無いものは computes の対応する関数をスレッドプールで並列に実行する。
+        """
+        results = [self.get(stage, key) for key in keys]
+        missing = [i for i, (found, _) in enumerate(results) if not found]
+        values = [value for _, value in results]
+        if len(missing) == 1 or workers == 1:
+            computed = [computes[i]() for i in missing]
+        elif missing:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                computed = list(pool.map(lambda i: computes[i](), missing))
+        else:
+            computed = []
+        for i, value in zip(missing, computed):
+            self.put(stage, keys[i], value)
+            values[i] = value
+        return values
+
+    def get(self, stage, key):
+        with self._lock:
+            entry = self._entries.get((stage, key))
+            if entry is not None:
+                self._entries.move_to_end((stage, key))
+                self._counts["hits"] += 1
+                return True, entry[0]
+
+        path = self._disk_path(stage, key)
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                with self._lock:
+                    self._counts["disk_hits"] += 1
+                self.put(stage, key, value)
+                return True, value
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return False, None
+
+    def put(self, stage, key, value):
+        size = estimate_size(value)
+        evicted = []
+        with self._lock:
+            old = self._entries.pop((stage, key), None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                # 単独で上限を超える結果はメモリに置かない
+                evicted.append(((stage, key), value))
+            else:
+                self._entries[(stage, key)] = (value, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self._counts["evictions"] += 1
+                evicted.append((old_key, old_value))
+        for (old_stage, old_key), old_value in evicted:
+            self._spill(old_stage, old_key, old_value)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _disk_path(self, stage, key):
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, f"{stage}-{key}.pkl")
+
+    def _spill(self, stage, key, value):
+        path = self._disk_path(stage, key)
+        if path is None or os.path.exists(path):
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            # pickle できない結果（描画オブジェクト等）は退避しない
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,181 @@
+"""複数ステップのルート（ポイントの並び）の集計。
+
+ユーザーごとの訪問順に並べた整数コードの列から、連続する stops 個のポイントの並びを
+1 つの 64 ビット整数（ホーナー法で畳み込んだ多項式ハッシュ）にして数える。
+ポイント数 ** stops が int64 に収まる場合は衝突の無い混合基数表現になる。
+"""
+import numpy as np
+import pandas as pd
+
+from src.stamprally_analyze import sort_key
+
+# 混合基数で表せないときのハッシュの基数（奇数なので 2**64 を法として可逆）
+_HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _sorted_codes(df):
+    # count_transitions と同じく user_id, timestamp の順に並べた整数コード
+    point_codes, points = pd.factorize(df["point"], sort=True)
+    user_codes, _ = pd.factorize(df["user_id"])
+    order = np.lexsort((sort_key(df["timestamp"]), user_codes))
+    order = order[user_codes[order] >= 0]
+    return point_codes[order].astype(np.int64), user_codes[order].astype(np.int64), np.asarray(points)
+
+
+def _hash_base(n_points, stops):
+    if n_points ** stops < 2 ** 63:
+        return np.uint64(max(n_points, 1))
+    return _HASH_BASE
+
+
+def _count_paths(keys, users, starts):
+    # ルートごとの利用者数（重複しないユーザー数）と通過回数、代表となる開始位置。
+    # 入力はユーザー順に並んでいるので、キーだけの安定ソートで (キー, ユーザー) 順になる
+    order = np.argsort(keys, kind="stable")
+    keys, users, starts = keys[order], users[order], starts[order]
+    new_path = np.r_[True, keys[1:] != keys[:-1]][:len(keys)]
+    new_pair = new_path | np.r_[True, users[1:] != users[:-1]][:len(keys)]
+    path_id = np.cumsum(new_path) - 1
+    n_paths = int(path_id[-1]) + 1 if len(path_id) else 0
+    return {
+        "keys": keys[new_path],
+        "users": np.bincount(path_id[new_pair], minlength=n_paths),
+        "trips": np.bincount(path_id, minlength=n_paths),
+        "starts": starts[new_path],
+        "path_id": path_id,
+        "order": order,
+    }
+
+
+def _pair_users(points, users):
+    # 1 回の移動（隣り合う 2 個の並び）ごとの利用者数。キーは from * ポイント数 + to
+    n_points = int(points.max()) + 1 if len(points) else 0
+    valid = (points[:-1] >= 0) & (points[1:] >= 0) & (users[:-1] == users[1:])
+    keys = (points[:-1] * n_points + points[1:]).astype(np.uint64)
+    starts = np.flatnonzero(valid)
+    counted = _count_paths(keys[starts], users[starts], starts)
+    return {"n_points": n_points, "valid": valid, "keys": keys, "pair_keys": counted["keys"],
+            "users": counted["users"]}
+
+
+def _mine(points, users, stops, min_users, pairs):
+    # ルートに含まれる移動はどれも、ルート以上の利用者がいる。
+    # そこで利用者が min_users 人未満の移動を含む並びは、並びを数える（ソートする）前に除く
+    n = len(points)
+    if n < stops:
+        return None
+    if stops == 1:
+        alive = points >= 0
+        keys = points.astype(np.uint64)
+    else:
+        ok = pairs["valid"].copy()
+        if min_users > 1:
+            frequent = pairs["pair_keys"][pairs["users"] >= min_users]
+            ok &= np.isin(pairs["keys"], frequent)
+        # 開始位置 i から stops - 1 回の移動がすべて ok なら数える
+        bad = np.r_[0, np.cumsum(~ok)]
+        alive = (bad[stops - 1:] - bad[:n - stops + 1]) == 0
+
+        base = _hash_base(pairs["n_points"], stops)
+        keys = points[:n - stops + 1].astype(np.uint64)
+        with np.errstate(over="ignore"):
+            for s in range(1, stops):
+                keys = keys * base + points[s:n - stops + 1 + s].astype(np.uint64)
+    starts = np.flatnonzero(alive)
+    if len(starts) == 0:
+        return None
+    counted = _count_paths(keys[starts], users[starts], starts)
+    keep = counted["users"] >= min_users
+    return {name: counted[name][keep] for name in ("users", "trips", "starts")}
+
+
+def _top(mined, k):
+    # 利用者数、通過回数の降順（同数は最初に現れた順）で上位 k 件の添字
+    if mined is None or len(mined["users"]) == 0:
+        return np.array([], dtype=np.int64)
+    rank = np.lexsort((mined["starts"], -mined["trips"], -mined["users"]))
+    return rank[:k]
+
+
+def mine_routes(df, stops=3, k=10, min_users=None):
+    """連続する stops 個のポイントの並び（stops - 1 回の移動）を、利用者数の多い順に k 件返す。
+
+    戻り値の dict:
+        points : ポイント名の配列（添字がポイントID）
+        paths  : (件数, stops) のポイントID の配列
+        users  : ルートを 1 回以上通ったユーザー数
+        trips  : ルートを通った回数（同じユーザーの繰り返しも数える）
+
+    利用者が min_users 人未満の移動を含む並びは数えない。min_users を指定しない場合は
+    上位 k 件の利用者数の下限を推定して枝刈りし、k 件そろわなければ下限を半分にしてやり直す
+    （結果は枝刈りしない場合と同じ）。
+    """
+    points, users, names = _sorted_codes(df)
+    empty = {"points": names, "paths": np.empty((0, stops), dtype=np.int64),
+             "users": np.array([], dtype=np.int64), "trips": np.array([], dtype=np.int64)}
+
+    if len(points) < stops:
+        return empty
+    pairs = _pair_users(points, users)
+    if min_users is not None:
+        mined = _mine(points, users, stops, min_users, pairs)
+    else:
+        # 1 回の移動の k 番目の利用者数は、ルートの k 番目の利用者数の上限になる
+        counts = np.sort(pairs["users"])[::-1]
+        bound = int(counts[min(k, len(counts)) - 1]) if len(counts) and stops > 1 else 1
+        threshold = max(1, bound // 4)
+        while True:
+            mined = _mine(points, users, stops, threshold, pairs)
+            found = 0 if mined is None else len(mined["users"])
+            if found >= k or threshold == 1:
+                break
+            threshold = max(1, threshold // 2)
+
+    top = _top(mined, k)
+    if len(top) == 0:
+        return empty
+    starts = mined["starts"][top]
+    return {
+        "points": names,
+        "paths": points[starts[:, None] + np.arange(stops)],
+        "users": mined["users"][top],
+        "trips": mined["trips"][top],
+    }
+
+
+def visit_orders(df, k=10):
+    """ユーザーごとの訪問順（全スタンプの並び）を、同じ並びのユーザー数の多い順に k 件返す。
+
+    戻り値は mine_routes と同じ形で、paths は長さがそろわないのでポイントID の配列のリストになる。
+    """
+    points, users, names = _sorted_codes(df)
+    valid = points >= 0
+    points, users = points[valid], users[valid]
+    if len(points) == 0:
+        return {"points": names, "paths": [], "users": np.array([], dtype=np.int64),
+                "trips": np.array([], dtype=np.int64)}
+
+    # ユーザーごとの並びを多項式ハッシュ（Σ p_j * B^(L-1-j)）にする
+    first = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    lengths = np.diff(np.r_[first, len(points)])
+    from_end = np.repeat(first + lengths, lengths) - np.arange(len(points)) - 1
+    with np.errstate(over="ignore"):
+        terms = (points + 1).astype(np.uint64) * np.power(_HASH_BASE, from_end.astype(np.uint64))
+        keys = np.add.reduceat(terms, first) * _HASH_BASE + lengths.astype(np.uint64)
+
+    counted = _count_paths(keys, np.arange(len(first)), first)
+    mined = {"users": counted["users"], "trips": counted["users"], "starts": counted["starts"]}
+    top = _top(mined, k)
+    length_of = dict(zip(first.tolist(), lengths.tolist()))
+    paths = [points[s:s + length_of[s]] for s in mined["starts"][top].tolist()]
+    return {"points": names, "paths": paths, "users": mined["users"][top], "trips": mined["trips"][top]}
+
+
+def routes_frame(routes, separator=" → "):
+    """mine_routes / visit_orders の結果を表示用の DataFrame（ルート, 利用者数, 通過回数）にする。"""
+    names = routes["points"]
+    return pd.DataFrame({
+        'ルート': [separator.join(str(names[p]) for p in path) for path in routes["paths"]],
+        '利用者数': np.asarray(routes["users"], dtype=np.int64),
+        '通過回数': np.asarray(routes["trips"], dtype=np.int64),
+    })
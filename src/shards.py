@@ -0,0 +1,189 @@
+"""日ごと・端末ごとなどに分かれた複数の CSV（シャード）の集計と合併。
+
+シャードごとに count_transitions でシャード内の遷移を数え、合併に必要な情報だけを持つ
+部分集計（shard_partial）を作る。部分集計どうしは merge_partials で合併でき、
+シャードをまたぐ遷移はユーザーごとの最初・最後のスタンプをつないで数える。
+結果は全シャードを連結した DataFrame に count_transitions を適用した場合と同じになる。
+
+ユーザーの時刻の範囲がシャード間で重なる（同じユーザーのスタンプが交互に並ぶ）場合は
+境界だけでは遷移を決められないので OverlappingShardsError を送出する。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.stamprally_analyze import appearance_order, count_transitions, edge_arrays
+from src.travel_time import TIME_KEYS, gap_ms, merge_travel_times, timestamp_ns, travel_time_table
+
+# 時刻が欠損したスタンプの並べ替えキー（count_transitions と同様に末尾へ）
+_NAT_KEY = np.iinfo(np.int64).max
+_INVALID_NS = np.iinfo(np.int64).min
+
+
+class OverlappingShardsError(Exception):
+    """同じユーザーの時刻の範囲が複数のシャードで重なっている"""
+
+
+def shard_paths(directory):
+    """ディレクトリ内の CSV のパス（ファイル名順）。"""
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(".csv"))
+
+
+def shard_partial(df, visitors=True):
+    """1 つのシャードの部分集計を返す。
+
+    visitors=False なら訪問者数を数えず、node_counts・visit_point・visit_user を含めない
+    （merge_partials の結果にも node_counts が含まれなくなる）。
+
+    戻り値の dict:
+        count_transitions の結果のキー : シャード内の遷移（ポイントID はこのシャードの points の添字）
+        users                : ユーザーIDの配列（添字がシャード内のユーザーコード）
+        visit_point, visit_user : 訪問した (ポイントID, ユーザーコード) の組（重複なし）
+        first_point, first_key, last_point, last_key :
+                               ユーザーコードごとの最初・最後のスタンプのポイントID（欠損は -1）と
+                               時刻（ナノ秒。欠損は int64 の最大値）
+    """
+    partial = count_transitions(df, visitors=visitors)
+    point_codes, _ = pd.factorize(df["point"], sort=True)
+    user_codes, users = pd.factorize(df["user_id"])
+    n_users = max(len(users), 1)
+
+    if visitors:
+        visited = (point_codes >= 0) & (user_codes >= 0)
+        pairs = np.unique(point_codes[visited].astype(np.int64) * n_users + user_codes[visited])
+        partial.update({"visit_point": pairs // n_users, "visit_user": pairs % n_users})
+
+    # count_transitions と同じ (user_id, timestamp) の順で、ユーザーごとの先頭と末尾の行を取る
+    keys = timestamp_ns(df["timestamp"])
+    keys[keys == _INVALID_NS] = _NAT_KEY
+    order = np.lexsort((keys, user_codes))
+    order = order[user_codes[order] >= 0]
+    sorted_users = user_codes[order]
+    first = order[np.r_[True, sorted_users[1:] != sorted_users[:-1]]] if len(order) else order
+    last = order[np.r_[sorted_users[1:] != sorted_users[:-1], True]] if len(order) else order
+
+    partial.update({
+        "users": np.asarray(users),
+        "first_point": point_codes[first].astype(np.int64),
+        "first_key": keys[first],
+        "last_point": point_codes[last].astype(np.int64),
+        "last_key": keys[last],
+    })
+    return partial
+
+
+def _boundary_transitions(partials, user_maps):
+    # ユーザーごとに、シャードを最初のスタンプの時刻順（同時刻はシャードの順）に並べてつなぐ
+    shard = np.concatenate([np.full(len(m), i, dtype=np.int64) for i, m in enumerate(user_maps)])
+    user = np.concatenate(user_maps)
+    first_key, last_key = (np.concatenate([p[k] for p in partials]) for k in ("first_key", "last_key"))
+    order = np.lexsort((shard, first_key, user))
+    user, shard, first_key, last_key = user[order], shard[order], first_key[order], last_key[order]
+    first_point = np.concatenate([p["first_point"] for p in partials])[order]
+    last_point = np.concatenate([p["last_point"] for p in partials])[order]
+
+    prev = np.flatnonzero(user[1:] == user[:-1])
+    nxt = prev + 1
+    # 連結して並べ替えたときに前のシャードの行がすべて先に来るなら、境界の 2 行が隣り合う
+    ordered = (last_key[prev] < first_key[nxt]) | ((last_key[prev] == first_key[nxt]) & (shard[prev] < shard[nxt]))
+    if not ordered.all():
+        raise OverlappingShardsError("a user's stamps interleave across shards")
+    return (shard[prev], last_point[prev], last_key[prev]), (shard[nxt], first_point[nxt], first_key[nxt])
+
+
+def merge_partials(partials):
+    """shard_partial の結果を合併し、count_transitions と同じ形式の dict を返す。
+
+    partials はシャードを連結する順に並べる。時刻の範囲が重なるユーザーがいれば OverlappingShardsError。
+    """
+    points = pd.factorize(np.concatenate([p["points"] for p in partials]), sort=True)[1]
+    _, users = pd.factorize(np.concatenate([p["users"] for p in partials]))
+    n_points, n_users = len(points), max(len(users), 1)
+    point_maps = [pd.Index(points).get_indexer(p["points"]).astype(np.int64) for p in partials]
+    user_maps = [pd.Index(users).get_indexer(p["users"]).astype(np.int64) for p in partials]
+
+    def remap(point_map, codes):
+        # シャード内のポイントID → 合併後のポイントID（欠損の -1 はそのまま）
+        codes = np.asarray(codes, dtype=np.int64)
+        return np.where(codes >= 0, point_map[np.maximum(codes, 0)] if len(point_map) else codes, -1)
+
+    node_order = appearance_order(np.concatenate([remap(pm, p["node_order"])
+                                                  for p, pm in zip(partials, point_maps)]))
+
+    # シャードをまたぐ遷移
+    (prev_shard, prev_point, prev_key), (next_shard, next_point, next_key) = _boundary_transitions(partials,
+                                                                                                   user_maps)
+    all_maps = np.concatenate(point_maps + [np.zeros(1, dtype=np.int64)])
+    offsets = np.r_[0, np.cumsum([len(m) for m in point_maps])]
+    src = np.where(prev_point >= 0, all_maps[offsets[prev_shard] + np.maximum(prev_point, 0)], -1)
+    dst = np.where(next_point >= 0, all_maps[offsets[next_shard] + np.maximum(next_point, 0)], -1)
+    valid = (src >= 0) & (dst >= 0)
+    src, dst = src[valid], dst[valid]
+    ns = [np.where(k == _NAT_KEY, _INVALID_NS, k)[valid] for k in (prev_key, next_key)]
+    crossing_times = travel_time_table(src, dst, gap_ms(*ns), n_points)
+
+    edge_from, edge_to, edge_weight = edge_arrays(
+        np.concatenate([remap(pm, p["edge_from"]) for p, pm in zip(partials, point_maps)] + [src]),
+        np.concatenate([remap(pm, p["edge_to"]) for p, pm in zip(partials, point_maps)] + [dst]),
+        n_points,
+        weights=np.concatenate([p["edge_weight"] for p in partials] + [np.ones(len(src), dtype=np.int64)]),
+    )
+    tables = [{**{key: p[key] for key in TIME_KEYS},
+               "time_from": remap(pm, p["time_from"]), "time_to": remap(pm, p["time_to"])}
+              for p, pm in zip(partials, point_maps)]
+
+    counts = {
+        "points": np.asarray(points),
+        "node_order": node_order,
+        "edge_from": edge_from,
+        "edge_to": edge_to,
+        "edge_weight": edge_weight,
+        **merge_travel_times(tables + [crossing_times], n_points),
+    }
+    if all("visit_point" in p for p in partials):
+        # ユニーク訪問者数は (ポイント, ユーザー) の組の和集合から数える
+        visits = np.unique(np.concatenate([remap(pm, p["visit_point"]) * n_users + um[p["visit_user"]]
+                                           for p, pm, um in zip(partials, point_maps, user_maps)]))
+        counts["node_counts"] = np.bincount(visits // n_users, minlength=n_points).astype(np.int64)
+    return counts
+
+
+def _load_shard(path):
+    # プロセスプールで実行する: CSV を読み込んで部分集計を作る
+    from src.batch import load_stamp_csv
+
+    try:
+        df = load_stamp_csv(path)
+    except ValueError as e:
+        return {"path": path, "error": str(e)}
+    return {"path": path, "df": df, "partial": shard_partial(df)}
+
+
+def ingest_shards(source, workers=None):
+    """CSV のパスのリスト（またはそれを置いたディレクトリ）を 1 つのデータセットとして集計する。
+
+    シャードの読み込みと部分集計はプロセスプールで並列に行う。戻り値の dict:
+        df      : 全シャードを連結した DataFrame
+        counts  : count_transitions と同じ形式の集計結果
+        errors  : 読み込めなかったシャード（パス → メッセージ）
+        stitched: シャードの部分集計を合併したか（False は重なりのため連結したデータから数え直した）
+    """
+    paths = shard_paths(source) if isinstance(source, str) and os.path.isdir(source) else list(source)
+    if workers == 1 or len(paths) <= 1:
+        loaded = [_load_shard(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(_load_shard, paths))
+
+    shards = [item for item in loaded if "error" not in item]
+    errors = {item["path"]: item["error"] for item in loaded if "error" in item}
+    if not shards:
+        raise ValueError("読み込めるCSVファイルがありません。")
+    df = pd.concat([item["df"] for item in shards], ignore_index=True)
+    try:
+        counts, stitched = merge_partials([item["partial"] for item in shards]), True
+    except OverlappingShardsError:
+        counts, stitched = count_transitions(df), False
+    return {"df": df, "counts": counts, "errors": errors, "stitched": stitched}
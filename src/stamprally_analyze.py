@@ -1,208 +1,145 @@
+"""スタンプラリーの人流分析（集計部分）。
+
+描画（matplotlib / streamlit_agraph）は src.stamprally_render にあり、
+ここでは numpy と pandas だけを読み込む。networkx はグラフを作るときに読み込む。
+"""
+import numpy as np
 import pandas as pd
-import networkx as nx
-from sklearn.preprocessing import LabelEncoder
-import matplotlib.pyplot as plt
-import matplotlib_fontja
-from io import BytesIO
-from streamlit_agraph import agraph, Node, Edge, Config
-
-def build_graph(df):
-    points = df["point"].unique()
-    encoder = LabelEncoder()
-    point_ids = encoder.fit_transform(points)
-    point_to_id = dict(zip(points, point_ids))
-    # id_to_point = dict(zip(point_ids, points))
-
-    node_counts = df.groupby("point")["user_id"].nunique().to_dict()
-
-    df_sorted = df.sort_values(["user_id", "timestamp"])
-    edges = []
-    for user, group in df_sorted.groupby("user_id"):
-        pts = group["point"].tolist()
-        for i in range(len(pts) - 1):
-            edges.append((pts[i], pts[i + 1]))
-
-    edges_df = pd.DataFrame(edges, columns=["from", "to"])
-    edge_counts = edges_df.value_counts().reset_index(name="weight")
+from src.travel_time import edge_travel_stats, gap_ms, timestamp_ns, travel_time_table
+
+def sort_key(values):
+    # 並べ替え用の整数キー（欠損値は pandas の sort_values と同様に末尾へ）
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            # タイムゾーン付きの時刻は UTC に揃えて比べる
+            values = values.dt.tz_convert(None)
+        keys = values.to_numpy().view("int64").copy()
+        keys[values.isna().to_numpy()] = np.iinfo(np.int64).max
+        return keys
+    codes, _ = pd.factorize(values, sort=True)
+    keys = codes.astype(np.int64)
+    keys[codes < 0] = np.iinfo(np.int64).max
+    return keys
+
+def appearance_order(point_codes):
+    # 出現順のポイントID（df["point"].unique() の順序）
+    observed = point_codes[point_codes >= 0]
+    _, first_index = np.unique(observed, return_index=True)
+    return observed[np.sort(first_index)]
+
+def visitor_counts(point_codes, user_codes, n_points, n_users):
+    # ポイントごとのユニーク訪問者数（groupby().nunique() 相当）
+    node_counts = np.zeros(n_points, dtype=np.int64)
+    valid = (point_codes >= 0) & (user_codes >= 0)
+    if valid.any():
+        # np.unique は値の種類が多いと遅いので、並べ替えて隣と異なる値だけを残す
+        pairs = np.sort(point_codes[valid].astype(np.int64) * n_users + user_codes[valid])
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+        node_counts += np.bincount(pairs // n_users, minlength=n_points)
+    return node_counts
+
+def transition_index(sorted_points, sorted_users):
+    # user_id, timestamp 順に並んだ行のうち、同じユーザーの次の行への遷移になる行の位置
+    same_user = sorted_users[1:] == sorted_users[:-1]
+    return np.flatnonzero(same_user & (sorted_points[:-1] >= 0) & (sorted_points[1:] >= 0))
+
+def transition_pairs(sorted_points, sorted_users):
+    # user_id, timestamp 順に並んだ行から、同じユーザーで隣り合う行の組を遷移として取り出す
+    rows = transition_index(sorted_points, sorted_users)
+    return sorted_points[rows], sorted_points[rows + 1]
+
+def edge_arrays(src, dst, n_points, weights=None):
+    # 遷移の組を集計し、移動数の降順（同数は (from, to) の昇順）に並べる
+    keys = src.astype(np.int64) * n_points + dst
+    if weights is None:
+        unique_keys, weights = np.unique(keys, return_counts=True)
+    else:
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.bincount(inverse, weights=weights, minlength=len(unique_keys)).astype(np.int64)
+    by_weight = np.argsort(-weights, kind="stable")
+    unique_keys = unique_keys[by_weight]
+    return unique_keys // max(n_points, 1), unique_keys % max(n_points, 1), weights[by_weight]
+
+def count_transitions(df, visitors=True):
+    """ポイント・ユーザーを整数コード化し、配列演算だけで遷移数を集計する。
+
+    visitors=False なら訪問者数を数えず、戻り値に node_counts を含めない
+    （訪問者数を src.visitor_sketch で近似する場合）。
+
+    戻り値の dict:
+        points      : ポイント名の配列（ソート済み。添字がポイントID）
+        node_order  : データ中の出現順に並べたポイントID
+        node_counts : ポイントIDごとのユニーク訪問者数
+        edge_from, edge_to, edge_weight : 遷移（from/to はポイントID）と移動数。
+                      移動数の降順、同数の場合は (from, to) の昇順
+        time_from, time_to, time_bucket, time_count, time_ms :
+                      遷移ごとの所要時間の対数ヒストグラム（src.travel_time を参照）
+    """
+    point_codes, points = pd.factorize(df["point"], sort=True)
+    user_codes, users = pd.factorize(df["user_id"])
+    n_points = len(points)
+
+    # user_id, timestamp の順に安定ソートし、隣り合う行の組を遷移とみなす
+    order = np.lexsort((sort_key(df["timestamp"]), user_codes))
+    order = order[user_codes[order] >= 0]
+    sorted_points = point_codes[order]
+    rows = transition_index(sorted_points, user_codes[order])
+    src, dst = sorted_points[rows], sorted_points[rows + 1]
+    edge_from, edge_to, edge_weight = edge_arrays(src, dst, n_points)
+
+    # 同じ並びのまま、隣り合うスタンプの時間差を所要時間として数える
+    ns = timestamp_ns(df["timestamp"])[order]
+    travel_times = travel_time_table(src, dst, gap_ms(ns[rows], ns[rows + 1]), n_points)
+
+    counts = {
+        "points": np.asarray(points),
+        "node_order": appearance_order(point_codes),
+        "edge_from": edge_from,
+        "edge_to": edge_to,
+        "edge_weight": edge_weight,
+        **travel_times,
+    }
+    if visitors:
+        counts["node_counts"] = visitor_counts(point_codes, user_codes, n_points, len(users))
+    return counts
+
+def graph_from_counts(counts):
+    import networkx as nx
+
+    points = counts["points"]
+    point_to_id = {p: i for i, p in enumerate(points)}
+    # 訪問者数を数えなかった集計（count_transitions の visitors=False）では None
+    node_counts = ({points[i]: int(counts["node_counts"][i]) for i in counts["node_order"]}
+                   if "node_counts" in counts else None)
 
     G = nx.DiGraph()
     # どのノードもエッジが無くてもグラフに含める（単一ノードの場合に layout 等で失敗しないようにする）
-    for p in points:
-        G.add_node(p)
-    for _, row in edge_counts.iterrows():
-        G.add_edge(row["from"], row["to"], weight=row["weight"])
+    G.add_nodes_from(points[counts["node_order"]])
+    G.add_weighted_edges_from(zip(points[counts["edge_from"]],
+                                  points[counts["edge_to"]],
+                                  counts["edge_weight"].tolist()))
+
+    # 所要時間の統計（秒）をエッジの属性にする
+    if "time_count" in counts:
+        stats = edge_travel_stats(counts)
+        for u, v, n, mean, median, p90 in zip(points[counts["edge_from"]], points[counts["edge_to"]],
+                                              stats["count"].tolist(), stats["mean"].tolist(),
+                                              stats["q50"].tolist(), stats["q90"].tolist()):
+            G[u][v].update(travel_count=n, travel_mean=mean, travel_median=median, travel_p90=p90)
 
     return G, node_counts, point_to_id
 
-def draw_graph(G, node_counts, point_to_id, pos=None):
-    # ノードラベルの準備
-    node_labels = {n: f"{n}\n{node_counts.get(n, 0)} 人" for n in G.nodes()}
-    def node_number(node):
-        return point_to_id.get(node, 0)
-
-    # エッジの分類（順方向・逆方向）
-    forward_edges, backward_edges = [], []
-    for u, v in G.edges():
-        if node_number(u) < node_number(v):
-            forward_edges.append((u, v))
-        else:
-            backward_edges.append((u, v))
-
-    # グラフの描画
-    plt.figure(figsize=(10, 7))
-    if pos is None:
-        pos = nx.spring_layout(G, seed=42)
-    max_weight = max(nx.get_edge_attributes(G, "weight").values()) if G.edges() else 1
-
-    max_node_count = max(node_counts.values()) if node_counts else 1
-    node_sizes = [node_counts.get(n, 0) / max_node_count * 2000 + 500 for n in G.nodes()]
-
-    widths_fwd = [G[u][v]["weight"] / max_weight * 5 + 1 for u, v in forward_edges]
-    widths_bwd = [G[u][v]["weight"] / max_weight * 5 + 1 for u, v in backward_edges]
-
-    nx.draw_networkx_edges(G, pos, edgelist=forward_edges, edge_color="b", width=widths_fwd, style="solid",
-                             arrowstyle="->", arrowsize=20, connectionstyle="arc3,rad=0.15")
-    nx.draw_networkx_edges(G, pos, edgelist=backward_edges, edge_color="g", width=widths_bwd, style="dashed",
-                             arrowstyle="->", arrowsize=20, connectionstyle="arc3,rad=0.15")
-    nx.draw_networkx_nodes(G, pos, node_color="skyblue", node_size=node_sizes, alpha=0.7)
-    nx.draw_networkx_labels(G, pos, labels=node_labels, font_family="IPAexGothic", font_size=10)
-
-    def make_label_dict(G, edges):
-        return {(u, v): f"{u}→{v}\n{G[u][v]['weight']} 人" for u, v in edges}
-
-    forward_labels = make_label_dict(G, forward_edges)
-    backward_labels = make_label_dict(G, backward_edges)
-
-    label_objs_fwd = nx.draw_networkx_edge_labels(G, pos, edge_labels=forward_labels,
-                                                   label_pos=0.3, font_color="b", font_family="IPAexGothic", rotate=False)
-    label_objs_bwd = nx.draw_networkx_edge_labels(G, pos, edge_labels=backward_labels,
-                                                   label_pos=0.3, font_color="g", font_family="IPAexGothic", rotate=False)
-
-    for label_dict, bg_color, border_color, linestyle in [
-        (label_objs_fwd, "white", "b", "solid"),
-        (label_objs_bwd, "white", "g", "dashed"),
-    ]:
-        for t in label_dict.values():
-            t.set_bbox(dict(facecolor=bg_color, edgecolor=border_color,
-                            boxstyle="round,pad=0.3", lw=1, linestyle=linestyle))
-
-    plt.axis("off")
-
-    # 画像の保存
-    buf = BytesIO()
-    plt.savefig(buf, format="png", bbox_inches="tight", dpi=150)
-    plt.close()
-    buf.seek(0)
-
-    # ノードの訪問者数データフレーム
-    nodes_df = pd.DataFrame({
-        'ポイント': list(G.nodes()),
-        '訪問者数': [node_counts.get(n, 0) for n in G.nodes()]
-    }).sort_values('訪問者数', ascending=False)
-
-    nodes_list = list(G.nodes())
-    if len(nodes_list) <= 1:
-        edges_matrix = pd.DataFrame(0, index=nodes_list, columns=nodes_list)
-        # index/columns の名前を削除してデフォルトに戻す
-        edges_matrix.index.name = None
-        edges_matrix.columns.name = None
-    else:
-        edges_data = []
-        for u, v in G.edges():
-            edges_data.append({
-                'From': u,
-                'To': v,
-                '移動者数': G[u][v]['weight']
-            })
-        edges_df = pd.DataFrame(edges_data)
-
-        # エッジの移動者数を二次元の表に変換
-        edges_matrix = edges_df.pivot(index='From', columns='To', values='移動者数').fillna(0)
-
-        # すべてのノードを行列に含める（ノードが一つだけでも空の行/列があるとエラーになるのを防ぐ）
-        nodes_list = list(G.nodes())
-        if len(nodes_list) > 0:
-            edges_matrix = edges_matrix.reindex(index=nodes_list, columns=nodes_list, fill_value=0)
-            # index/columns の名前を削除してデフォルトに戻す
-            edges_matrix.index.name = None
-            edges_matrix.columns.name = None
-
-    return {
-        'image': buf,
-        'nodes_data': nodes_df,
-        'edges_matrix': edges_matrix,
-        'pos': pos
-    }
+def build_graph(df, return_counts=False):
+    counts = count_transitions(df)
+    G, node_counts, point_to_id = graph_from_counts(counts)
+    if return_counts:
+        return G, node_counts, point_to_id, counts
+    return G, node_counts, point_to_id
 
-def draw_agraph(G, node_counts, point_to_id):
-    nodes = []
-    if not list(G.nodes()):
-        return None
-
-    # ノード訪問者数の正規化（サイズに反映）
-    node_counts_values = [node_counts.get(n, 0) for n in G.nodes()]
-    max_node_count = max(node_counts_values) if node_counts_values else 1
-    min_node_count = min(node_counts_values) if node_counts_values else 0
-
-    def scale_node_size(count):
-        if max_node_count == min_node_count:
-            return 20
-        # 15から35の範囲にスケーリング
-        return 15 + (count - min_node_count) / (max_node_count - min_node_count) * 20
-
-    for node_name in G.nodes():
-        count = node_counts.get(node_name, 0)
-        nodes.append(Node(id=node_name,
-                        label=f"{node_name}\n{count}人",
-                        size=scale_node_size(count)
-                        ))
-
-    edges = []
-    if list(G.edges()):
-        # エッジの重みの正規化（太さに反映）
-        weights = [data['weight'] for _, _, data in G.edges(data=True)]
-        max_weight = max(weights) if weights else 1
-        min_weight = min(weights) if weights else 1
-
-        def scale_edge_width(weight):
-            if max_weight == min_weight:
-                return 2
-            # 1から8の範囲にスケーリング
-            return 1 + (weight - min_weight) / (max_weight - min_weight) * 7
-        
-        def node_number(node):
-            return point_to_id.get(node, 0)
-
-        for u, v, data in G.edges(data=True):
-            weight = data.get('weight', 1)
-            
-            edge_kwargs = {
-                'label': str(weight),
-                'width': scale_edge_width(weight),
-                'smooth': {'enabled': True, 'roundness': 0.20, 'type': 'curvedCW'},
-            }
-
-            # 順方向と逆方向でエッジの曲げ方と色を変更
-            if node_number(u) < node_number(v):
-                # 順方向: 実線
-                edge_kwargs['dashes'] = False
-            else:
-                # 逆方向: 点線
-                edge_kwargs['dashes'] = True
-            
-            edges.append(Edge(source=u,
-                            target=v,
-                            **edge_kwargs
-                            ))
-
-    config = Config(width=800,
-                    height=700,
-                    directed=True,
-                    physics={"enabled": True, "solver": "barnesHut", "barnesHut": {"springLength": 200}},
-                    nodeHighlightBehavior=True,
-                    collapsible=False,
-                    node={'labelProperty': 'label'},
-                    link={'renderLabel': True, 'labelProperty': 'label'}
-                   )
-
-    return agraph(nodes=nodes, edges=edges, config=config)
+def __getattr__(name):
+    # 互換性のため、描画関数は従来どおりこのモジュールからも参照できるようにする（初回参照時に読み込む）
+    if name in ("draw_graph", "draw_agraph"):
+        from src import stamprally_render
+        return getattr(stamprally_render, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
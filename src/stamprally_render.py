@@ -0,0 +1,248 @@
+"""スタンプラリーの人流分析（描画部分）。
+
+matplotlib とフォント登録、streamlit_agraph は初回の描画時に読み込む。
+"""
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from src.layout import compute_layout
+from src.profiling import Profiler
+from src.travel_time import format_duration, travel_time_frame
+
+# 描画済み画像はここでは保持しない（アプリでは ResultCache に完成した画像だけを置く）
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+def _figure_class():
+    # matplotlib_fontja は読み込み時に日本語フォントを登録する
+    from matplotlib.figure import Figure
+    import matplotlib_fontja  # noqa: F401
+    return Figure
+
+def edge_label(data, show_travel_time=False):
+    # エッジに添える移動者数（と所要時間の中央値）
+    label = f"{data.get('weight', 0)} 人"
+    if show_travel_time and data.get("travel_count"):
+        label += f"\n中央値 {format_duration(data['travel_median'])}"
+    return label
+
+def _render(G, node_counts, point_to_id, pos, image_format, show_travel_time=False):
+    import matplotlib
+    import networkx as nx
+    Figure = _figure_class()
+
+    # ノードラベルの準備
+    node_labels = {n: f"{n}\n{node_counts.get(n, 0)} 人" for n in G.nodes()}
+    def node_number(node):
+        return point_to_id.get(node, 0)
+
+    # エッジの分類（順方向・逆方向）
+    forward_edges, backward_edges = [], []
+    for u, v in G.edges():
+        if node_number(u) < node_number(v):
+            forward_edges.append((u, v))
+        else:
+            backward_edges.append((u, v))
+
+    # グラフの描画（pyplot の状態を使わないので別スレッドからも描画できる）
+    fig = Figure(figsize=(10, 7))
+    ax = fig.add_subplot()
+    max_weight = max(nx.get_edge_attributes(G, "weight").values()) if G.edges() else 1
+
+    max_node_count = max(node_counts.values()) if node_counts else 1
+    node_sizes = [node_counts.get(n, 0) / max_node_count * 2000 + 500 for n in G.nodes()]
+
+    widths_fwd = [G[u][v]["weight"] / max_weight * 5 + 1 for u, v in forward_edges]
+    widths_bwd = [G[u][v]["weight"] / max_weight * 5 + 1 for u, v in backward_edges]
+
+    nx.draw_networkx_edges(G, pos, edgelist=forward_edges, edge_color="b", width=widths_fwd, style="solid",
+                             arrowstyle="->", arrowsize=20, connectionstyle="arc3,rad=0.15", ax=ax)
+    nx.draw_networkx_edges(G, pos, edgelist=backward_edges, edge_color="g", width=widths_bwd, style="dashed",
+                             arrowstyle="->", arrowsize=20, connectionstyle="arc3,rad=0.15", ax=ax)
+    nx.draw_networkx_nodes(G, pos, node_color="skyblue", node_size=node_sizes, alpha=0.7, ax=ax)
+    nx.draw_networkx_labels(G, pos, labels=node_labels, font_family="IPAexGothic", font_size=10, ax=ax)
+
+    def make_label_dict(G, edges):
+        return {(u, v): f"{u}→{v}\n{edge_label(G[u][v], show_travel_time)}" for u, v in edges}
+
+    forward_labels = make_label_dict(G, forward_edges)
+    backward_labels = make_label_dict(G, backward_edges)
+
+    label_objs_fwd = nx.draw_networkx_edge_labels(G, pos, edge_labels=forward_labels,
+                                                   label_pos=0.3, font_color="b", font_family="IPAexGothic", rotate=False, ax=ax)
+    label_objs_bwd = nx.draw_networkx_edge_labels(G, pos, edge_labels=backward_labels,
+                                                   label_pos=0.3, font_color="g", font_family="IPAexGothic", rotate=False, ax=ax)
+
+    for label_dict, bg_color, border_color, linestyle in [
+        (label_objs_fwd, "white", "b", "solid"),
+        (label_objs_bwd, "white", "g", "dashed"),
+    ]:
+        for t in label_dict.values():
+            t.set_bbox(dict(facecolor=bg_color, edgecolor=border_color,
+                            boxstyle="round,pad=0.3", lw=1, linestyle=linestyle))
+
+    ax.axis("off")
+
+    # 画像の保存（SVG は文字をパスに変換せずテキストのまま出力するので軽い）
+    buf = BytesIO()
+    with matplotlib.rc_context({"svg.fonttype": "none"}):
+        fig.savefig(buf, format=image_format, bbox_inches="tight", dpi=150)
+    return buf.getvalue()
+
+def render_graph_image(G, node_counts, point_to_id, pos, image_format="png", show_travel_time=False,
+                       profiler=None):
+    """グラフ画像（png または svg）を描画して BytesIO で返す。描画時間は profiler の "render_image" に記録する。"""
+    with (profiler or Profiler()).stage("render_image", rows=G.number_of_edges()):
+        return BytesIO(_render(G, node_counts, point_to_id, pos, image_format, show_travel_time))
+
+def submit_render(G, node_counts, point_to_id, pos, image_format="png", show_travel_time=False, profiler=None):
+    """render_graph_image を描画用スレッドで実行し、Future を返す。"""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stamprally-render")
+    return _render_executor.submit(render_graph_image, G, node_counts, point_to_id, pos, image_format,
+                                   show_travel_time, profiler)
+
+def graph_tables(G, node_counts):
+    """表示用の表（ポイントごとの訪問者数、ポイント間の所要時間）を作る。"""
+    # ノードの訪問者数データフレーム
+    nodes_df = pd.DataFrame({
+        'ポイント': list(G.nodes()),
+        '訪問者数': [node_counts.get(n, 0) for n in G.nodes()]
+    }).sort_values('訪問者数', ascending=False)
+    return {'nodes_data': nodes_df, 'travel_times': travel_time_frame(G)}
+
+def draw_graph(G, node_counts, point_to_id, pos=None, image_format="png", background=False,
+               show_travel_time=False, profiler=None):
+    """グラフ画像と表示用の表を作る。
+
+    ポイント間の移動者数の疎行列は集計結果から作る（SparseAdjacency.from_counts）ので、ここでは作らない。
+    background=True の場合、'image' は画像（BytesIO）を返す Future になり、
+    表の作成と並行して描画される。show_travel_time=True の場合はエッジに所要時間の中央値も添える。
+    """
+    if pos is None:
+        pos = compute_layout(G)
+
+    if background:
+        image = submit_render(G, node_counts, point_to_id, pos, image_format, show_travel_time, profiler)
+    else:
+        image = render_graph_image(G, node_counts, point_to_id, pos, image_format, show_travel_time, profiler)
+
+    return {'image': image, **graph_tables(G, node_counts), 'pos': pos}
+
+def draw_agraph(G, node_counts, point_to_id, show_travel_time=False, lod=None):
+    """streamlit_agraph でインタラクティブなグラフを表示し、クリックされたノードのIDを返す。
+
+    lod（src.graph_lod.reduce_graph の結果）を渡すと、簡略化したグラフを計算済みの座標に
+    固定して表示する（ブラウザ側の力学計算は行わない）。
+    """
+    from streamlit_agraph import agraph, Node, Edge, Config
+
+    if not list(G.nodes()):
+        return None
+
+    if lod is None:
+        node_items = [{"id": n, "label": f"{n}\n{node_counts.get(n, 0)}人", "count": node_counts.get(n, 0),
+                       "members": [n]} for n in G.nodes()]
+        edge_items = list(G.edges(data=True))
+    else:
+        node_items, edge_items = lod["nodes"], lod["edges"]
+
+    # ノード訪問者数の正規化（サイズに反映）
+    node_counts_values = [item["count"] for item in node_items]
+    max_node_count = max(node_counts_values) if node_counts_values else 1
+    min_node_count = min(node_counts_values) if node_counts_values else 0
+
+    def scale_node_size(count):
+        if max_node_count == min_node_count:
+            return 20
+        # 15から35の範囲にスケーリング
+        return 15 + (count - min_node_count) / (max_node_count - min_node_count) * 20
+
+    nodes = []
+    for item in node_items:
+        node_kwargs = {}
+        if lod is not None:
+            node_kwargs = {'x': item['x'], 'y': item['y'], 'fixed': True}
+            if len(item['members']) > 1:
+                # クラスタ: クリックすると中のポイントを個別に表示する
+                node_kwargs.update(shape='box', title="クリックで展開: " + ", ".join(map(str, item['members'][:20]))
+                                   + (" ..." if len(item['members']) > 20 else ""))
+        nodes.append(Node(id=item['id'],
+                        label=item['label'],
+                        size=scale_node_size(item['count']),
+                        **node_kwargs
+                        ))
+
+    # クラスタの向きはメンバーのうち最小のポイント番号で決める
+    number_of = {item['id']: min(point_to_id.get(n, 0) for n in item['members']) for item in node_items}
+
+    edges = []
+    if edge_items:
+        # エッジの重みの正規化（太さに反映）
+        weights = [data['weight'] for _, _, data in edge_items]
+        max_weight = max(weights) if weights else 1
+        min_weight = min(weights) if weights else 1
+
+        def scale_edge_width(weight):
+            if max_weight == min_weight:
+                return 2
+            # 1から8の範囲にスケーリング
+            return 1 + (weight - min_weight) / (max_weight - min_weight) * 7
+        
+        def node_number(node):
+            return number_of.get(node, 0)
+
+        for u, v, data in edge_items:
+            weight = data.get('weight', 1)
+
+            # 中央値が無い（クラスタ間で合算した）エッジは平均所要時間を添える
+            travel = ""
+            if show_travel_time and data.get('travel_count'):
+                median = format_duration(data['travel_median'])
+                travel = f"\n{median}" if median else f"\n平均 {format_duration(data['travel_mean'])}"
+            edge_kwargs = {
+                'label': str(weight) + travel,
+                'width': scale_edge_width(weight),
+                'smooth': {'enabled': True, 'roundness': 0.20, 'type': 'curvedCW'},
+            }
+
+            # マウスを重ねたときに所要時間の統計を表示
+            if data.get('travel_count'):
+                edge_kwargs['title'] = (f"{u}→{v}: {weight} 人\n"
+                                        f"平均 {format_duration(data['travel_mean'])} / "
+                                        f"中央値 {format_duration(data['travel_median'])} / "
+                                        f"90%点 {format_duration(data['travel_p90'])}")
+
+            # 順方向と逆方向でエッジの曲げ方と色を変更
+            if node_number(u) < node_number(v):
+                # 順方向: 実線
+                edge_kwargs['dashes'] = False
+            else:
+                # 逆方向: 点線
+                edge_kwargs['dashes'] = True
+            
+            edges.append(Edge(source=u,
+                            target=v,
+                            **edge_kwargs
+                            ))
+
+    if lod is None:
+        physics = {"enabled": True, "solver": "barnesHut", "barnesHut": {"springLength": 200}}
+    else:
+        # 座標は固定済みなので、ブラウザ側の力学計算（安定化の反復を含む）を止める
+        physics = False
+    config = Config(width=800,
+                    height=700,
+                    directed=True,
+                    physics=physics,
+                    stabilization=lod is None,
+                    nodeHighlightBehavior=True,
+                    collapsible=False,
+                    node={'labelProperty': 'label'},
+                    link={'renderLabel': True, 'labelProperty': 'label'}
+                   )
+
+    return agraph(nodes=nodes, edges=edges, config=config)
@@ -0,0 +1,348 @@
+"""CSV をチャンクごとに読み込み、count_transitions と同じ遷移の集計を行ごとの配列を作らずに求める。
+
+チャンク間で保持するのはユーザーごとの直前ポイント・直前時刻、訪問した (ポイント, ユーザー) の組、
+遷移ごとの件数だけなので、メモリはポイント数とユーザー数に比例し、行数には依存しない。
+ユーザーごとに時刻順で並んでいない入力は、チャンクごとに並べ替えた run をディスクに書き出し、
+一度に開く run を fan_in 個までに抑えて併合する（外部ソート）。
+
+アプリでは、アップロードされた CSV は src.ingest で一度に読み込んで Arrow 形式で保存する
+（この読み込みは行数に比例するメモリを一時的に使う）。時刻・曜日で絞り込まない集計は、
+読み込んだ DataFrame（保存済みならメモリマップ）を stream_counts にチャンクごとに渡して行う。
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.travel_time import bucket_of, gap_ms, merge_travel_times
+
+# 遷移キー (from, to) を 1 つの int64 にまとめるときのシフト幅
+_KEY_SHIFT = np.int64(1 << 32)
+# 直前のスタンプが無いことを表す値
+_NO_POINT = -2
+_NAT_KEY = np.iinfo(np.int64).max
+# 外部ソートで書き出す行。seq は入力での行の位置（同じ時刻のスタンプを入力の順に並べるため）
+_RECORD_DTYPE = np.dtype([("user", "<i8"), ("ts", "<i8"), ("seq", "<i8"), ("point", "<i8")])
+# 外部ソートで一度に併合する run の数の既定値
+DEFAULT_FAN_IN = 64
+
+
+class UnsortedInputError(Exception):
+    """ユーザーごとのタイムスタンプが昇順に並んでいない入力"""
+
+
+def _timestamp_keys(values):
+    ts = pd.to_datetime(pd.Series(values), errors="coerce")
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        # タイムゾーン付きの時刻は UTC に揃える
+        ts = ts.dt.tz_convert(None)
+    keys = ts.astype("datetime64[ns]").to_numpy().view("int64").copy()
+    keys[ts.isna().to_numpy()] = _NAT_KEY
+    return keys
+
+
+def _unique(keys):
+    # np.unique は値の種類が多いと遅いので、並べ替えて隣と異なる値だけを残す
+    keys = np.sort(keys)
+    return keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+
+
+def _valid_ns(keys):
+    # 欠損（末尾に並べるための最大値）を src.travel_time の欠損値に置き換える
+    return np.where(keys == _NAT_KEY, np.iinfo(np.int64).min, keys)
+
+
+class _Registry:
+    # 値 → 出現順の整数コード。チャンクをまたいでコードを共有する
+    def __init__(self):
+        self.index = pd.Index([])
+
+    def encode(self, values):
+        values = pd.Series(values)
+        codes = self.index.get_indexer(values)
+        new = (codes < 0) & values.notna().to_numpy()
+        if new.any():
+            added = pd.unique(values[new])
+            self.index = self.index.append(pd.Index(added))
+            codes[new] = self.index.get_indexer(values[new])
+        return codes.astype(np.int64)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class TransitionAccumulator:
+    """チャンク単位でスタンプを受け取り、訪問者集合と遷移数を積み上げる（visitors=False なら遷移数だけ）。
+
+    チャンク間で保持するのはユーザーごとの直前ポイント・直前時刻と、訪問した組・遷移ごとの件数だけなので、
+    メモリはポイント数とユーザー数に比例し、行数には依存しない。
+    """
+
+    def __init__(self, visitors=True):
+        self.track_visitors = visitors
+        self.points = _Registry()
+        self.users = _Registry()
+        self.last_point = np.empty(0, dtype=np.int64)
+        self.last_ts = np.empty(0, dtype=np.int64)
+        # 訪問した (ポイント, ユーザー) の組のキー（重複なし・昇順）と、まだ重複を除いていないチャンクごとのキー
+        self.visits = np.empty(0, dtype=np.int64)
+        self._pending_visits = []
+        # 遷移キーごとの件数（キーの昇順）
+        self.edge_keys = np.empty(0, dtype=np.int64)
+        self.edge_weights = np.empty(0, dtype=np.int64)
+        # (遷移キー, 所要時間のバケット) ごとの件数と合計ミリ秒（キー・バケットの昇順）
+        self.time_keys = np.empty(0, dtype=np.int64)
+        self.time_buckets = np.empty(0, dtype=np.int64)
+        self.time_counts = np.empty(0, dtype=np.int64)
+        self.time_ms = np.empty(0, dtype=np.int64)
+
+    def encode(self, chunk):
+        # 列をコード化して (user, point, ts) の配列を返す（欠損ユーザーの行は除外）
+        users = self.users.encode(chunk["user_id"])
+        points = self.points.encode(chunk["point"])
+        ts = _timestamp_keys(chunk["timestamp"])
+        valid = users >= 0
+        return users[valid], points[valid], ts[valid]
+
+    def add_visitors(self, users, points):
+        if not self.track_visitors:
+            return
+        has_point = points >= 0
+        self._pending_visits.append(_unique(points[has_point] * _KEY_SHIFT + users[has_point]))
+        # 溜まったキーが重複を除いた組の数を超えたらまとめる（組の数の数倍までしか保持しない）
+        if sum(len(keys) for keys in self._pending_visits) > max(len(self.visits), 1 << 16):
+            self._compact_visits()
+
+    def _compact_visits(self):
+        if self._pending_visits:
+            self.visits = _unique(np.concatenate([self.visits, *self._pending_visits]))
+            self._pending_visits = []
+
+    def _grow_state(self):
+        missing = len(self.users) - len(self.last_point)
+        if missing > 0:
+            self.last_point = np.concatenate([self.last_point, np.full(missing, _NO_POINT, dtype=np.int64)])
+            self.last_ts = np.concatenate([self.last_ts, np.full(missing, np.iinfo(np.int64).min, dtype=np.int64)])
+
+    def add_sorted(self, users, points, ts, check_order=True):
+        """ユーザーごとに時刻順で並んだ行（ユーザー同士は混在してよい）の遷移を取り込む。"""
+        self._grow_state()
+        if len(users) == 0:
+            return
+
+        # ユーザー単位にまとめる（安定ソートなのでユーザー内の順序は保たれる）
+        order = np.argsort(users, kind="stable")
+        users, points, ts = users[order], points[order], ts[order]
+        first = np.ones(len(users), dtype=bool)
+        first[1:] = users[1:] != users[:-1]
+
+        if check_order:
+            prev_ts = np.empty_like(ts)
+            prev_ts[1:] = ts[:-1]
+            prev_ts[first] = self.last_ts[users[first]]
+            if (ts < prev_ts).any():
+                raise UnsortedInputError("timestamps are not sorted within each user")
+
+        # 直前ポイント（チャンク先頭の行はチャンク間で保持した状態を使う）
+        prev_points = np.empty_like(points)
+        prev_points[1:] = points[:-1]
+        prev_points[first] = self.last_point[users[first]]
+        keep = (prev_points >= 0) & (points >= 0)
+        keys = prev_points[keep] * _KEY_SHIFT + points[keep]
+        self._add_edges(keys)
+
+        prev_ts = np.empty_like(ts)
+        prev_ts[1:] = ts[:-1]
+        prev_ts[first] = self.last_ts[users[first]]
+        self._add_times(keys, gap_ms(_valid_ns(prev_ts[keep]), _valid_ns(ts[keep])))
+
+        last = np.ones(len(users), dtype=bool)
+        last[:-1] = first[1:]
+        self.last_point[users[last]] = points[last]
+        self.last_ts[users[last]] = ts[last]
+
+    def _add_edges(self, keys):
+        keys = np.concatenate([self.edge_keys, keys])
+        weights = np.concatenate([self.edge_weights, np.ones(len(keys) - len(self.edge_keys), dtype=np.int64)])
+        order = np.argsort(keys, kind="stable")
+        keys, weights = keys[order], weights[order]
+        first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else keys
+        self.edge_keys = keys[first]
+        self.edge_weights = np.add.reduceat(weights, first) if len(first) else weights
+
+    def _add_times(self, keys, ms):
+        valid = ms >= 0
+        keys, ms = keys[valid], ms[valid]
+        n_new = len(keys)
+        keys = np.concatenate([self.time_keys, keys])
+        buckets = np.concatenate([self.time_buckets, bucket_of(ms)])
+        counts = np.concatenate([self.time_counts, np.ones(n_new, dtype=np.int64)])
+        ms = np.concatenate([self.time_ms, ms])
+        order = np.lexsort((buckets, keys))
+        keys, buckets, counts, ms = keys[order], buckets[order], counts[order], ms[order]
+        first = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (buckets[1:] != buckets[:-1])]) if len(keys) else keys
+        self.time_keys, self.time_buckets = keys[first], buckets[first]
+        self.time_counts = np.add.reduceat(counts, first) if len(first) else counts
+        self.time_ms = np.add.reduceat(ms, first) if len(first) else ms
+
+    def result(self):
+        """count_transitions と同じ形式の dict を返す。"""
+        points = np.asarray(self.points.index)
+        n_points = len(points)
+        # 出現順コード → ソート済みポイントID
+        by_name = pd.Index(points).argsort()
+        sorted_order = np.empty(n_points, dtype=np.int64)
+        sorted_order[by_name] = np.arange(n_points)
+        sorted_points = points[by_name]
+
+
+        keys, weights = self.edge_keys, self.edge_weights
+        src = sorted_order[keys // _KEY_SHIFT] if len(keys) else keys
+        dst = sorted_order[keys % _KEY_SHIFT] if len(keys) else keys
+        by_pair = np.lexsort((dst, src))
+        src, dst, weights = src[by_pair], dst[by_pair], weights[by_pair]
+        by_weight = np.argsort(-weights, kind="stable")
+
+        time_keys = self.time_keys
+        travel_times = merge_travel_times([{
+            "time_from": sorted_order[time_keys // _KEY_SHIFT] if len(time_keys) else time_keys,
+            "time_to": sorted_order[time_keys % _KEY_SHIFT] if len(time_keys) else time_keys,
+            "time_bucket": self.time_buckets,
+            "time_count": self.time_counts,
+            "time_ms": self.time_ms,
+        }], n_points)
+
+        counts = {
+            "points": sorted_points,
+            "node_order": sorted_order,
+            "edge_from": src[by_weight],
+            "edge_to": dst[by_weight],
+            "edge_weight": weights[by_weight],
+            **travel_times,
+        }
+        if self.track_visitors:
+            self._compact_visits()
+            counts["node_counts"] = np.bincount(sorted_order[self.visits // _KEY_SHIFT],
+                                                minlength=n_points).astype(np.int64)
+        return counts
+
+
+def _read_chunks(source, chunksize):
+    if isinstance(source, pd.DataFrame):
+        return (source.iloc[start:start + chunksize] for start in range(0, len(source), chunksize))
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return pd.read_csv(source, chunksize=chunksize, usecols=["user_id", "point", "timestamp"])
+
+
+def _stream_single_pass(source, chunksize, visitors):
+    acc = TransitionAccumulator(visitors)
+    for chunk in _read_chunks(source, chunksize):
+        users, points, ts = acc.encode(chunk)
+        acc.add_visitors(users, points)
+        acc.add_sorted(users, points, ts)
+    return acc.result()
+
+
+def _write_runs(source, chunksize, acc, work_dir):
+    # チャンクごとに (user, ts, seq) の順に並べ替えて、1 つの run としてディスクに書き出す
+    paths = []
+    seq = 0
+    for chunk in _read_chunks(source, chunksize):
+        users, points, ts = acc.encode(chunk)
+        acc.add_visitors(users, points)
+        records = np.empty(len(users), dtype=_RECORD_DTYPE)
+        records["user"], records["ts"], records["point"] = users, ts, points
+        records["seq"] = np.arange(seq, seq + len(users))
+        seq += len(users)
+        path = os.path.join(work_dir, f"run_{len(paths)}.bin")
+        records[np.lexsort((records["ts"], records["user"]))].tofile(path)
+        paths.append(path)
+    return paths
+
+
+def _count_not_after(records, bound):
+    # (user, ts, seq) の順に並んだ records のうち、bound 以下の行の数（先頭からの連続した範囲になる）
+    user, ts, seq = bound
+    not_after = (records["user"] < user) | ((records["user"] == user)
+                                            & ((records["ts"] < ts) | ((records["ts"] == ts) & (records["seq"] <= seq))))
+    return int(np.count_nonzero(not_after))
+
+
+def _merge_runs(paths, block_rows):
+    # run を block_rows 行ずつ読み、どの run でも読み込み済みの範囲に収まる行だけを並べ替えて順に返す。
+    # (user, ts, seq) は行ごとに異なるので、返すブロックをつなぐと全体が同じ順に並ぶ
+    files = [open(path, "rb") for path in paths]
+    try:
+        blocks = [np.fromfile(f, dtype=_RECORD_DTYPE, count=block_rows) for f in files]
+        while True:
+            active = [i for i, block in enumerate(blocks) if len(block)]
+            if not active:
+                return
+            bound = min((int(blocks[i]["user"][-1]), int(blocks[i]["ts"][-1]), int(blocks[i]["seq"][-1]))
+                        for i in active)
+            taken = []
+            for i in active:
+                n = _count_not_after(blocks[i], bound)
+                taken.append(blocks[i][:n])
+                blocks[i] = blocks[i][n:]
+                if len(blocks[i]) == 0:
+                    blocks[i] = np.fromfile(files[i], dtype=_RECORD_DTYPE, count=block_rows)
+            merged = np.concatenate(taken)
+            yield merged[np.lexsort((merged["seq"], merged["ts"], merged["user"]))]
+    finally:
+        for f in files:
+            f.close()
+
+
+def _stream_external_sort(source, chunksize, fan_in, tmp_dir, visitors):
+    # 並べ替えた run を fan_in 個ずつ併合して 1 つの run にまとめることを繰り返し、
+    # 最後の併合の出力を (user, timestamp) の順に集計する
+    acc = TransitionAccumulator(visitors)
+    block_rows = max(chunksize // fan_in, 1)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        paths = _write_runs(source, chunksize, acc, work_dir)
+        generation = 0
+        while len(paths) > fan_in:
+            merged_paths = []
+            for start in range(0, len(paths), fan_in):
+                group = paths[start:start + fan_in]
+                path = os.path.join(work_dir, f"merged_{generation}_{len(merged_paths)}.bin")
+                with open(path, "wb") as f:
+                    for block in _merge_runs(group, block_rows):
+                        block.tofile(f)
+                for done in group:
+                    os.remove(done)
+                merged_paths.append(path)
+            paths = merged_paths
+            generation += 1
+
+        # 併合したブロックは小さいので、チャンクの大きさまでまとめてから取り込む
+        pending, pending_rows = [], 0
+        for block in _merge_runs(paths, block_rows):
+            pending.append(block)
+            pending_rows += len(block)
+            if pending_rows >= chunksize:
+                records = np.concatenate(pending)
+                acc.add_sorted(records["user"], records["point"], records["ts"], check_order=False)
+                pending, pending_rows = [], 0
+        if pending:
+            records = np.concatenate(pending)
+            acc.add_sorted(records["user"], records["point"], records["ts"], check_order=False)
+    return acc.result()
+
+
+def stream_counts(source, chunksize=100_000, fan_in=DEFAULT_FAN_IN, tmp_dir=None, visitors=True):
+    """CSV をチャンクごとに読み込み、count_transitions と同じ集計結果を返す。
+
+    ユーザーごとに時刻順で並んだファイルなら 1 パスで処理する。
+    そうでない場合は先頭から読み直し、ディスク上の外部ソートで処理する
+    （source はパスか、seek 可能なファイルオブジェクトであること）。
+    source には読み込み済みの DataFrame も渡せる（chunksize 行ずつ取り出して同じように処理する）。
+    visitors=False なら count_transitions と同様に訪問者数を数えない。
+    """
+    try:
+        return _stream_single_pass(source, chunksize, visitors)
+    except UnsortedInputError:
+        return _stream_external_sort(source, chunksize, fan_in, tmp_dir, visitors)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# 時間帯ごとの来場の山（中心の時刻[時], 幅[時], 重み）
+DEFAULT_PEAKS = ((10.5, 1.0, 0.4), (14.0, 1.5, 0.45), (17.5, 0.8, 0.15))
+
+
+def _point_names(n_points):
+    width = len(str(n_points))
+    return np.array([f"P{i + 1:0{width}d}" for i in range(n_points)], dtype=object)
+
+
+def _generate_users(rng, first_user, n_users, n_points, popularity, mean_stamps, forward_prob,
+                    peaks, days, weekend_weight, start_date, interval_minutes):
+    # 1 人あたりのスタンプ数（1 以上、ポイント数の 2 倍まで）
+    lengths = np.minimum(1 + rng.poisson(mean_stamps - 1, n_users), 2 * n_points)
+    total = int(lengths.sum())
+    user_of_row = np.repeat(np.arange(n_users), lengths)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    step = np.arange(total) - np.repeat(starts, lengths)
+
+    # ルート: 多くの人は順路どおり次のポイントへ進み、残りは人気に応じて寄り道する
+    points = np.empty(total, dtype=np.int64)
+    first = step == 0
+    points[first] = rng.choice(n_points, size=int(first.sum()), p=popularity)
+    for k in range(1, int(lengths.max()) if total else 0):
+        rows = np.flatnonzero(step == k)
+        prev = points[rows - 1]
+        jump = rng.choice(n_points, size=len(rows), p=popularity)
+        forward = rng.random(len(rows)) < forward_prob
+        points[rows] = np.where(forward, (prev + 1) % n_points, jump)
+
+    # 来場日（週末は多め）と最初のスタンプ時刻（時間帯の山の混合分布）
+    dates = pd.date_range(start_date, periods=days, freq="D")
+    day_weight = np.where(dates.weekday >= 5, weekend_weight, 1.0)
+    day = rng.choice(days, size=n_users, p=day_weight / day_weight.sum())
+    centers, widths, weights = (np.array(v, dtype=float) for v in zip(*peaks))
+    peak = rng.choice(len(centers), size=n_users, p=weights / weights.sum())
+    start_seconds = np.clip(rng.normal(centers[peak], widths[peak]) * 3600, 0, 86400 - 1)
+
+    # スタンプ間隔は指数分布（最初のスタンプは 0）
+    gaps = rng.exponential(interval_minutes * 60, total)
+    gaps[first] = 0
+    elapsed = np.cumsum(gaps)
+    elapsed -= np.repeat(elapsed[starts], lengths)
+    seconds = start_seconds[user_of_row] + elapsed
+
+    timestamps = dates.values[day[user_of_row]] + (seconds * 1e9).astype("timedelta64[ns]")
+    user_names = np.char.add("U", np.char.zfill(np.arange(first_user, first_user + n_users).astype(str), 8))
+    return pd.DataFrame({
+        "user_id": user_names[user_of_row],
+        "timestamp": pd.to_datetime(timestamps).floor("s"),
+        "point": _point_names(n_points)[points],
+    })
+
+
+def iter_stamp_log(n_users=1000, n_points=20, mean_stamps=5.0, route_skew=1.0, forward_prob=0.6,
+                   peaks=DEFAULT_PEAKS, days=7, weekend_weight=2.0, start_date="2025-11-01",
+                   interval_minutes=15.0, seed=0, chunk_users=100_000, sort_by_time=False):
+    """疑似的なスタンプログを、ユーザー chunk_users 人ずつの DataFrame として順に返す。
+
+    同じ引数なら常に同じデータになる。ポイントの人気は順位の -route_skew 乗に比例し、
+    route_skew を大きくするほど一部のポイント・ルートに集中する。
+    sort_by_time=True の場合は各チャンクの中を時刻順に並べる。
+    """
+    ranks = np.arange(1, n_points + 1, dtype=float)
+    popularity = ranks ** -route_skew
+    popularity /= popularity.sum()
+
+    for chunk_index, first_user in enumerate(range(0, n_users, chunk_users)):
+        rng = np.random.default_rng([seed, chunk_index])
+        df = _generate_users(rng, first_user, min(chunk_users, n_users - first_user), n_points, popularity,
+                             mean_stamps, forward_prob, peaks, days, weekend_weight, start_date, interval_minutes)
+        if sort_by_time:
+            df = df.sort_values("timestamp", kind="stable", ignore_index=True)
+        yield df
+
+
+def generate_stamp_log(n_users=1000, **kwargs):
+    """疑似的なスタンプログを 1 つの DataFrame として返す（引数は iter_stamp_log と同じ）。"""
+    return pd.concat(list(iter_stamp_log(n_users, **kwargs)), ignore_index=True)
+
+
+def write_stamp_log_csv(path, n_users=1000, **kwargs):
+    """疑似的なスタンプログを CSV に書き出す。チャンクごとに書くので数千万行でもメモリに収まる。
+
+    書き出した行数を返す。
+    """
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, df in enumerate(iter_stamp_log(n_users, **kwargs)):
+            df.to_csv(f, index=False, header=(i == 0), date_format="%Y-%m-%d %H:%M:%S")
+            rows += len(df)
+    return rows
@@ -0,0 +1,104 @@
+"""大きな表をページ単位で表示するための検索・並べ替え・抽出。
+
+並べ替えと検索はサーバー側で行い、ブラウザには表示するページの行だけを送る。
+行数などの集計は表示するページとは別に、条件に一致した行全体から求める。
+"""
+import numpy as np
+import pandas as pd
+
+from src.stamprally_analyze import sort_key
+
+PAGE_SIZES = (50, 100, 500)
+
+
+def search_mask(df, text, columns=None):
+    """いずれかの列に text を含む行（大文字・小文字は区別しない）。
+
+    columns を省略すると、数値・日時以外の列を対象にする。値の種類ごとに 1 回だけ判定するので、
+    ユーザーIDやポイント名のように重複の多い列では行数によらず速い。
+    """
+    if columns is None:
+        columns = [c for c in df.columns
+                   if not (pd.api.types.is_numeric_dtype(df[c]) or pd.api.types.is_datetime64_any_dtype(df[c]))]
+    mask = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        codes, uniques = pd.factorize(df[column])
+        if len(uniques) == 0:
+            continue
+        hit = pd.Index(uniques).astype(str).str.contains(text, case=False, regex=False)
+        mask |= (codes >= 0) & np.asarray(hit)[np.maximum(codes, 0)]
+    return mask
+
+
+def table_order(df, sort_by=None, ascending=True, search=None, search_columns=None):
+    """検索に一致した行の位置を、sort_by 列の順（欠損は末尾、同じ値は元の順）に並べて返す。"""
+    if search:
+        rows = np.flatnonzero(search_mask(df, search, search_columns))
+    else:
+        rows = np.arange(len(df))
+    if sort_by is None or len(rows) == 0:
+        return rows
+
+    keys = sort_key(df[sort_by].iloc[rows])
+    if not ascending:
+        missing = keys == np.iinfo(np.int64).max
+        keys = -keys
+        keys[missing] = np.iinfo(np.int64).max
+    return rows[np.argsort(keys, kind="stable")]
+
+
+def sample_order(order, n, seed=0):
+    """order から n 行を無作為に選ぶ（並び順は保つ）。"""
+    if n >= len(order):
+        return order
+    picked = np.random.default_rng(seed).choice(len(order), size=n, replace=False)
+    return order[np.sort(picked)]
+
+
+def page_count(n_rows, page_size):
+    return max(1, -(-n_rows // page_size))
+
+
+def table_page(df, order, page, page_size):
+    """order のうち page 番目（0 始まり）のページの行だけを取り出す。"""
+    return df.iloc[order[page * page_size:(page + 1) * page_size]]
+
+
+def show_table(df, key, cache=None, data_key=None, page_size=100, search_columns=None):
+    """検索・並べ替え・無作為抽出つきで、表の 1 ページだけを Streamlit に表示する。
+
+    cache（ResultCache）と data_key（df の内容を表すキー）を渡すと、並べ替えた行の位置を再利用する。
+    """
+    import streamlit as st
+    from src.result_cache import content_key
+
+    columns = list(df.columns)
+    col_search, col_sort, col_dir, col_size = st.columns([3, 2, 1, 1])
+    search = col_search.text_input("検索", key=f"{key}_search", placeholder="文字列を含む行を検索")
+    sort_label = col_sort.selectbox("並べ替え", ["（元の順）"] + [str(c) for c in columns], key=f"{key}_sort")
+    ascending = col_dir.radio("順序", ["昇順", "降順"], key=f"{key}_dir", horizontal=True) == "昇順"
+    page_size = col_size.selectbox("行数", PAGE_SIZES, index=PAGE_SIZES.index(page_size)
+                                   if page_size in PAGE_SIZES else 0, key=f"{key}_size")
+    sort_by = None if sort_label == "（元の順）" else columns[[str(c) for c in columns].index(sort_label)]
+    sample = st.checkbox("無作為に抽出して表示", key=f"{key}_sample")
+
+    def compute():
+        order = table_order(df, sort_by, ascending, search, search_columns)
+        return sample_order(order, page_size) if sample else order
+
+    if cache is not None and data_key is not None:
+        order = cache.get_or_compute("table", content_key(data_key, key, sort_by, ascending, search, sample,
+                                                          page_size if sample else None), compute)
+    else:
+        order = compute()
+
+    pages = page_count(len(order), page_size)
+    page = 0
+    if pages > 1:
+        # 条件が変わってページ数が減った場合は最後のページに合わせる
+        if st.session_state.get(f"{key}_page", 1) > pages:
+            st.session_state[f"{key}_page"] = pages
+        page = int(st.number_input("ページ", min_value=1, max_value=pages, value=1, key=f"{key}_page")) - 1
+    st.dataframe(table_page(df, order, page, page_size))
+    st.caption(f"全 {len(df):,} 行中 {len(order):,} 行を表示対象（{page + 1} / {pages} ページ）")
+    return order
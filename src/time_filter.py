@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def time_to_seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def build_time_index(timestamps):
+    """時刻（秒）・曜日の整数列と、(曜日, 時刻) で並べた索引を作る。
+
+    アップロードごとに 1 回だけ作成し、フィルタ時は二分探索とマスクだけで済ませる。
+    欠損（NaT）の行は曜日・時刻とも -1 とし、どの条件にも一致しない。
+    秒未満は切り捨てて扱う。
+    """
+    timestamps = pd.Series(timestamps)
+    valid = timestamps.notna().to_numpy()
+    seconds = np.full(len(timestamps), -1, dtype=np.int32)
+    weekday = np.full(len(timestamps), -1, dtype=np.int8)
+    dt = timestamps[valid].dt
+    seconds[valid] = (dt.hour * 3600 + dt.minute * 60 + dt.second).to_numpy()
+    weekday[valid] = dt.weekday.to_numpy()
+
+    keys = weekday.astype(np.int32) * SECONDS_PER_DAY + seconds
+    keys[~valid] = -1
+    order = np.argsort(keys, kind="stable")
+    return {
+        "seconds": seconds,
+        "weekday": weekday,
+        "order": order,
+        "sorted_keys": keys[order],
+    }
+
+
+def concat_time_indexes(indexes):
+    """ファイルごとに作った時刻索引を、行を連結した順の 1 つの索引にまとめる。
+
+    曜日・時刻の抽出はやり直さず、整列済みのキーの併合（安定ソート）だけを行うので、
+    連結したデータに build_time_index を適用した結果と同じになる。
+    """
+    offsets = np.cumsum([0] + [len(index["order"]) for index in indexes])
+    sorted_keys = np.concatenate([index["sorted_keys"] for index in indexes])
+    order = np.concatenate([index["order"] + offset for index, offset in zip(indexes, offsets)])
+    merge = np.argsort(sorted_keys, kind="stable")
+    return {
+        "seconds": np.concatenate([index["seconds"] for index in indexes]),
+        "weekday": np.concatenate([index["weekday"] for index in indexes]),
+        "order": order[merge],
+        "sorted_keys": sorted_keys[merge],
+    }
+
+
+def time_filter_mask(index, start_time, end_time, weekdays=None):
+    """start_time <= 時刻 <= end_time かつ曜日が weekdays に含まれる行の真偽マスクを返す。
+
+    weekdays が空（または None）の場合は曜日で絞り込まない。
+    """
+    start = time_to_seconds(start_time)
+    end = time_to_seconds(end_time)
+    if not weekdays:
+        weekdays = range(7)
+
+    mask = np.zeros(len(index["order"]), dtype=bool)
+    for day in sorted(set(weekdays)):
+        base = day * SECONDS_PER_DAY
+        lo = np.searchsorted(index["sorted_keys"], base + start, side="left")
+        hi = np.searchsorted(index["sorted_keys"], base + end, side="right")
+        mask[index["order"][lo:hi]] = True
+    return mask
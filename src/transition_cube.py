@@ -0,0 +1,258 @@
+"""曜日 × 分 × from × to の遷移数を事前集計したキューブ。
+
+遷移は「同じ日の中の遷移」と「日をまたぐ遷移」に分けて扱う。
+
+同じ日の中の遷移は、出発時刻の分（切り捨て）と到着時刻の分（切り上げ）のバケットに数える。
+時刻範囲で絞り込むと同じ日のスタンプは連続した区間として残るので、遷移が残る条件は
+「出発 >= 開始」かつ「到着 <= 終了」になる。遷移を (曜日, from, to, 所要時間のバケット) の
+グループに分け、グループごとに出発・到着の分の累積和を持っておくと、区間内の件数は
+
+    到着 <= 終了 の件数 - 出発 < 開始 の件数 + (出発 < 開始 かつ 到着 > 終了) の件数
+
+で求まる。最後の項は絞り込みの区間より長くかかった遷移だけなので、所要時間の長い順に並べた
+先頭から取り出す。区間が短くてこの項の候補が多い場合は、到着時刻の区間を直接切り出す。
+
+日をまたぐ遷移（複数の日に記録のあるユーザーの、ある日の最後のスタンプから次の日の
+最初のスタンプへの遷移）は残る日によって変わるので、そのユーザーの行から問い合わせ時に数える。
+開始・終了が分単位でない問い合わせも、行から数える。
+"""
+import numpy as np
+import pandas as pd
+
+from src.stamprally_analyze import (
+    appearance_order, edge_arrays, sort_key, transition_index, visitor_counts,
+)
+from src.time_filter import SECONDS_PER_DAY, time_filter_mask, time_to_seconds
+from src.travel_time import N_BUCKETS, bucket_of, gap_ms, merge_travel_times, timestamp_ns, travel_time_table
+
+MINUTES_PER_DAY = 24 * 60
+# 分のバケットは 0〜MINUTES_PER_DAY（到着は切り上げるので 24:00 を含む）
+_STRIDE = MINUTES_PER_DAY + 1
+
+
+def _local_days(timestamps):
+    # 日付（1970-01-01 からの日数）。タイムゾーン付きの時刻はその地域の日付にする
+    ts = pd.Series(timestamps)
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        ts = ts.dt.tz_localize(None)
+    return ts.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def _prefix(values):
+    # 先頭に 0 を付けた累積和（区間 [lo, hi) の和が c[hi] - c[lo] になる）
+    return np.r_[np.zeros(1, dtype=np.int64), np.cumsum(values, dtype=np.int64)]
+
+
+def build_transition_cube(df, time_index):
+    """曜日 × 分 × from × to の遷移数を疎な形で事前集計する。
+
+    戻り値の dict の主なキー:
+        group_weekday, group_from, group_to, group_bucket : グループ（曜日の順に並ぶ）
+        entry_group, entry_departure, entry_arrival, entry_count, entry_ms :
+            (グループ, 出発の分, 到着の分) ごとの件数と所要時間の合計ミリ秒
+        row_order, row_ns   : 時刻の分かる行の (ユーザー, 時刻) 順の並びと時刻（ナノ秒）
+        cross_positions     : row_order のうち、複数の日に記録のあるユーザーの行の位置
+    """
+    point_codes, points = pd.factorize(df["point"], sort=True)
+    user_codes, users = pd.factorize(df["user_id"])
+    n_points = len(points)
+    seconds = time_index["seconds"]
+    weekday = time_index["weekday"]
+
+    # 時刻が欠損した行はどの絞り込みにも含まれないので対象外
+    rows = np.flatnonzero((weekday >= 0) & (user_codes >= 0))
+    ts_keys = sort_key(df["timestamp"])
+    order = rows[np.lexsort((ts_keys[rows], user_codes[rows]))]
+    sorted_users = user_codes[order]
+    ns = timestamp_ns(df["timestamp"])[order]
+    days = _local_days(df["timestamp"])[order]
+
+    # 同じユーザーで隣り合う行の組のうち、同じ日のもの
+    pair = np.flatnonzero(sorted_users[1:] == sorted_users[:-1])
+    same_day = days[pair] == days[pair + 1]
+    multi_day = np.zeros(len(users), dtype=bool)
+    multi_day[sorted_users[pair[~same_day]]] = True
+
+    pair = pair[same_day]
+    prev_rows, next_rows = order[pair], order[pair + 1]
+    src, dst = point_codes[prev_rows].astype(np.int64), point_codes[next_rows].astype(np.int64)
+    keep = (src >= 0) & (dst >= 0)
+    pair, prev_rows, next_rows, src, dst = pair[keep], prev_rows[keep], next_rows[keep], src[keep], dst[keep]
+    ms = gap_ms(ns[pair], ns[pair + 1])
+    departure = seconds[prev_rows].astype(np.int64) // 60
+    arrival = -(-seconds[next_rows].astype(np.int64) // 60)
+
+    # (曜日, from, to, 所要時間のバケット) のグループと、(グループ, 出発, 到着) ごとの件数・合計
+    group_keys, group = np.unique(
+        ((weekday[next_rows].astype(np.int64) * max(n_points, 1) + src) * max(n_points, 1) + dst) * N_BUCKETS
+        + bucket_of(ms), return_inverse=True)
+    entry_keys, entry = np.unique((group * _STRIDE + departure) * _STRIDE + arrival, return_inverse=True)
+    entry_count = np.bincount(entry, minlength=len(entry_keys)).astype(np.int64)
+    entry_ms = np.bincount(entry, weights=ms, minlength=len(entry_keys)).astype(np.int64)
+    entry_group, entry_departure = np.divmod(entry_keys // _STRIDE, _STRIDE)
+    entry_arrival = entry_keys % _STRIDE
+
+    pair_keys, group_bucket = np.divmod(group_keys, N_BUCKETS)
+    group_weekday_from, group_to = np.divmod(pair_keys, max(n_points, 1))
+    group_weekday, group_from = np.divmod(group_weekday_from, max(n_points, 1))
+
+    # グループごとの累積和: 出発の分の順（entry_keys の順）と到着の分の順
+    by_arrival = np.lexsort((entry_arrival, entry_group))
+    # 所要時間（分）の短い順と、(曜日, 到着の分) の順
+    by_duration = np.argsort(entry_arrival - entry_departure, kind="stable")
+    by_weekday_arrival = np.lexsort((entry_arrival, group_weekday[entry_group]))
+
+    return {
+        "points": np.asarray(points),
+        "point_codes": point_codes,
+        "user_codes": user_codes,
+        "n_users": len(users),
+        "group_weekday": group_weekday,
+        "group_from": group_from,
+        "group_to": group_to,
+        "group_bucket": group_bucket,
+        "weekday_groups": np.searchsorted(group_weekday, np.arange(8)),
+        "entry_group": entry_group,
+        "entry_departure": entry_departure,
+        "entry_arrival": entry_arrival,
+        "departure_keys": entry_group * _STRIDE + entry_departure,
+        "departure_count": _prefix(entry_count),
+        "departure_ms": _prefix(entry_ms),
+        "arrival_keys": (entry_group * _STRIDE + entry_arrival)[by_arrival],
+        "arrival_count": _prefix(entry_count[by_arrival]),
+        "arrival_ms": _prefix(entry_ms[by_arrival]),
+        "duration_order": by_duration,
+        "durations": (entry_arrival - entry_departure)[by_duration],
+        "weekday_arrival_order": by_weekday_arrival,
+        "weekday_arrival_keys": (group_weekday[entry_group] * _STRIDE + entry_arrival)[by_weekday_arrival],
+        "entry_count": entry_count,
+        "entry_ms": entry_ms,
+        "row_order": order,
+        "row_ns": ns,
+        "row_days": days,
+        "cross_positions": np.flatnonzero(multi_day[sorted_users]),
+    }
+
+
+def _minute_range(start_time, end_time):
+    # 開始・終了が分単位なら (開始の分, 終了の分) を返す（23:59:59 は終日の終わりとして扱う）
+    start, end = time_to_seconds(start_time), time_to_seconds(end_time)
+    if end == SECONDS_PER_DAY - 1:
+        end = SECONDS_PER_DAY
+    if start % 60 or end % 60:
+        return None
+    return start // 60, end // 60
+
+
+def _group_sums(cube, weekdays, start, end, use_prefix=None):
+    # 選んだ曜日のグループごとの、出発 >= start かつ 到着 <= end の遷移の件数と合計ミリ秒
+    # （use_prefix を省略すると、累積和と直接の切り出しのうち扱う件数の少ない方を使う）
+    n_groups = len(cube["group_weekday"])
+    selected = np.zeros(7, dtype=bool)
+    selected[list(weekdays)] = True
+    bounds = cube["weekday_groups"]
+    groups = np.concatenate([np.arange(bounds[d], bounds[d + 1]) for d in sorted(set(weekdays))])
+    count = np.zeros(n_groups, dtype=np.int64)
+    ms = np.zeros(n_groups, dtype=np.int64)
+
+    # 区間より長くかかった遷移（出発 < start かつ 到着 > end）の候補
+    long_entries = cube["duration_order"][np.searchsorted(cube["durations"], end - start + 2):]
+    # 到着時刻の区間を直接切り出す場合の件数
+    keys = cube["weekday_arrival_keys"]
+    direct = [(np.searchsorted(keys, d * _STRIDE + start), np.searchsorted(keys, d * _STRIDE + end, side="right"))
+              for d in sorted(set(weekdays))]
+
+    if use_prefix is None:
+        use_prefix = sum(hi - lo for lo, hi in direct) > len(long_entries) + len(groups)
+    if not use_prefix:
+        entries = np.concatenate([cube["weekday_arrival_order"][lo:hi] for lo, hi in direct])
+        entries = entries[cube["entry_departure"][entries] >= start]
+    else:
+        # 累積和: 到着 <= end の件数 - 出発 < start の件数
+        base = groups * _STRIDE
+        for name, bound, side, factor in (("arrival", end, "right", 1), ("departure", start, "left", -1)):
+            lo = np.searchsorted(cube[f"{name}_keys"], base)
+            hi = np.searchsorted(cube[f"{name}_keys"], base + bound, side=side)
+            count[groups] += factor * (cube[f"{name}_count"][hi] - cube[f"{name}_count"][lo])
+            ms[groups] += factor * (cube[f"{name}_ms"][hi] - cube[f"{name}_ms"][lo])
+        # 区間より長くかかった遷移は両方で引かれているので足し戻す
+        entries = long_entries[(cube["entry_departure"][long_entries] < start)
+                               & (cube["entry_arrival"][long_entries] > end)
+                               & selected[cube["group_weekday"][cube["entry_group"][long_entries]]]]
+    count += np.bincount(cube["entry_group"][entries], weights=cube["entry_count"][entries],
+                                minlength=n_groups).astype(np.int64)
+    ms += np.bincount(cube["entry_group"][entries], weights=cube["entry_ms"][entries],
+                             minlength=n_groups).astype(np.int64)
+    groups = groups[count[groups] > 0]
+    return groups, count[groups], ms[groups]
+
+
+def _row_transitions(cube, mask, positions, cross_day_only):
+    # 行から数える遷移（cross_day_only のときは日をまたぐものだけ）
+    point_codes = cube["point_codes"]
+    positions = positions[mask[cube["row_order"][positions]]]
+    rows = cube["row_order"][positions]
+    pairs = transition_index(point_codes[rows], cube["user_codes"][rows])
+    if cross_day_only:
+        days = cube["row_days"][positions]
+        pairs = pairs[days[pairs] != days[pairs + 1]]
+    ns = cube["row_ns"][positions]
+    src, dst = point_codes[rows][pairs], point_codes[rows][pairs + 1]
+    return src, dst, gap_ms(ns[pairs], ns[pairs + 1])
+
+
+def query_transition_cube(cube, time_index, start_time, end_time, weekdays=None, mask=None, visitors=True):
+    """絞り込み後のデータに対する count_transitions と同じ結果をキューブから求める。
+
+    mask には time_filter_mask の結果を渡せる（省略時はここで計算する）。
+    visitors=False なら count_transitions と同様に node_counts を含めない。
+    """
+    if mask is None:
+        mask = time_filter_mask(time_index, start_time, end_time, weekdays)
+    if not weekdays:
+        weekdays = range(7)
+    n_points = len(cube["points"])
+
+    srcs, dsts, weights, times = [], [], [], []
+    minutes = _minute_range(start_time, end_time)
+    if minutes is None:
+        # 分単位でない区間は、すべての遷移を行から数える
+        src, dst, ms = _row_transitions(cube, mask, np.arange(len(cube["row_order"])), cross_day_only=False)
+    else:
+        groups, count, ms = _group_sums(cube, weekdays, *minutes)
+        srcs.append(cube["group_from"][groups])
+        dsts.append(cube["group_to"][groups])
+        weights.append(count)
+        times.append({"time_from": srcs[-1], "time_to": dsts[-1], "time_bucket": cube["group_bucket"][groups],
+                      "time_count": count, "time_ms": ms})
+        # 日をまたぐ遷移は、複数の日に記録のあるユーザーの行から数える
+        src, dst, ms = _row_transitions(cube, mask, cube["cross_positions"], cross_day_only=True)
+    srcs.append(src)
+    dsts.append(dst)
+    weights.append(np.ones(len(src), dtype=np.int64))
+    times.append(travel_time_table(src, dst, ms, n_points))
+
+    # 絞り込み後に現れるポイントだけで ID を振り直す（ソート順は保たれる）
+    point_codes = cube["point_codes"]
+    filtered_points = point_codes[mask]
+    present = np.unique(filtered_points[filtered_points >= 0])
+    # 末尾の要素は欠損ポイント（コード -1）を -1 のまま残すためのもの
+    remap = np.full(n_points + 1, -1, dtype=np.int64)
+    remap[present] = np.arange(len(present))
+    filtered_points = remap[filtered_points]
+
+    edge_from, edge_to, edge_weight = edge_arrays(remap[np.concatenate(srcs).astype(np.int64)],
+                                                  remap[np.concatenate(dsts).astype(np.int64)],
+                                                  len(present), weights=np.concatenate(weights))
+    counts = {
+        "points": cube["points"][present],
+        "node_order": appearance_order(filtered_points),
+        "edge_from": edge_from,
+        "edge_to": edge_to,
+        "edge_weight": edge_weight,
+        **merge_travel_times(times, len(present), remap=remap),
+    }
+    if visitors:
+        counts["node_counts"] = visitor_counts(filtered_points, cube["user_codes"][mask], len(present),
+                                               cube["n_users"])
+    return counts
@@ -0,0 +1,147 @@
+"""遷移ごとの所要時間（隣り合うスタンプの時間差）の集計。
+
+所要時間は対数スケールのバケット（相対誤差 RELATIVE_ACCURACY）に数え、
+(from, to, バケット) ごとの件数と合計ミリ秒だけを持つ。1 つの遷移あたりの行数は
+バケット数（N_BUCKETS）以下に収まり、件数・合計どうしを足すだけで結果を合併できる。
+中央値などの分位点はバケットの代表値で近似する（誤差は RELATIVE_ACCURACY 以内）。
+"""
+import numpy as np
+import pandas as pd
+
+RELATIVE_ACCURACY = 0.02
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+# これより長い所要時間は最後のバケットにまとめる
+MAX_SECONDS = 7 * 24 * 3600
+# バケット 0 は 1 秒未満、バケット b (>= 1) は (γ^(b-2), γ^(b-1)] 秒
+N_BUCKETS = int(np.ceil(np.log(MAX_SECONDS) / np.log(_GAMMA))) + 2
+_INVALID = np.iinfo(np.int64).min
+TIME_KEYS = ("time_from", "time_to", "time_bucket", "time_count", "time_ms")
+
+
+def timestamp_ns(values):
+    """日時の列をナノ秒の int64 にする（欠損は負の最小値）。"""
+    ts = pd.to_datetime(pd.Series(values), errors="coerce")
+    if isinstance(ts.dtype, pd.DatetimeTZDtype):
+        # タイムゾーン付きの時刻は UTC に揃える
+        ts = ts.dt.tz_convert(None)
+    ns = ts.astype("datetime64[ns]").to_numpy().view("int64").copy()
+    ns[ts.isna().to_numpy()] = _INVALID
+    return ns
+
+
+def gap_ms(prev_ns, next_ns):
+    """2 つの時刻の差（ミリ秒）。どちらかが欠損、または負の差なら -1。"""
+    valid = (prev_ns != _INVALID) & (next_ns != _INVALID) & (next_ns >= prev_ns)
+    return np.where(valid, (next_ns - np.where(valid, prev_ns, 0)) // 1_000_000, -1)
+
+
+def bucket_of(ms):
+    """所要時間（ミリ秒）のバケット番号。"""
+    seconds = np.asarray(ms, dtype=np.float64) / 1000
+    with np.errstate(divide="ignore"):
+        buckets = np.ceil(np.log(np.maximum(seconds, 1)) / np.log(_GAMMA)).astype(np.int64) + 1
+    buckets[seconds < 1] = 0
+    return np.minimum(buckets, N_BUCKETS - 1)
+
+
+def bucket_seconds(buckets):
+    """バケットの代表値（秒）。区間の上下端との相対誤差が RELATIVE_ACCURACY になる値。"""
+    buckets = np.asarray(buckets, dtype=np.int64)
+    values = 2 * _GAMMA ** (buckets - 1) / (_GAMMA + 1)
+    return np.where(buckets == 0, 0.0, values)
+
+
+def travel_time_table(src, dst, ms, n_points):
+    """遷移ごとの所要時間（ミリ秒）を (from, to, バケット) ごとの件数・合計ミリ秒にまとめる。
+
+    ms が負の遷移（時刻が欠損）は数えない。戻り値は TIME_KEYS をキーとする dict
+    （from, to, バケットの昇順）。
+    """
+    ms = np.asarray(ms, dtype=np.int64)
+    valid = ms >= 0
+    return merge_travel_times([{
+        "time_from": np.asarray(src, dtype=np.int64)[valid],
+        "time_to": np.asarray(dst, dtype=np.int64)[valid],
+        "time_bucket": bucket_of(ms[valid]),
+        "time_count": np.ones(int(valid.sum()), dtype=np.int64),
+        "time_ms": ms[valid],
+    }], n_points)
+
+
+def merge_travel_times(tables, n_points, remap=None):
+    """複数の所要時間の表を合併する。remap を渡すとポイントID を remap[id] に付け替える。"""
+    src, dst, bucket, count, ms = (np.concatenate([np.asarray(t[key], dtype=np.int64) for t in tables])
+                                   for key in TIME_KEYS)
+    if remap is not None:
+        src, dst = remap[src], remap[dst]
+
+    keys = (src * max(n_points, 1) + dst) * N_BUCKETS + bucket
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    pair, bucket = np.divmod(unique_keys, N_BUCKETS)
+    return {
+        "time_from": pair // max(n_points, 1),
+        "time_to": pair % max(n_points, 1),
+        "time_bucket": bucket,
+        "time_count": np.bincount(inverse, weights=count, minlength=len(unique_keys)).astype(np.int64),
+        "time_ms": np.bincount(inverse, weights=ms, minlength=len(unique_keys)).astype(np.int64),
+    }
+
+
+def edge_travel_stats(counts, quantiles=(0.5, 0.9)):
+    """count_transitions の結果から、edge_from / edge_to と同じ並びの所要時間の統計を返す。
+
+    戻り値の dict: count（所要時間の分かる遷移数）, mean（秒）, 分位点ごとの "q50" などのキー（秒）。
+    所要時間の分からない遷移は count が 0、他は NaN。
+    """
+    n_points = max(len(counts["points"]), 1)
+    pair = counts["time_from"] * n_points + counts["time_to"]
+    first = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]]) if len(pair) else np.empty(0, dtype=np.int64)
+    group_pair = pair[first]
+    group_count = np.add.reduceat(counts["time_count"], first) if len(first) else np.empty(0, dtype=np.int64)
+    group_ms = np.add.reduceat(counts["time_ms"], first) if len(first) else np.empty(0, dtype=np.int64)
+
+    stats = {"count": group_count, "mean": group_ms / np.maximum(group_count, 1) / 1000}
+    # 分位点: 表全体の累積件数から、各遷移の順位 ceil(q * 件数) に当たるバケットを二分探索する
+    cumulative = np.cumsum(counts["time_count"])
+    before = cumulative[first] - counts["time_count"][first] if len(first) else group_count
+    for q in quantiles:
+        rank = before + np.maximum(np.ceil(q * group_count).astype(np.int64), 1)
+        rows = np.searchsorted(cumulative, rank, side="left")
+        stats[f"q{round(q * 100)}"] = bucket_seconds(counts["time_bucket"][rows]) if len(rows) else np.empty(0)
+
+    # 遷移の並びに合わせる
+    edge_pair = counts["edge_from"] * n_points + counts["edge_to"]
+    position = np.searchsorted(group_pair, edge_pair)
+    found = position < len(group_pair)
+    found[found] = group_pair[position[found]] == edge_pair[found]
+    result = {}
+    for name, values in stats.items():
+        aligned = np.full(len(edge_pair), 0 if name == "count" else np.nan,
+                          dtype=np.int64 if name == "count" else np.float64)
+        aligned[found] = values[position[found]]
+        result[name] = aligned
+    return result
+
+
+def format_duration(seconds):
+    """所要時間を「12分」「1時間5分」「45秒」のように表す（NaN は空文字）。"""
+    if seconds is None or not np.isfinite(seconds):
+        return ""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}秒"
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f"{minutes}分"
+    return f"{minutes // 60}時間{minutes % 60}分"
+
+
+def travel_time_frame(G):
+    """グラフのエッジの所要時間の統計を表にする（時間は分単位）。"""
+    rows = [(u, v, d.get("weight", 0), d.get("travel_count", 0), d.get("travel_mean", np.nan),
+             d.get("travel_median", np.nan), d.get("travel_p90", np.nan)) for u, v, d in G.edges(data=True)]
+    df = pd.DataFrame(rows, columns=['From', 'To', '移動者数', '所要時間の件数', '平均所要時間(分)',
+                                     '所要時間の中央値(分)', '所要時間の90%点(分)'])
+    for column in ('平均所要時間(分)', '所要時間の中央値(分)', '所要時間の90%点(分)'):
+        df[column] = (df[column].astype(float) / 60).round(1)
+    return df
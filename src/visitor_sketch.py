@@ -0,0 +1,253 @@
+"""HyperLogLog によるユニーク訪問者数の近似。
+
+ユーザーIDを 64 ビットのハッシュにし、ポイントごとに 2**precision 個のレジスタ（uint8）だけを持つ。
+レジスタどうしは要素ごとの最大値で合併でき、合併しても誤差は変わらない。
+標準誤差はおよそ 1.04 / sqrt(2**precision)（precision=10 で約 3.3%、14 で約 0.8%）。
+
+build_visitor_sketches は ポイント × (曜日, 時) と ポイント × (曜日, 分) ごとのレジスタを事前に作っておき、
+query_visitor_sketches は絞り込み条件に完全に含まれる時間帯のレジスタと、範囲の端の時間帯のうち
+完全に含まれる分のレジスタを合併する。スケッチは行ごとの値を持たないので、大きさはセルの数で頭打ちになる。
+範囲の端が分の途中（アプリのスライダーでは終了時刻の分）のときは、その秒の範囲の行だけを
+時刻索引の二分探索で取り出して足す。結果は絞り込み後の行から直接作ったレジスタと一致する。
+ほとんどのセルは訪問者が少なくレジスタの大半が 0 なので、値のあるレジスタだけを
+(セル, レジスタ番号, 値) の組で持ち、密な配列は組の方が大きくなるセルにだけ割り当てる。
+"""
+import numpy as np
+import pandas as pd
+
+from src.time_filter import time_to_seconds
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+DEFAULT_PRECISION = 12
+HOURS_PER_WEEK = 7 * 24
+MINUTES_PER_WEEK = 7 * 24 * 60
+SECONDS_PER_DAY = 24 * 60 * 60
+# 疎な表現の 1 項目のバイト数（ポイント int32・時間帯 int16・レジスタ番号 uint16・値 uint8）
+SPARSE_ENTRY_BYTES = 9
+# スケッチの形式の版（形式を変えたら上げて、保存済みのスケッチを使わないようにする）
+SKETCH_VERSION = 2
+# 問い合わせで一度に合併する密なレジスタのバイト数（取り出す行の一時配列の大きさを抑える）
+_MERGE_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def standard_error(precision):
+    """レジスタ数 2**precision の HyperLogLog の標準誤差（相対値）。"""
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+def precision_for_error(error):
+    """標準誤差が error 以下になる最小の precision（MIN_PRECISION〜MAX_PRECISION に収める）。"""
+    precision = int(np.ceil(2 * np.log2(1.04 / error)))
+    return min(max(precision, MIN_PRECISION), MAX_PRECISION)
+
+
+def user_hashes(values):
+    """ユーザーIDの 64 ビットハッシュ（プロセスやファイルによらず同じ値になる）。"""
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+def _bit_length(x):
+    # uint64 の各要素のビット長（0 は 0）
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= (np.uint64(1) << np.uint64(shift))
+        length[big] += shift
+        x[big] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+def register_updates(hashes, precision):
+    """ハッシュごとのレジスタ番号（上位 precision ビット）と値（残りのビットの先頭の 0 の数 + 1）。"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    rest_bits = 64 - precision
+    index = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << rest_bits) - 1)
+    return index, (rest_bits - _bit_length(rest) + 1).astype(np.uint8)
+
+
+def sketch(groups, hashes, n_groups, precision):
+    """グループ（ポイントなど）ごとのレジスタ（n_groups × 2**precision の uint8）を作る。"""
+    registers = np.zeros((n_groups, 2 ** precision), dtype=np.uint8)
+    index, rho = register_updates(hashes, precision)
+    np.maximum.at(registers, (np.asarray(groups, dtype=np.int64), index), rho)
+    return registers
+
+
+def estimate(registers):
+    """レジスタ（最後の軸が 2**precision）からユニーク数を推定する。"""
+    registers = np.asarray(registers)
+    m = registers.shape[-1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=-1)
+    # 小さい値は空のレジスタの割合から数える（linear counting）
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def _cell_registers(point, cell, index, rho, n_cells, precision):
+    # (ポイントID, セル) ごとのレジスタを、値のあるレジスタの組（疎）と密な配列に分ける
+    m = 2 ** precision
+    # (セル, レジスタ番号) ごとの最大値: 値を下位 6 ビットに入れたキーを並べ、各組の最後を取る
+    keys = np.sort(((point * n_cells + cell) * m + index) * 64 + rho)
+    entry = keys // 64
+    last = np.r_[entry[1:] != entry[:-1], True] if len(entry) else np.zeros(0, dtype=bool)
+    entry, entry_rho = entry[last], (keys[last] % 64).astype(np.uint8)
+    entry_cell, entry_index = entry // m, entry % m
+
+    # 項目が密なレジスタより大きくなるセルだけ密にする
+    cell_start = np.flatnonzero(np.r_[True, entry_cell[1:] != entry_cell[:-1]]) if len(entry) else entry
+    cells = entry_cell[cell_start]
+    sizes = np.diff(np.r_[cell_start, len(entry)])
+    dense_cells = cells[sizes * SPARSE_ENTRY_BYTES > m]
+    is_dense = np.isin(entry_cell, dense_cells)
+    registers = np.zeros((len(dense_cells), m), dtype=np.uint8)
+    registers[np.searchsorted(dense_cells, entry_cell[is_dense]), entry_index[is_dense]] = entry_rho[is_dense]
+    sparse_cell = entry_cell[~is_dense]
+    return {
+        "dense_point": dense_cells // n_cells,
+        "dense_cell": dense_cells % n_cells,
+        "dense_registers": registers,
+        "sparse_point": (sparse_cell // n_cells).astype(np.int32),
+        "sparse_cell": (sparse_cell % n_cells).astype(np.int16),
+        "sparse_index": entry_index[~is_dense].astype(np.uint16 if precision <= 16 else np.int64),
+        "sparse_rho": entry_rho[~is_dense],
+    }
+
+
+def _row_updates(df, points, precision):
+    # 行ごとのポイントID（欠損は len(points)）・レジスタ番号・値と、ユーザーが欠損していない行の真偽
+    users = df["user_id"]
+    index, rho = register_updates(user_hashes(users), precision)
+    point = pd.Index(points).get_indexer(df["point"]).astype(np.int64)
+    point[point < 0] = len(points)
+    return point, index, rho, users.notna().to_numpy()
+
+
+def build_visitor_sketches(df, time_index, precision=DEFAULT_PRECISION):
+    """ポイント × (曜日, 時) と ポイント × (曜日, 分) ごとのレジスタを作る。
+
+    戻り値の dict:
+        points  : ポイント名の配列（ソート済み。添字がポイントID。ID = ポイント数 は全ポイント合計）
+        hours   : (ポイントID, 曜日 * 24 + 時) のセルのレジスタ
+        minutes : (ポイントID, 曜日 * 1440 + 分) のセルのレジスタ
+    セルのレジスタの dict:
+        dense_point, dense_cell, dense_registers : 値のあるレジスタが多いセルの密なレジスタ
+        sparse_point, sparse_cell, sparse_index, sparse_rho :
+                  それ以外のセルの、値のあるレジスタ（セルとレジスタ番号の組ごとに最大値）
+    行ごとの値は持たないので、大きさは行数が増えてもポイント数 × セル数 × 2**precision を超えない。
+    precision を上げても密なレジスタはそれに見合う項目数のセルにしか割り当てない。
+    """
+    points = pd.factorize(df["point"], sort=True)[1]
+    n_points = len(points)
+    point, index, rho, has_user = _row_updates(df, points, precision)
+
+    # 各行は自分のポイントと全ポイント合計（ID = n_points）の両方に数える（時刻・ユーザーの欠損した行は除く）
+    rows = np.flatnonzero((time_index["weekday"] >= 0) & has_user)
+    weekday = time_index["weekday"][rows].astype(np.int64)
+    seconds = time_index["seconds"][rows].astype(np.int64)
+    point = np.concatenate([point[rows], np.full(len(rows), n_points)])
+    index, rho = np.tile(index[rows], 2), np.tile(rho[rows], 2)
+    hour, minute = np.tile(weekday * 24 + seconds // 3600, 2), np.tile(weekday * 1440 + seconds // 60, 2)
+
+    return {
+        "precision": precision,
+        "points": np.asarray(points),
+        "hours": _cell_registers(point, hour, index, rho, HOURS_PER_WEEK, precision),
+        "minutes": _cell_registers(point, minute, index, rho, MINUTES_PER_WEEK, precision),
+    }
+
+
+def _full_cells(start_time, end_time, weekdays, cell_seconds):
+    # 時刻範囲と曜日の条件に丸ごと含まれる cell_seconds 秒ごとのセルの真偽配列
+    start, end = time_to_seconds(start_time), time_to_seconds(end_time)
+    per_day = SECONDS_PER_DAY // cell_seconds
+    cells = np.arange(per_day)
+    inside = (cells * cell_seconds >= start) & ((cells + 1) * cell_seconds - 1 <= end)
+    full = np.zeros(7 * per_day, dtype=bool)
+    for day in sorted(set(weekdays or range(7))):
+        full[day * per_day:(day + 1) * per_day] = inside
+    return full
+
+
+def full_hours(start_time, end_time, weekdays=None):
+    """時刻範囲と曜日の条件に丸ごと含まれる (曜日, 時) の真偽配列（長さ 168）。"""
+    return _full_cells(start_time, end_time, weekdays, 3600)
+
+
+def partial_minute_ranges(start_time, end_time):
+    """時刻範囲のうち、丸ごとは含まれない分に当たる秒の範囲 [(開始秒, 終了秒), ...]（両端を含む）。"""
+    start, end = time_to_seconds(start_time), time_to_seconds(end_time)
+    if start > end:
+        return []
+    first_full = -(-start // 60) * 60
+    last_full = (end + 1) // 60 * 60 - 1
+    if first_full > last_full:
+        return [(start, end)]
+    return [(lo, hi) for lo, hi in ((start, first_full - 1), (last_full + 1, end)) if lo <= hi]
+
+
+def _merge_cells(registers, cells, selected):
+    # selected（セルごとの真偽）のセルのレジスタを合併する（密なレジスタは少しずつ取り出す）
+    m = registers.shape[1]
+    dense = np.flatnonzero(selected[cells["dense_cell"]])
+    step = max(1, _MERGE_CHUNK_BYTES // m)
+    for i in range(0, len(dense), step):
+        chunk = dense[i:i + step]
+        np.maximum.at(registers, cells["dense_point"][chunk], cells["dense_registers"][chunk])
+    chosen = selected[cells["sparse_cell"]]
+    np.maximum.at(registers, (cells["sparse_point"][chosen], cells["sparse_index"][chosen]),
+                  cells["sparse_rho"][chosen])
+
+
+def query_visitor_sketches(sketches, start_time, end_time, weekdays=None, df=None, time_index=None):
+    """start_time <= 時刻 <= end_time かつ曜日が weekdays に含まれる行の、ポイントごとと全体のレジスタを返す。
+
+    戻り値の dict: points（ポイント名）, registers（ポイントID ごと。最後の行が全ポイント合計）。
+    範囲の端が分の途中なら、スケッチを作った df と time_index からその秒の範囲の行を足す
+    （渡されていなければ ValueError）。
+    """
+    n_points = len(sketches["points"])
+    precision = sketches["precision"]
+    registers = np.zeros((n_points + 1, 2 ** precision), dtype=np.uint8)
+
+    # 丸ごと含まれる時間帯は時のセル、それ以外の時間帯で丸ごと含まれる分は分のセルから合併する
+    hours = full_hours(start_time, end_time, weekdays)
+    _merge_cells(registers, sketches["hours"], hours)
+    minutes = _full_cells(start_time, end_time, weekdays, 60) & ~np.repeat(hours, 60)
+    _merge_cells(registers, sketches["minutes"], minutes)
+
+    ranges = partial_minute_ranges(start_time, end_time)
+    if not ranges:
+        return {"points": sketches["points"], "registers": registers}
+    if df is None or time_index is None:
+        raise ValueError("the time range starts or ends within a minute; pass df and time_index")
+    # 分の途中の範囲は、時刻索引で該当する行だけを取り出して足す
+    keys = time_index["sorted_keys"]
+    positions = np.concatenate([time_index["order"][np.searchsorted(keys, day * SECONDS_PER_DAY + lo, side="left"):
+                                                    np.searchsorted(keys, day * SECONDS_PER_DAY + hi, side="right")]
+                                for day in sorted(set(weekdays or range(7))) for lo, hi in ranges])
+    point, index, rho, has_user = _row_updates(df.iloc[positions], sketches["points"], precision)
+    point, index, rho = point[has_user], index[has_user], rho[has_user]
+    np.maximum.at(registers, (point, index), rho)
+    np.maximum.at(registers[n_points], index, rho)
+    return {"points": sketches["points"], "registers": registers}
+
+
+def merge_visitor_registers(results):
+    """query_visitor_sketches の結果（ファイルごとなど）をポイント名で突き合わせて合併する。"""
+    points = pd.factorize(np.concatenate([r["points"] for r in results]), sort=True)[1]
+    registers = np.zeros((len(points) + 1, results[0]["registers"].shape[1]), dtype=np.uint8)
+    for r in results:
+        ids = np.r_[pd.Index(points).get_indexer(r["points"]), len(points)]
+        np.maximum.at(registers, ids, r["registers"])
+    return {"points": np.asarray(points), "registers": registers}
+
+
+def visitor_estimates(result):
+    """レジスタからポイントごとの推定訪問者数（dict）と全体の推定ユーザー数を返す。"""
+    counts = np.rint(estimate(result["registers"])).astype(np.int64)
+    return dict(zip(result["points"].tolist(), counts[:-1].tolist())), int(counts[-1])
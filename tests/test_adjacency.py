@@ -0,0 +1,54 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.adjacency import SparseAdjacency
+from src.stamprally_analyze import build_graph
+
+
+@pytest.fixture
+def graph():
+    rng = np.random.default_rng(4)
+    n = 500
+    df = pd.DataFrame({
+        'user_id': rng.integers(0, 60, n),
+        'point': rng.choice([f'P{i}' for i in range(8)], n),
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 86400, n), unit='s'),
+    })
+    return build_graph(df, return_counts=True)
+
+
+def test_to_frame_matches_dense_pivot(graph):
+    G, _, _, counts = graph
+    edges = pd.DataFrame([(u, v, d['weight']) for u, v, d in G.edges(data=True)], columns=['From', 'To', 'w'])
+    nodes = list(G.nodes())
+    expected = edges.pivot(index='From', columns='To', values='w').fillna(0).reindex(index=nodes, columns=nodes, fill_value=0)
+
+    for adjacency in (SparseAdjacency.from_graph(G), SparseAdjacency.from_counts(counts)):
+        frame = adjacency.to_frame()
+        assert list(frame.index) == nodes
+        assert list(frame.columns) == nodes
+        assert np.array_equal(frame.to_numpy(), expected.to_numpy().astype(np.int64))
+        assert adjacency.nnz == G.number_of_edges()
+
+
+def test_to_networkx_round_trip(graph):
+    G = graph[0]
+    H = SparseAdjacency.from_graph(G).to_networkx()
+
+    assert list(H.nodes()) == list(G.nodes())
+    # 移動者数以外の属性（所要時間など）は隣接行列に含まれない
+    assert {(u, v): w for u, v, w in H.edges(data="weight")} == {(u, v): w for u, v, w in G.edges(data="weight")}
+
+
+def test_page_slices_rows_and_columns(graph):
+    adjacency = SparseAdjacency.from_graph(graph[0])
+    full = adjacency.to_frame()
+
+    block = adjacency.page(1, page_size=3, col_page=2, col_page_size=3)
+
+    assert adjacency.page_count(3) == 3
+    assert block.equals(full.iloc[3:6, 6:9])
@@ -0,0 +1,110 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import datetime
+
+import pandas as pd
+import pytest
+from src import batch
+from src.stamprally_analyze import build_graph
+from src.synthetic import generate_stamp_log
+from src.time_filter import build_time_index, time_filter_mask
+
+
+def test_parse_specs():
+    assert batch.parse_time_range("09:00-12:30") == (datetime.time(9, 0), datetime.time(12, 30))
+    assert batch.parse_weekdays("all") == []
+    assert batch.parse_weekdays("sun,5") == [5, 6]
+    assert batch.job_label(datetime.time(9, 0), datetime.time(12, 0), [5, 6]) == "0900-1200_sat-sun"
+    with pytest.raises(ValueError):
+        batch.parse_time_range("09:00")
+    with pytest.raises(ValueError):
+        batch.parse_weekdays("holiday")
+
+
+def test_run_batch_matches_build_graph(tmp_path):
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    for seed in range(2):
+        generate_stamp_log(200, n_points=8, seed=seed).to_csv(in_dir / f"day{seed}.csv", index=False)
+    (in_dir / "broken.csv").write_text("a,b\n1,2\n", encoding="utf-8")
+
+    out_dir = tmp_path / "out"
+    code = batch.main([str(in_dir), str(out_dir), "--time", "09:00-12:00", "--time", "13:00-18:00",
+                       "--weekdays", "all", "--weekdays", "sat,sun", "--image", "svg", "--workers", "2"])
+
+    # 読み込めないファイルはサマリにエラーとして残り、終了コードは 1
+    assert code == 1
+    summary = pd.read_csv(out_dir / "summary.csv", keep_default_na=False)
+    assert len(summary) == 2 * 2 * 2 + 1
+    assert summary.loc[summary["file"] == "broken", "error"].str.contains("user_id").all()
+
+    df = pd.read_csv(in_dir / "day1.csv")
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    mask = time_filter_mask(build_time_index(df["timestamp"]), datetime.time(13, 0), datetime.time(18, 0), [5, 6])
+    G, node_counts, _ = build_graph(df[mask])
+
+    job_dir = out_dir / "day1" / "1300-1800_sat-sun"
+    edges = pd.read_csv(job_dir / "edges.csv")
+    nodes = pd.read_csv(job_dir / "nodes.csv")
+    assert {(u, v, w) for u, v, w in edges.itertuples(index=False)} == set(G.edges(data="weight"))
+    assert dict(zip(nodes["ポイント"], nodes["訪問者数"])) == node_counts
+    assert (job_dir / "graph.svg").exists()
+
+
+def test_shards_are_analyzed_as_one_dataset(tmp_path):
+    in_dir = tmp_path / "daily"
+    in_dir.mkdir()
+    df = generate_stamp_log(200, n_points=8, seed=3).sort_values("timestamp", kind="stable")
+    for i, (_, day) in enumerate(df.groupby(df["timestamp"].dt.floor("D"), sort=True)):
+        day.to_csv(in_dir / f"day{i}.csv", index=False)
+
+    out_dir = tmp_path / "out"
+    assert batch.main([str(in_dir), str(out_dir), "--shards", "--workers", "2", "--image", "svg"]) == 0
+
+    combined = pd.concat([batch.load_stamp_csv(p) for p in sorted(in_dir.glob("*.csv"))], ignore_index=True)
+    G, node_counts, _ = build_graph(combined)
+    job_dir = out_dir / "daily" / "0000-2359_all"
+    edges = pd.read_csv(job_dir / "edges.csv")
+    nodes = pd.read_csv(job_dir / "nodes.csv")
+    assert {(u, v, w) for u, v, w in edges.itertuples(index=False)} == set(G.edges(data="weight"))
+    assert dict(zip(nodes["ポイント"], nodes["訪問者数"])) == node_counts
+    assert (job_dir / "graph.svg").exists()
+
+
+def test_overlapping_shards_fall_back_to_concatenated_rows(tmp_path):
+    in_dir = tmp_path / "terminals"
+    in_dir.mkdir()
+    # 端末ごとのファイル: 同じユーザーのスタンプが 2 つのファイルに交互に入る
+    df = generate_stamp_log(100, n_points=6, seed=4)
+    df.iloc[0::2].to_csv(in_dir / "a.csv", index=False)
+    df.iloc[1::2].to_csv(in_dir / "b.csv", index=False)
+
+    out_dir = tmp_path / "out"
+    assert batch.main([str(in_dir), str(out_dir), "--shards", "--workers", "1", "--time", "10:00-16:00"]) == 0
+
+    combined = pd.concat([batch.load_stamp_csv(p) for p in sorted(in_dir.glob("*.csv"))], ignore_index=True)
+    mask = time_filter_mask(build_time_index(combined["timestamp"]), datetime.time(10, 0), datetime.time(16, 0), [])
+    G, _, _ = build_graph(combined[mask])
+    edges = pd.read_csv(out_dir / "terminals" / "1000-1600_all" / "edges.csv")
+    assert {(u, v, w) for u, v, w in edges.itertuples(index=False)} == set(G.edges(data="weight"))
+
+
+def test_failed_job_is_reported_in_summary(tmp_path):
+    csv_path = tmp_path / "day.csv"
+    generate_stamp_log(200, n_points=8, seed=3).to_csv(csv_path, index=False)
+    out_dir = tmp_path / "out"
+    # 出力先と同じ名前のファイルがあると、そのジョブだけ書き込めない
+    (out_dir / "day").mkdir(parents=True)
+    (out_dir / "day" / "0900-1200_all").write_text("", encoding="utf-8")
+
+    code = batch.main([str(csv_path), str(out_dir), "--time", "09:00-12:00", "--time", "13:00-18:00",
+                       "--workers", "2"])
+
+    # 他のジョブは続けて実行し、サマリも書き出す
+    assert code == 1
+    summary = pd.read_csv(out_dir / "summary.csv", keep_default_na=False).set_index("label")
+    assert summary.loc["0900-1200_all", "error"].startswith("FileExistsError")
+    assert summary.loc["1300-1800_all", "error"] == ""
+    assert (out_dir / "day" / "1300-1800_all" / "edges.csv").exists()
@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+from src.adjacency import SparseAdjacency
+from src.export import iter_combined_csv, make_combined_csv, spool_export, write_combined_csv, write_export_bundle
+from src.stamprally_analyze import build_graph
+from src.synthetic import generate_stamp_log
+
+
+def make_inputs(df):
+    G, node_counts, _ = build_graph(df)
+    nodes_df = pd.DataFrame({'ポイント': list(G.nodes()), '訪問者数': [node_counts[n] for n in G.nodes()]})
+    return nodes_df, SparseAdjacency.from_graph(G), G.number_of_edges()
+
+
+def test_streamed_csv_matches_single_string():
+    df = generate_stamp_log(300, n_points=12)
+    nodes_df, adjacency, moves = make_inputs(df)
+    # 以前の実装と同じく、各セクションを丸ごと CSV 化して連結したもの
+    expected = "\n".join([
+        "# Analysis summary",
+        pd.DataFrame([["analysis_time", "x"], ["total_users", 1], ["total_stamps", 2], ["total_moves", moves]],
+                     columns=["metric", "value"]).to_csv(index=False),
+        "# Nodes (ポイントごとの訪問者数)", nodes_df.to_csv(index=False),
+        "\n# Edges (ポイント間の移動者数 行:from 列:to)", adjacency.to_frame().to_csv(),
+        "\n# Filtered raw data (利用したデータ)", df.to_csv(index=False),
+    ]).encode("utf-8-sig")
+
+    chunks = list(iter_combined_csv(df, nodes_df, adjacency, "x", 1, 2, moves, chunk_rows=7))
+    assert len(chunks) > 10
+    assert b"".join(chunks) == expected
+    assert make_combined_csv(df, nodes_df, adjacency.to_frame(), "x", 1, 2, moves) == expected
+
+
+def test_chunks_keep_column_wide_datetime_format():
+    # 一部のチャンクが 0 時ちょうどだけでも、列全体と同じ表記で書く
+    df = pd.DataFrame({
+        "user_id": ["A", "A", "B", "B"],
+        "timestamp": pd.to_datetime(["2025-11-01 00:00", "2025-11-01 00:00", "2025-11-01 10:30", "2025-11-01 11:00"]),
+        "point": ["P1", "P2", "P1", "P2"],
+    })
+    nodes_df, adjacency, moves = make_inputs(df)
+
+    streamed = b"".join(iter_combined_csv(df, nodes_df, adjacency, "x", 2, 4, moves, chunk_rows=2))
+    assert streamed.endswith(df.to_csv(index=False, header=False).encode("utf-8"))
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_export_bundle_has_one_file_per_section(file_format):
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+    df = generate_stamp_log(100, n_points=6)
+    nodes_df, adjacency, moves = make_inputs(df)
+
+    buf = io.BytesIO()
+    write_export_bundle(buf, df, nodes_df, adjacency, "x", 1, len(df), moves, file_format=file_format, chunk_rows=30)
+
+    with zipfile.ZipFile(buf) as zf:
+        names = zf.namelist()
+        assert names == [f"{s}.{file_format}" for s in ("summary", "nodes", "edges", "filtered_data")]
+        data = io.BytesIO(zf.read(f"filtered_data.{file_format}"))
+    if file_format == "parquet":
+        restored = pd.read_parquet(data)
+    else:
+        restored = pd.read_csv(data, encoding="utf-8-sig", parse_dates=["timestamp"])
+    pd.testing.assert_frame_equal(restored, df, check_dtype=False)
+
+
+def test_export_bundle_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        write_export_bundle(io.BytesIO(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), "x", 0, 0, 0,
+                            file_format="xlsx")
+
+
+def test_spooled_export_is_read_from_a_temporary_file():
+    df = generate_stamp_log(300, n_points=12)
+    nodes_df, adjacency, moves = make_inputs(df)
+
+    f = spool_export(write_combined_csv, df, nodes_df, adjacency, "x", 1, 2, moves, chunk_rows=7)
+    # st.download_button がそのまま読み込める読み取り用のファイルで、閉じると一時ファイルも消える
+    assert isinstance(f, io.BufferedReader)
+    assert f.read() == make_combined_csv(df, nodes_df, adjacency.to_frame(), "x", 1, 2, moves)
+    f.close()
+    assert not os.path.exists(f.name)
@@ -0,0 +1,77 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+import pandas as pd
+from src.graph_lod import reduce_graph, screen_positions
+from src.layout import compute_layout
+from src.stamprally_analyze import build_graph
+from src.synthetic import generate_stamp_log
+
+
+def make_graph(n_points=80):
+    df = generate_stamp_log(2000, n_points=n_points, seed=3)
+    G, node_counts, _ = build_graph(df)
+    return G, node_counts, compute_layout(G)
+
+
+def test_small_graph_is_unchanged():
+    df = pd.DataFrame({
+        "user_id": [1, 1, 2, 2],
+        "point": ["A", "B", "B", "C"],
+        "timestamp": pd.to_datetime(["2025-11-01 10:00", "2025-11-01 10:05", "2025-11-01 10:10",
+                                     "2025-11-01 10:20"]),
+    })
+    G, node_counts, _ = build_graph(df)
+    pos = {"A": (0.0, 0.0), "B": (1.0, 0.0), "C": (1.0, 1.0)}
+
+    lod = reduce_graph(G, node_counts, pos)
+    assert sorted(n["id"] for n in lod["nodes"]) == ["A", "B", "C"]
+    assert sorted((u, v) for u, v, _ in lod["edges"]) == [("A", "B"), ("B", "C")]
+    assert lod["clusters"] == {} and lod["hidden_edges"] == 0
+    # 画面座標は中心が原点で、y は下向き
+    assert screen_positions(pos, ["A", "C"]) == {"A": (-300.0, 300.0), "C": (300.0, -300.0)}
+
+
+def test_budgets_and_clusters_preserve_totals():
+    G, node_counts, pos = make_graph()
+    lod = reduce_graph(G, node_counts, pos, max_nodes=10, max_edges=30, max_clusters=4)
+
+    ids = [n["id"] for n in lod["nodes"]]
+    assert len(ids) == len(set(ids)) <= 10 + len(lod["clusters"]) + 4
+    assert len(lod["edges"]) == 30
+    weights = [d["weight"] for _, _, d in lod["edges"]]
+    assert weights == sorted(weights, reverse=True)
+
+    # どのポイントもちょうど 1 つのノードに含まれ、訪問者数の多い 10 個は個別に表示される
+    members = [m for n in lod["nodes"] for m in n["members"]]
+    assert sorted(members) == sorted(G.nodes())
+    top = sorted(G.nodes(), key=lambda n: -node_counts[n])[:10]
+    assert set(top) <= set(ids)
+    assert all(n["count"] == sum(node_counts[m] for m in n["members"]) for n in lod["nodes"])
+
+    # 表示したエッジと省略したエッジで、元のエッジをちょうど数え尽くす
+    assert sum(d["merged_edges"] for _, _, d in lod["edges"]) + lod["hidden_edges"] == G.number_of_edges()
+
+    # エッジの budget を外せば、合算後の移動数の合計はクラスタ内の移動を除いた合計と等しい
+    full = reduce_graph(G, node_counts, pos, max_nodes=10, max_edges=10**6, max_clusters=4)
+    owner = {m: n["id"] for n in full["nodes"] for m in n["members"]}
+    inside = sum(d["weight"] for u, v, d in G.edges(data=True)
+                 if owner[u] == owner[v] and owner[u] in full["clusters"])
+    assert sum(d["weight"] for _, _, d in full["edges"]) == G.size(weight="weight") - inside
+
+
+def test_expanding_a_cluster_shows_its_members():
+    G, node_counts, pos = make_graph()
+    lod = reduce_graph(G, node_counts, pos, max_nodes=10, max_clusters=4)
+    cluster_id, members = next(iter(lod["clusters"].items()))
+
+    expanded = reduce_graph(G, node_counts, pos, max_nodes=10, max_clusters=4, expanded=members)
+    ids = {n["id"] for n in expanded["nodes"]}
+    assert set(members) <= ids
+    assert cluster_id not in expanded["clusters"]
+    # 座標は展開前後で変わらない
+    before = {n["id"]: (n["x"], n["y"]) for n in lod["nodes"] if n["id"] not in lod["clusters"]}
+    after = {n["id"]: (n["x"], n["y"]) for n in expanded["nodes"]}
+    assert all(np.allclose(after[k], v) for k, v in before.items())
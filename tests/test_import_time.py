@@ -0,0 +1,43 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import json
+import subprocess
+
+# src.stamprally_analyze の読み込みにかけてよい時間（numpy / pandas の読み込みは除く）
+# 描画ライブラリを読み込むと数秒かかるため、それらを読み込んでいないことの確認を兼ねる
+IMPORT_TIME_BUDGET_SEC = 0.25
+HEAVY_MODULES = ["matplotlib", "matplotlib_fontja", "sklearn", "streamlit", "streamlit_agraph", "networkx", "scipy"]
+
+SCRIPT = """
+import json, sys, time
+import numpy, pandas
+start = time.perf_counter()
+import src.stamprally_analyze
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_import():
+    root = os.path.join(os.path.dirname(__file__), "..")
+    out = subprocess.run([sys.executable, "-c", SCRIPT], cwd=root, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_core_import_skips_rendering_libraries():
+    assert measure_import()["loaded"] == []
+
+
+def test_core_import_within_budget():
+    # 一時的な揺らぎを避けるため、3回のうち最速の値で判定する
+    elapsed = min(measure_import()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET_SEC
+
+
+def test_render_functions_still_available_from_core_module():
+    import src.stamprally_analyze as core
+    from src.stamprally_render import draw_graph
+
+    assert core.draw_graph is draw_graph
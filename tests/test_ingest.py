@@ -0,0 +1,112 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from src import ingest
+from src.stamprally_analyze import build_graph, count_transitions
+from src.synthetic import generate_stamp_log
+
+
+@pytest.mark.parametrize("values, expected", [
+    (["2025-11-01 10:00", "2025-11-01T10:00:05.250"], "ISO8601"),
+    (["11/30/2025 10:00:00", "12/01/2025 09:00:00"], "%m/%d/%Y %H:%M:%S"),
+    (["30/11/2025 10:00", "01/12/2025 09:00"], "%d/%m/%Y %H:%M"),
+    (["2025年11月1日 10:00", "2025年11月2日 9:30"], "%Y年%m月%d日 %H:%M"),
+    # 解釈できない値が混じっていても、大半を解釈できる書式を選ぶ
+    (["11/30/2025 10:00:00", "bad", None], "%m/%d/%Y %H:%M:%S"),
+])
+def test_detect_timestamp_format(values, expected):
+    assert ingest.detect_timestamp_format(values) == expected
+
+
+def test_bad_rows_are_reported_and_excluded():
+    text = ("user_id,timestamp,point\n"
+            "A,2025-11-01 08:15,P1\n"
+            "A,bad,P2\n"
+            ",2025-11-01 09:00,P1\n"
+            "B,,P3\n"
+            "B,2025-11-01 09:30,\n"
+            "B,2025-11-01 10:00,P2\n")
+    result = ingest.read_stamps(StringIO(text))
+
+    df = result["df"]
+    assert df["user_id"].tolist() == ["A", "B"]
+    assert isinstance(df["user_id"].dtype, pd.CategoricalDtype)
+    assert isinstance(df["point"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(df["timestamp"])
+    assert result["bad_rows"][["レコード番号", "理由"]].values.tolist() == [
+        [2, "timestamp を解釈できません"], [3, "user_id が空です"], [4, "timestamp が空です"], [5, "point が空です"],
+    ]
+    assert result["bad_rows"]["timestamp"].tolist()[0] == "bad"
+
+    with pytest.raises(ValueError):
+        ingest.read_stamps(StringIO("user_id,point\nA,P1\n"))
+
+
+def test_bad_rows_are_numbered_by_record_across_multiline_fields():
+    text = ('user_id,timestamp,point\n'
+            'A,2025-11-01 08:15,"P1\nannex"\n'
+            'A,bad,P2\n')
+    result = ingest.read_stamps(StringIO(text))
+
+    # 引用符の中の改行でファイルの行（4 行目）とはずれるが、レコードとしては 2 件目
+    assert result["bad_rows"]["レコード番号"].tolist() == [2]
+
+
+def test_results_match_default_parsing(tmp_path):
+    path = tmp_path / "log.csv"
+    log = generate_stamp_log(500, n_points=10, seed=7)
+    log["timestamp"] = log["timestamp"].dt.strftime("%Y/%m/%d %H:%M:%S")
+    log.to_csv(path, index=False)
+
+    expected = pd.read_csv(path)
+    expected["timestamp"] = pd.to_datetime(expected["timestamp"], errors="coerce")
+    df = ingest.read_stamps(str(path))["df"]
+
+    counts, expected_counts = count_transitions(df), count_transitions(expected)
+    for key in expected_counts:
+        assert np.array_equal(counts[key], expected_counts[key]), key
+
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_utc_offsets_are_read_as_local_time(tmp_path, monkeypatch, use_pyarrow):
+    if use_pyarrow:
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(ingest, "has_pyarrow", lambda: use_pyarrow)
+    log = generate_stamp_log(300, n_points=8, seed=9)
+    naive_path, offset_path = tmp_path / "naive.csv", tmp_path / "offset.csv"
+    log.to_csv(naive_path, index=False)
+    log.assign(timestamp=log["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S+09:00")).to_csv(offset_path, index=False)
+
+    df = ingest.read_stamps(str(offset_path))["df"]
+    assert not isinstance(df["timestamp"].dtype, pd.DatetimeTZDtype)
+
+    # 時差を除いた現地の時刻として、時差の無いファイルと同じグラフになる
+    naive_df = ingest.read_stamps(str(naive_path))["df"]
+    assert df["timestamp"].tolist() == naive_df["timestamp"].tolist()
+    G, node_counts, _ = build_graph(df)
+    G_naive, naive_counts, _ = build_graph(naive_df)
+    assert node_counts == naive_counts
+    assert set(G.edges(data="weight")) == set(G_naive.edges(data="weight"))
+
+
+def test_arrow_cache_is_reused(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    text = "user_id,timestamp,point\nA,2025-11-01 08:15,P1\nA,oops,P2\nA,2025-11-01 09:00,P3\n"
+
+    first = ingest.load_stamps(StringIO(text), cache_dir=str(tmp_path), key="abc")
+    # 2 回目は CSV を読まずに保存した結果を使う
+    monkeypatch.setattr(ingest, "read_stamps", lambda *args, **kwargs: pytest.fail("CSV was parsed again"))
+    second = ingest.load_stamps(StringIO(text), cache_dir=str(tmp_path), key="abc")
+
+    pd.testing.assert_frame_equal(second["df"], first["df"])
+    pd.testing.assert_frame_equal(second["bad_rows"], first["bad_rows"], check_dtype=False)
+    assert second["timestamp_format"] == first["timestamp_format"] == "ISO8601"
+    assert isinstance(second["df"]["point"].dtype, pd.CategoricalDtype)
+    # 日時の列はメモリマップした領域をコピーせずに参照する
+    assert not second["df"]["timestamp"].to_numpy().flags.writeable
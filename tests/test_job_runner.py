@@ -0,0 +1,100 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from src.job_runner import Job, JobCancelled, LatestJobRunner
+
+
+def test_step_raises_after_cancel():
+    job = Job('a')
+    job.step(0.5, "途中")
+    assert (job.progress, job.message) == (0.5, "途中")
+    job.cancel()
+    with pytest.raises(JobCancelled):
+        job.step(0.6)
+
+
+def test_newer_job_cancels_running_job_and_keeps_latest_result():
+    runner = LatestJobRunner(ThreadPoolExecutor(max_workers=2))
+    started, release = threading.Event(), threading.Event()
+    finished = []
+
+    def slow(job):
+        started.set()
+        release.wait(5)
+        job.step(0.5)
+        finished.append('a')
+        return 'a'
+
+    old = runner.submit('a', slow)
+    assert started.wait(5)
+    new = runner.submit('b', lambda job: 'b')
+    assert runner.wait(new, timeout=5) == 'b'
+    assert runner.latest() == ('b', 'b')
+
+    # 古い計算は次の step で打ち切られ、結果は残らない
+    release.set()
+    assert runner.wait(old, timeout=5) is None
+    assert old.cancelled and finished == []
+    assert runner.latest() == ('b', 'b')
+
+
+def test_same_key_reuses_job_and_pending_job_is_skipped():
+    runner = LatestJobRunner(ThreadPoolExecutor(max_workers=1))
+    release = threading.Event()
+    calls = []
+
+    def compute(key):
+        def run(job):
+            calls.append(key)
+            if key == 'a':
+                release.wait(5)
+            return key
+        return run
+
+    first = runner.submit('a', compute('a'))
+    assert runner.submit('a', compute('a')) is first
+    # 'b' は 'a' の後ろで待っている間に 'c' に置き換えられるので実行されない
+    runner.submit('b', compute('b'))
+    latest = runner.submit('c', compute('c'))
+    release.set()
+    assert runner.wait(latest, timeout=5) == 'c'
+    assert calls == ['a', 'c']
+    assert runner.latest() == ('c', 'c')
+
+
+def test_wait_times_out_and_reraises_errors():
+    runner = LatestJobRunner(ThreadPoolExecutor(max_workers=1))
+    release = threading.Event()
+    job = runner.submit('a', lambda job: release.wait(5) and 'a')
+    assert runner.wait(job, timeout=0.01) is None
+    release.set()
+    assert runner.wait(job, timeout=5) == 'a'
+
+    def fail(job):
+        raise ValueError("bad")
+
+    failed = runner.submit('b', fail)
+    with pytest.raises(ValueError):
+        runner.wait(failed, timeout=5)
+    # 失敗した計算は同じキーで投入し直すとやり直す
+    retried = runner.submit('b', lambda job: 'b')
+    assert retried is not failed
+    assert runner.wait(retried, timeout=5) == 'b'
+
+
+def test_sessions_do_not_wait_for_each_others_jobs():
+    busy, other = LatestJobRunner(), LatestJobRunner()
+    release = threading.Event()
+    stale = busy.submit('a', lambda job: release.wait(5) and 'a')
+
+    # 別のセッションの計算が作業スレッドを占有していても、すぐに実行される
+    try:
+        assert other.wait(other.submit('b', lambda job: 'b'), timeout=1) == 'b'
+    finally:
+        release.set()
+    assert busy.wait(stale, timeout=5) == 'a'
@@ -0,0 +1,72 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import networkx as nx
+import numpy as np
+from src import layout
+
+
+def make_graph(n, m, seed=0):
+    G = nx.gnm_random_graph(n, m, seed=seed, directed=True)
+    return nx.relabel_nodes(G, {i: f'P{i}' for i in G.nodes()})
+
+
+def test_incremental_layout_keeps_known_positions():
+    G = make_graph(20, 40)
+    previous = layout.compute_layout(G.subgraph([f'P{i}' for i in range(15)]))
+
+    pos = layout.compute_layout(G, previous)
+
+    assert set(pos) == set(G.nodes())
+    for n, xy in previous.items():
+        assert np.allclose(pos[n], xy)
+
+
+def test_get_layout_reuses_point_set_cache():
+    G = make_graph(12, 30, seed=1)
+    first = layout.get_layout(G, namespace='test-cache')
+    # 同じポイント集合なら前回の座標がそのまま返る
+    second = layout.get_layout(G, namespace='test-cache')
+
+    for n in G.nodes():
+        assert np.allclose(first[n], second[n])
+
+
+def fail_spring_layout(*args, **kwargs):
+    raise AssertionError('spring_layout should not run for large graphs')
+
+
+def test_large_graph_uses_fast_layout(monkeypatch):
+    G = make_graph(layout.LARGE_GRAPH_NODES + 50, 2000, seed=2)
+    # 大きなグラフでは O(N^2) の spring_layout を使わない
+    monkeypatch.setattr(nx, 'spring_layout', fail_spring_layout)
+
+    pos = layout.compute_layout(G)
+
+    xy = np.array(list(pos.values()))
+    assert set(pos) == set(G.nodes())
+    assert np.isfinite(xy).all()
+    assert len(np.unique(xy.round(6), axis=0)) == len(xy)
+
+
+def test_large_graph_incremental_layout_keeps_known_positions(monkeypatch):
+    G = make_graph(layout.LARGE_GRAPH_NODES + 50, 2000, seed=3)
+    previous = layout.compute_layout(G.subgraph([f'P{i}' for i in range(layout.LARGE_GRAPH_NODES + 20)]))
+    monkeypatch.setattr(nx, 'spring_layout', fail_spring_layout)
+
+    pos = layout.compute_layout(G, previous)
+
+    assert set(pos) == set(G.nodes())
+    assert np.isfinite(np.array(list(pos.values()))).all()
+    for n, xy in previous.items():
+        assert np.allclose(pos[n], xy)
+
+
+def test_dump_and_load_layout_round_trip():
+    pos = {'A': (0.5, -0.25), np.int64(3): np.array([1.0, 2.0])}
+
+    loaded = layout.load_layout(layout.dump_layout(pos))
+
+    assert np.allclose(loaded['A'], [0.5, -0.25])
+    assert np.allclose(loaded[3], [1.0, 2.0])
@@ -0,0 +1,98 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import json
+import logging
+import tracemalloc
+
+import pytest
+from src import profiling
+from src.profiling import Profiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    with profiler.stage("read_csv", rows=10) as record:
+        record["rows"] = 20
+
+    assert profiler.records == []
+    assert profiler.stage("filter") is profiler.stage("layout")
+
+
+def test_enabled_profiler_records_stages():
+    profiler = Profiler(enabled=True, trace_memory=True)
+    with profiler.stage("build_graph", rows=5) as record:
+        data = [0] * 100_000
+        record["rows"] = len(data)
+    with pytest.raises(ValueError):
+        with profiler.stage("draw_graph"):
+            raise ValueError
+
+    first, second = profiler.records
+    assert first["stage"] == "build_graph"
+    assert first["rows"] == 100_000
+    assert first["seconds"] >= 0
+    assert first["process_peak_mb"] > 0.5
+    assert second["error"] == "ValueError"
+    assert profiler.total_seconds() == pytest.approx(first["seconds"] + second["seconds"])
+
+    # 計測中の段階が無くなると tracemalloc も止まる
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_tracing_is_shared_between_profilers():
+    first, second = Profiler(enabled=True, trace_memory=True), Profiler(enabled=True, trace_memory=True)
+    with first.stage("outer"):
+        # 他のプロファイラ（別のセッション）の段階が終わったり、メモリを計測しないプロファイラを
+        # 作ったりしても、計測中の段階がある間は止めない
+        with second.stage("inner"):
+            pass
+        Profiler(enabled=True)
+        assert tracemalloc.is_tracing()
+        data = [0] * 100_000
+    del data
+    assert not tracemalloc.is_tracing()
+    assert first.records[0]["process_peak_mb"] > 0.5
+
+
+def test_tracing_started_elsewhere_is_left_running():
+    tracemalloc.start()
+    try:
+        with Profiler(enabled=True, trace_memory=True).stage("filter"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_records_are_logged_as_json(caplog):
+    profiler = Profiler(enabled=True, context={"file": "abc"})
+    with caplog.at_level(logging.INFO, logger="stamprally.perf"):
+        with profiler.stage("filter", rows=3):
+            pass
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry["stage"] == "filter"
+    assert entry["file"] == "abc"
+    assert entry["run_id"] == profiler.context["run_id"]
+
+
+def test_configure_perf_log_appends_json_lines(tmp_path):
+    path = tmp_path / "perf.jsonl"
+    profiling.configure_perf_log(str(path))
+    # 同じファイルを二重に登録しない
+    profiling.configure_perf_log(str(path))
+    try:
+        profiler = Profiler(enabled=True)
+        with profiler.stage("layout"):
+            pass
+    finally:
+        for handler in list(profiling.logger.handlers):
+            if getattr(handler, "baseFilename", None) == str(path):
+                profiling.logger.removeHandler(handler)
+                handler.close()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["stage"] == "layout"
@@ -0,0 +1,47 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import pandas as pd
+import pytest
+from src import stamprally_render
+from src.profiling import Profiler
+from src.stamprally_analyze import build_graph
+
+
+@pytest.fixture
+def graph():
+    df = pd.DataFrame({
+        'user_id': [1, 1, 2, 2, 3],
+        'point': ['A', 'B', 'A', 'C', 'B'],
+        'timestamp': pd.to_datetime(['2023-01-01 10:00', '2023-01-01 10:05', '2023-01-01 10:10',
+                                     '2023-01-01 10:15', '2023-01-01 10:20']),
+    })
+    G, node_counts, point_to_id = build_graph(df)
+    pos = {'A': (0.0, 0.0), 'B': (1.0, 0.0), 'C': (0.0, 1.0)}
+    return G, node_counts, point_to_id, pos
+
+
+def test_background_render_is_profiled_in_render_thread(graph, monkeypatch):
+    G, node_counts, point_to_id, pos = graph
+    monkeypatch.setattr(stamprally_render, '_render', lambda *args: b'image')
+    profiler = Profiler(enabled=True)
+
+    future = stamprally_render.submit_render(G, node_counts, point_to_id, pos, profiler=profiler)
+
+    # 計測するのは投入ではなく描画そのもの
+    assert future.result(timeout=60).getvalue() == b'image'
+    assert [r['stage'] for r in profiler.records] == ['render_image']
+    assert profiler.records[0]['rows'] == G.number_of_edges()
+
+
+def test_draw_graph_svg_in_background(graph):
+    G, node_counts, point_to_id, pos = graph
+
+    graph_data = stamprally_render.draw_graph(G, node_counts, point_to_id, pos=pos,
+                                              image_format='svg', background=True)
+
+    svg = graph_data['image'].result(timeout=60).getvalue().decode('utf-8')
+    assert '<svg' in svg
+    assert sorted(graph_data['nodes_data']['ポイント']) == ['A', 'B', 'C']
+    assert list(graph_data['travel_times'].columns) == list(stamprally_render.travel_time_frame(G).columns)
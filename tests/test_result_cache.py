@@ -0,0 +1,89 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+from concurrent.futures import Future
+
+from src.result_cache import ResultCache, content_key, estimate_size
+
+
+def test_content_key_depends_on_bytes_and_parameters():
+    assert content_key(b'abc', (1, 2)) == content_key(b'abc', (1, 2))
+    assert content_key(b'abc', (1, 2)) != content_key(b'abd', (1, 2))
+    assert content_key(b'abc', (1, 2)) != content_key(b'abc', (1, 3))
+
+
+def test_lru_eviction_and_stats():
+    cache = ResultCache(max_bytes=2500)
+    calls = []
+
+    def compute(i):
+        calls.append(i)
+        return np.zeros(1000, dtype=np.uint8)
+
+    cache.get_or_compute('stage', 'a', lambda: compute('a'))
+    cache.get_or_compute('stage', 'b', lambda: compute('b'))
+    cache.get_or_compute('stage', 'a', lambda: compute('a'))
+    # 上限を超えるので最も長く使われていない 'b' が追い出される
+    cache.get_or_compute('stage', 'c', lambda: compute('c'))
+    cache.get_or_compute('stage', 'b', lambda: compute('b'))
+
+    assert calls == ['a', 'b', 'c', 'b']
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 4
+    assert stats['evictions'] == 2
+    assert stats['bytes'] <= 2500
+
+
+def test_evicted_results_spill_to_disk(tmp_path):
+    cache = ResultCache(max_bytes=1500, disk_dir=str(tmp_path))
+    cache.put('stage', 'a', np.arange(100, dtype=np.int64))
+    cache.put('stage', 'b', np.arange(100, dtype=np.int64))
+
+    found, value = cache.get('stage', 'a')
+
+    assert found
+    assert np.array_equal(value, np.arange(100))
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_get_or_compute_many_only_computes_missing():
+    cache = ResultCache()
+    cache.put('shard', 'a', 'cached')
+    calls = []
+
+    def compute(name):
+        calls.append(name)
+        return name.upper()
+
+    values = cache.get_or_compute_many('shard', ['a', 'b', 'c'],
+                                       [lambda: compute('a'), lambda: compute('b'), lambda: compute('c')], workers=2)
+
+    assert values == ['cached', 'B', 'C']
+    assert sorted(calls) == ['b', 'c']
+    assert cache.get('shard', 'c') == (True, 'C')
+
+
+def test_estimate_size_of_known_types():
+    from scipy import sparse
+    from src.adjacency import SparseAdjacency
+
+    matrix = sparse.random(100, 100, density=0.1, format="csr", random_state=0)
+    assert estimate_size(matrix) == matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    adjacency = SparseAdjacency(np.array(["A"] * 100, dtype=object), matrix)
+    assert estimate_size(adjacency) >= estimate_size(adjacency.matrix)
+
+    # 未完了の Future は中身が分からないので小さく、完了したものは結果の大きさ
+    future = Future()
+    assert estimate_size(future) < 1000
+    future.set_result(np.zeros(10_000, dtype=np.uint8))
+    assert estimate_size(future) == 10_000
+
+    # 任意のオブジェクトの属性はたどらない
+    class Holder:
+        def __init__(self):
+            self.array = np.zeros(10_000, dtype=np.uint8)
+
+    assert estimate_size(Holder()) < 1000
@@ -0,0 +1,71 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.routes import mine_routes, routes_frame, visit_orders
+from src.synthetic import generate_stamp_log
+
+
+def naive_routes(df, stops):
+    # ユーザーごとの並びから素朴に数える
+    users, trips = Counter(), Counter()
+    ordered = df.sort_values(["user_id", "timestamp"], kind="stable")
+    for _, seq in ordered.groupby("user_id", sort=False)["point"]:
+        seq = list(seq)
+        seen = set()
+        for i in range(len(seq) - stops + 1):
+            path = tuple(seq[i:i + stops])
+            if any(pd.isna(p) for p in path):
+                continue
+            trips[path] += 1
+            if path not in seen:
+                seen.add(path)
+                users[path] += 1
+    return users, trips
+
+
+@pytest.mark.parametrize("stops", [2, 3, 5])
+def test_mine_routes_matches_naive_count(stops):
+    df = generate_stamp_log(500, n_points=10, seed=stops)
+    df.loc[3, "point"] = None
+    users, trips = naive_routes(df, stops)
+
+    for min_users in (None, 1):
+        routes = mine_routes(df, stops, k=6, min_users=min_users)
+        found = [tuple(routes["points"][path]) for path in routes["paths"]]
+        assert [(users[p], trips[p]) for p in found] == list(zip(routes["users"], routes["trips"]))
+        expected = sorted(((users[p], trips[p]) for p in users), reverse=True)[:6]
+        assert list(zip(routes["users"], routes["trips"])) == expected
+
+
+def test_mine_routes_with_many_points_uses_hash():
+    # ポイント数 ** stops が int64 を超えるとハッシュになる
+    df = generate_stamp_log(300, n_points=2000, mean_stamps=6, route_skew=0.2, seed=1)
+    users, _ = naive_routes(df, 7)
+    routes = mine_routes(df, 7, k=5)
+    assert list(routes["users"]) == sorted(users.values(), reverse=True)[:5]
+
+
+def test_visit_orders_and_frame():
+    df = pd.DataFrame({
+        "user_id": ["A", "A", "B", "B", "C", "C", "C", "D"],
+        "timestamp": pd.to_datetime(["2025-11-01 10:00", "2025-11-01 10:30"] * 2
+                                    + ["2025-11-01 09:00", "2025-11-01 09:30", "2025-11-01 10:00", "2025-11-01 11:00"]),
+        "point": ["P1", "P2", "P1", "P2", "P1", "P2", "P3", "P3"],
+    })
+
+    frame = routes_frame(visit_orders(df, k=2))
+    assert frame["ルート"].tolist() == ["P1 → P2", "P1 → P2 → P3"]
+    assert frame["利用者数"].tolist() == [2, 1]
+
+    routes = mine_routes(df, 3, k=10)
+    assert routes["paths"].tolist() == [[0, 1, 2]]
+    assert mine_routes(df.iloc[:0], 3)["paths"].shape == (0, 3)
+    assert np.array_equal(mine_routes(df, 4)["users"], [])
+    # 1 人 1 スタンプだけで移動が無い場合
+    assert mine_routes(df.drop_duplicates("user_id"), 2)["paths"].shape == (0, 2)
@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.shards import OverlappingShardsError, ingest_shards, merge_partials, shard_partial
+from src.stamprally_analyze import count_transitions
+from src.synthetic import generate_stamp_log
+
+
+def assert_same_counts(actual, expected):
+    assert actual.keys() == expected.keys()
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
+
+
+def daily_shards(n_users=500, seed=5):
+    df = generate_stamp_log(n_users, n_points=12, seed=seed).sort_values("timestamp", kind="stable")
+    return [day.reset_index(drop=True) for _, day in df.groupby(df["timestamp"].dt.floor("D"), sort=True)]
+
+
+def test_merge_matches_concatenated_data():
+    shards = daily_shards()
+    assert len(shards) > 2
+
+    merged = merge_partials([shard_partial(s) for s in shards])
+    assert_same_counts(merged, count_transitions(pd.concat(shards, ignore_index=True)))
+
+
+def test_boundary_rows_with_missing_values():
+    def frame(users, points, times):
+        return pd.DataFrame({"user_id": users, "point": points, "timestamp": pd.to_datetime(times)})
+
+    day1 = frame(["A", "A", "B", "C", None], ["P1", "P2", "P1", None, "P3"],
+                 ["2025-11-01 10:00", "2025-11-01 10:10", "2025-11-01 11:00", "2025-11-01 12:00", "2025-11-01 13:00"])
+    # A は日をまたいで P2 → P3、C は直前のポイントが欠損なので数えない、D は 2 日目だけ
+    day2 = frame(["A", "B", "C", "D", "D"], ["P3", "P1", "P2", "P4", "P1"],
+                 ["2025-11-02 09:00", "2025-11-02 09:30", "2025-11-02 10:00", "2025-11-02 10:00", None])
+    partials = [shard_partial(day1), shard_partial(day2)]
+
+    assert_same_counts(merge_partials(partials), count_transitions(pd.concat([day1, day2], ignore_index=True)))
+    # 空のシャード（フィルタで全行が除かれた場合など）も合併できる
+    empty = shard_partial(day1.iloc[:0])
+    assert_same_counts(merge_partials([empty] + partials),
+                       count_transitions(pd.concat([day1, day2], ignore_index=True)))
+
+
+def test_interleaved_users_are_detected():
+    df = generate_stamp_log(100, n_points=6, seed=1)
+    # 行を交互に振り分けると、同じユーザーの時刻の範囲が重なる
+    with pytest.raises(OverlappingShardsError):
+        merge_partials([shard_partial(df.iloc[0::2]), shard_partial(df.iloc[1::2])])
+
+
+def test_ingest_directory(tmp_path):
+    shards = daily_shards(200, seed=2)
+    for i, s in enumerate(shards):
+        s.to_csv(tmp_path / f"day{i:02d}.csv", index=False)
+    (tmp_path / "broken.csv").write_text("a,b\n1,2\n", encoding="utf-8")
+
+    result = ingest_shards(str(tmp_path), workers=2)
+    assert result["stitched"]
+    assert list(result["errors"]) == [str(tmp_path / "broken.csv")]
+    assert_same_counts(result["counts"], count_transitions(result["df"]))
+    assert len(result["df"]) == sum(len(s) for s in shards)
+
+
+def test_merge_without_visitors():
+    # 訪問者数を近似する場合は、シャードでも合併でも訪問者数を数えない
+    shards = daily_shards()
+    merged = merge_partials([shard_partial(s, visitors=False) for s in shards])
+    expected = count_transitions(pd.concat(shards, ignore_index=True), visitors=False)
+    assert "node_counts" not in expected
+    assert_same_counts(merged, expected)
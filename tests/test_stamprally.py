@@ -3,8 +3,9 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
 
 import pytest
+import numpy as np
 import pandas as pd
-from src.stamprally_analyze import build_graph
+from src.stamprally_analyze import build_graph, count_transitions, graph_from_counts
 from io import BytesIO
 
 def test_build_graph():
@@ -60,6 +61,67 @@ def test_single_node_no_edges():
     assert len(G.edges()) == 0
     assert node_counts.get('X') == 3
 
+def naive_transitions(df):
+    # ユーザーごとにループする素朴な実装（比較用）
+    edges = {}
+    for user, group in df.sort_values(["user_id", "timestamp"], kind="stable").groupby("user_id"):
+        pts = group["point"].tolist()
+        for i in range(len(pts) - 1):
+            edges[(pts[i], pts[i + 1])] = edges.get((pts[i], pts[i + 1]), 0) + 1
+    return edges
+
+def test_build_graph_matches_naive_transitions():
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({
+        'user_id': rng.integers(0, 150, n),
+        'point': rng.choice(['P1', 'P2', 'P3', 'P4', 'P5'], n),
+        'timestamp': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 86400, n), unit='s'),
+    })
+
+    G, node_counts, point_to_id, counts = build_graph(df, return_counts=True)
+
+    assert {(u, v): d['weight'] for u, v, d in G.edges(data=True)} == naive_transitions(df)
+    assert node_counts == df.groupby('point')['user_id'].nunique().to_dict()
+    assert point_to_id == {p: i for i, p in enumerate(sorted(df['point'].unique()))}
+    assert list(G.nodes()) == list(df['point'].unique())
+    assert counts['edge_weight'].sum() == len(df) - df['user_id'].nunique()
+    assert list(counts['edge_weight']) == sorted(counts['edge_weight'], reverse=True)
+
+def test_count_transitions_without_rows():
+    df = pd.DataFrame({'user_id': [], 'point': [], 'timestamp': pd.to_datetime([])})
+    counts = count_transitions(df)
+
+    assert len(counts['points']) == 0
+    assert len(counts['edge_weight']) == 0
+
+def test_count_transitions_without_visitors():
+    df = pd.DataFrame({'user_id': ['A', 'A', 'B', 'B'], 'point': ['P1', 'P2', 'P1', 'P2'],
+                       'timestamp': pd.to_datetime(['2025-11-01 10:00', '2025-11-01 10:10',
+                                                    '2025-11-01 11:00', '2025-11-01 11:10'])})
+    counts = count_transitions(df, visitors=False)
+
+    # 訪問者数は数えず、遷移とグラフは同じになる
+    assert 'node_counts' not in counts
+    G, node_counts, _ = graph_from_counts(counts)
+    assert node_counts is None
+    assert G['P1']['P2']['weight'] == 2
+
+def test_build_graph_with_timezone_aware_timestamps():
+    # オフセット付きの時刻は UTC に揃えて並べる（オフセットが違っても同じ時刻の順になる）
+    timestamps = pd.Series(pd.to_datetime(['2025-11-01T10:00:00+09:00', '2025-11-01T10:05:00+09:00',
+                                           '2025-11-01T10:10:00+09:00', '2025-11-01T10:15:00+09:00']))
+    df = pd.DataFrame({'user_id': [1, 1, 2, 2], 'point': ['B', 'A', 'A', 'C'], 'timestamp': timestamps})
+    df = df.iloc[[1, 0, 3, 2]]
+
+    G, node_counts, _ = build_graph(df)
+    naive_df = df.assign(timestamp=df['timestamp'].dt.tz_convert(None))
+    G_naive, naive_counts, _ = build_graph(naive_df)
+
+    assert {(u, v): d['weight'] for u, v, d in G.edges(data=True)} == {('B', 'A'): 1, ('A', 'C'): 1}
+    assert list(G.edges(data=True)) == list(G_naive.edges(data=True))
+    assert node_counts == naive_counts
+
 # pytestを実行するためのエントリーポイント
 if __name__ == "__main__":
     pytest.main()
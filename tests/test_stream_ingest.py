@@ -0,0 +1,81 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.stamprally_analyze import count_transitions
+from src.stream_ingest import stream_counts
+
+
+def make_csv(order):
+    rng = np.random.default_rng(1)
+    n = 3000
+    df = pd.DataFrame({
+        'user_id': rng.integers(0, 200, n),
+        'timestamp': (pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 3600, n), unit='s')).astype(str),
+        'point': rng.choice([f'P{i}' for i in range(10)], n),
+    })
+    if order is not None:
+        df = df.sort_values(order, kind='stable')
+    return df.to_csv(index=False)
+
+
+@pytest.mark.parametrize('order', [['user_id', 'timestamp'], ['timestamp'], None])
+def test_stream_counts_matches_count_transitions(order):
+    text = make_csv(order)
+    df = pd.read_csv(StringIO(text))
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    expected = count_transitions(df)
+
+    # ソート済み・ユーザー混在（1パス）と未ソート（外部ソート）のいずれでも一致する
+    actual = stream_counts(StringIO(text), chunksize=500, fan_in=2)
+
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
+
+
+def test_stream_counts_with_timezone_offsets():
+    text = make_csv(['user_id', 'timestamp'])
+    df = pd.read_csv(StringIO(text))
+    df['timestamp'] = df['timestamp'] + '+09:00'
+    text = df.to_csv(index=False)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    expected = count_transitions(df)
+
+    actual = stream_counts(StringIO(text), chunksize=500, fan_in=2)
+
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
+
+
+@pytest.mark.parametrize('order', [['timestamp'], None])
+def test_stream_counts_from_dataframe(order):
+    df = pd.read_csv(StringIO(make_csv(order)))
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    for column in ('user_id', 'point'):
+        df[column] = df[column].astype('category')
+    expected = count_transitions(df)
+
+    # 読み込み済みの DataFrame もチャンクごとに集計できる
+    actual = stream_counts(df, chunksize=500, fan_in=2)
+
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
+
+
+@pytest.mark.parametrize('order', [['user_id', 'timestamp'], None])
+def test_stream_counts_without_visitors(order):
+    text = make_csv(order)
+    df = pd.read_csv(StringIO(text))
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    expected = count_transitions(df, visitors=False)
+
+    actual = stream_counts(StringIO(text), chunksize=500, fan_in=2, visitors=False)
+
+    assert actual.keys() == expected.keys() and 'node_counts' not in actual
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
@@ -0,0 +1,37 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import pandas as pd
+from src.synthetic import generate_stamp_log, iter_stamp_log, write_stamp_log_csv
+
+
+def test_generator_is_deterministic():
+    a = generate_stamp_log(500, n_points=12, seed=7)
+    b = generate_stamp_log(500, n_points=12, seed=7)
+    c = generate_stamp_log(500, n_points=12, seed=8)
+
+    pd.testing.assert_frame_equal(a, b)
+    assert not a.equals(c)
+
+
+def test_generator_shape_and_skew():
+    df = generate_stamp_log(2000, n_points=10, route_skew=2.0, forward_prob=0.0, seed=1)
+
+    assert list(df.columns) == ['user_id', 'timestamp', 'point']
+    assert df['user_id'].nunique() == 2000
+    assert set(df['point']) <= {f'P{i:02d}' for i in range(1, 11)}
+    # 人気の偏りを強くすると先頭のポイントに集中する
+    assert df['point'].value_counts().idxmax() == 'P01'
+    # ユーザーごとのスタンプは時刻順
+    assert df.groupby('user_id')['timestamp'].is_monotonic_increasing.all()
+
+
+def test_chunks_match_single_frame(tmp_path):
+    chunks = list(iter_stamp_log(250, n_points=8, seed=3, chunk_users=100))
+    path = tmp_path / 'stamps.csv'
+
+    rows = write_stamp_log_csv(path, 250, n_points=8, seed=3, chunk_users=100)
+
+    assert len(chunks) == 3
+    assert rows == sum(len(c) for c in chunks) == len(pd.read_csv(path))
@@ -0,0 +1,54 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+import pandas as pd
+from src.table_view import page_count, sample_order, search_mask, table_order, table_page
+
+
+def make_frame():
+    return pd.DataFrame({
+        "user_id": ["A", "b", "C", "a", None, "B"],
+        "point": ["P1", "P2", "P10", "P3", "P1", "P2"],
+        "count": [3, 1, np.nan, 3, 2, 5],
+        "timestamp": pd.to_datetime(["2025-11-01 10:00", "2025-11-01 09:00", None,
+                                     "2025-11-01 08:00", "2025-11-01 11:00", "2025-11-01 12:00"]),
+    })
+
+
+def test_search_ignores_case_and_numeric_columns():
+    df = make_frame()
+    assert np.flatnonzero(search_mask(df, "a")).tolist() == [0, 3]
+    assert np.flatnonzero(search_mask(df, "p1")).tolist() == [0, 2, 4]
+    # 数値・日時の列は対象外（列を指定すれば検索できる）
+    assert not search_mask(df, "5").any()
+    assert np.flatnonzero(search_mask(df, "5", columns=["count"])).tolist() == [5]
+
+
+def test_table_order_matches_pandas_sort():
+    df = make_frame()
+    for column in ("user_id", "count", "timestamp"):
+        for ascending in (True, False):
+            expected = df.reset_index(drop=True).sort_values(column, ascending=ascending, kind="stable",
+                                                             na_position="last").index.tolist()
+            assert table_order(df, column, ascending).tolist() == expected, (column, ascending)
+
+    # 検索に一致した行だけを並べ替える
+    assert table_order(df, "count", False, search="p").tolist() == [5, 0, 3, 4, 1, 2]
+    assert table_order(df, "count", True, search="p2").tolist() == [1, 5]
+
+
+def test_pages_and_samples():
+    df = pd.DataFrame({"x": np.arange(250)})
+    order = table_order(df, "x", ascending=False)
+
+    assert page_count(len(order), 100) == 3
+    assert page_count(0, 100) == 1
+    assert table_page(df, order, 2, 100)["x"].tolist() == list(range(49, -1, -1))
+
+    sampled = sample_order(order, 20, seed=1)
+    assert len(sampled) == 20 and len(set(sampled.tolist())) == 20
+    # 抽出しても並べ替えた順序は保たれる
+    assert (np.diff(df["x"].to_numpy()[sampled]) < 0).all()
+    assert sample_order(order, 1000) is order
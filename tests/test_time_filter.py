@@ -0,0 +1,44 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.time_filter import build_time_index, concat_time_indexes, time_filter_mask
+
+
+@pytest.fixture
+def timestamps():
+    rng = np.random.default_rng(2)
+    ts = pd.Series(pd.Timestamp('2023-01-02') + pd.to_timedelta(rng.integers(0, 14 * 86400, 1000), unit='s'))
+    ts[::97] = pd.NaT
+    return ts
+
+
+@pytest.mark.parametrize('start, end, weekdays', [
+    (datetime.time(0, 0), datetime.time(23, 59, 59), [0, 1, 2, 3, 4, 5, 6]),
+    (datetime.time(9, 30), datetime.time(12, 0), [5, 6]),
+    (datetime.time(12, 0), datetime.time(12, 0), []),
+])
+def test_time_filter_mask_matches_apply(timestamps, start, end, weekdays):
+    index = build_time_index(timestamps)
+
+    # 行ごとに判定する従来の方法と同じ行が選ばれる
+    expected = timestamps.apply(lambda x: pd.notna(x) and start <= x.time() <= end
+                                and (not weekdays or x.weekday() in weekdays))
+    actual = time_filter_mask(index, start, end, weekdays)
+
+    assert np.array_equal(actual, expected.to_numpy())
+
+
+def test_concat_time_indexes_matches_index_of_concatenated_rows(timestamps):
+    parts = [timestamps[:300], timestamps[300:301], timestamps[301:]]
+
+    combined = concat_time_indexes([build_time_index(part) for part in parts])
+    expected = build_time_index(timestamps)
+
+    for key in ("seconds", "weekday", "order", "sorted_keys"):
+        assert np.array_equal(combined[key], expected[key])
@@ -0,0 +1,85 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.stamprally_analyze import count_transitions
+from src.time_filter import build_time_index, time_filter_mask
+from src.transition_cube import _group_sums, build_transition_cube, query_transition_cube
+
+
+@pytest.fixture
+def stamps():
+    rng = np.random.default_rng(3)
+    n = 4000
+    user = rng.integers(0, 300, n)
+    # 半数のユーザーは 1 日だけ、残りは 2 週間にわたって記録がある
+    day = np.where(user % 2 == 0, user % 14, rng.integers(0, 14, n))
+    df = pd.DataFrame({
+        'user_id': user,
+        'point': rng.choice(['P1', 'P2', 'P3', 'P4', 'P5', 'P6'], n),
+        'timestamp': pd.Timestamp('2023-01-02') + pd.to_timedelta(day * 86400 + rng.integers(8 * 3600, 18 * 3600, n), unit='s'),
+    })
+    df.loc[::101, 'timestamp'] = pd.NaT
+    df.loc[::53, 'point'] = None
+    return df
+
+
+@pytest.mark.parametrize('start, end, weekdays', [
+    (datetime.time(0, 0), datetime.time(23, 59, 59), []),
+    (datetime.time(10, 0), datetime.time(12, 30), [0, 2, 4]),
+    (datetime.time(13, 15), datetime.time(13, 45), [6]),
+    (datetime.time(20, 0), datetime.time(21, 0), []),
+    (datetime.time(9, 0), datetime.time(17, 0), [1, 5]),
+    # 分単位でない区間は行から数える
+    (datetime.time(10, 0, 30), datetime.time(12, 0, 15), [0, 3]),
+    (datetime.time(12, 0), datetime.time(11, 0), []),
+])
+def test_query_matches_count_transitions(stamps, start, end, weekdays):
+    index = build_time_index(stamps['timestamp'])
+    cube = build_transition_cube(stamps, index)
+
+    expected = count_transitions(stamps[time_filter_mask(index, start, end, weekdays)])
+    actual = query_transition_cube(cube, index, start, end, weekdays)
+
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
+
+
+def test_same_day_transitions_use_prefix_sums(stamps):
+    index = build_time_index(stamps['timestamp'])
+    cube = build_transition_cube(stamps, index)
+
+    # 複数の日に記録のあるユーザーも、同じ日の中の遷移はキューブに入り、行から数えるのは日をまたぐ遷移だけ
+    same_day_transitions = cube['entry_count'].sum()
+    assert same_day_transitions > len(stamps) // 2
+    assert len(cube['cross_positions']) < len(cube['row_order'])
+
+    # 累積和と到着時刻の直接の切り出しは、どの区間でも同じ結果になる
+    for start, end, weekdays in [(0, 1440, range(7)), (600, 750, [0, 2]), (795, 825, [6]), (700, 600, [1])]:
+        entry_weekday = cube['group_weekday'][cube['entry_group']]
+        inside = (np.isin(entry_weekday, list(weekdays)) & (cube['entry_departure'] >= start)
+                  & (cube['entry_arrival'] <= end))
+        expected = np.bincount(cube['entry_group'][inside], weights=cube['entry_count'][inside],
+                               minlength=len(cube['group_weekday']))
+        for use_prefix in (True, False):
+            groups, count, _ = _group_sums(cube, weekdays, start, end, use_prefix=use_prefix)
+            assert np.array_equal(groups, np.flatnonzero(expected))
+            assert np.array_equal(count, expected[groups])
+
+
+def test_query_without_visitors(stamps):
+    index = build_time_index(stamps['timestamp'])
+    cube = build_transition_cube(stamps, index)
+    start, end, weekdays = datetime.time(10, 0), datetime.time(12, 30), [0, 2, 4]
+
+    expected = count_transitions(stamps[time_filter_mask(index, start, end, weekdays)], visitors=False)
+    actual = query_transition_cube(cube, index, start, end, weekdays, visitors=False)
+
+    assert actual.keys() == expected.keys() and 'node_counts' not in actual
+    for key in expected:
+        assert np.array_equal(actual[key], expected[key]), key
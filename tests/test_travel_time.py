@@ -0,0 +1,86 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.stamprally_analyze import build_graph, count_transitions
+from src.synthetic import generate_stamp_log
+from src.travel_time import (
+    N_BUCKETS, RELATIVE_ACCURACY, edge_travel_stats, format_duration, merge_travel_times, travel_time_frame,
+    travel_time_table,
+)
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(0)
+    ms = (rng.lognormal(mean=7, sigma=1, size=20_000) * 1000).astype(np.int64)
+    src = rng.integers(0, 3, size=len(ms))
+    table = travel_time_table(src, np.zeros(len(ms), dtype=np.int64), ms, n_points=3)
+    counts = {"points": np.arange(3), "edge_from": np.arange(3), "edge_to": np.zeros(3, dtype=np.int64), **table}
+
+    stats = edge_travel_stats(counts)
+    for p in range(3):
+        seconds = np.sort(ms[src == p]) / 1000
+        assert stats["count"][p] == len(seconds)
+        assert stats["mean"][p] == pytest.approx(seconds.mean())
+        for q in (50, 90):
+            exact = seconds[int(np.ceil(q / 100 * len(seconds))) - 1]
+            assert abs(stats[f"q{q}"][p] - exact) <= RELATIVE_ACCURACY * exact + 1e-9
+    # 1 つの遷移あたりの行数はバケット数以下
+    assert len(table["time_count"]) <= 3 * N_BUCKETS
+
+
+def test_merge_equals_single_table():
+    rng = np.random.default_rng(1)
+    src, dst = rng.integers(0, 5, size=(2, 1000))
+    ms = rng.integers(-1, 3_600_000, size=1000)
+
+    whole = travel_time_table(src, dst, ms, n_points=5)
+    parts = [travel_time_table(src[i::3], dst[i::3], ms[i::3], n_points=5) for i in range(3)]
+    merged = merge_travel_times(parts, n_points=5)
+
+    for key in whole:
+        assert np.array_equal(merged[key], whole[key]), key
+    assert whole["time_count"].sum() == (ms >= 0).sum()
+
+
+def test_graph_edges_carry_travel_time():
+    df = pd.DataFrame({
+        "user_id": ["A", "A", "B", "B", "C", "C", "C"],
+        "timestamp": pd.to_datetime(["2025-11-01 10:00", "2025-11-01 10:10", "2025-11-01 11:00", "2025-11-01 11:30",
+                                     "2025-11-01 12:00", "2025-11-01 12:20", None]),
+        "point": ["P1", "P2", "P1", "P2", "P1", "P2", "P3"],
+    })
+
+    G, _, _ = build_graph(df)
+    edge = G["P1"]["P2"]
+    assert edge["travel_count"] == 3
+    assert edge["travel_mean"] == pytest.approx(20 * 60)
+    assert edge["travel_median"] == pytest.approx(20 * 60, rel=RELATIVE_ACCURACY)
+    # 時刻が欠損したスタンプへの遷移は数えるが、所要時間は分からない
+    assert G["P2"]["P3"]["weight"] == 1
+    assert G["P2"]["P3"]["travel_count"] == 0
+    assert np.isnan(G["P2"]["P3"]["travel_median"])
+
+    frame = travel_time_frame(G)
+    assert frame.loc[0, ["From", "To", "移動者数", "所要時間の件数"]].tolist() == ["P1", "P2", 3, 3]
+    assert frame.loc[0, "平均所要時間(分)"] == 20.0
+
+
+def test_count_transitions_travel_time_matches_per_user_gaps():
+    df = generate_stamp_log(300, n_points=6, seed=2)
+    counts = count_transitions(df)
+
+    ordered = df.sort_values(["user_id", "timestamp"], kind="stable")
+    gaps = ordered.groupby("user_id")["timestamp"].diff().dt.total_seconds().dropna()
+    assert counts["time_count"].sum() == len(gaps)
+    assert counts["time_ms"].sum() == int(round(gaps.sum() * 1000))
+
+
+def test_format_duration():
+    assert format_duration(45) == "45秒"
+    assert format_duration(12 * 60 + 10) == "12分"
+    assert format_duration(65 * 60) == "1時間5分"
+    assert format_duration(float("nan")) == ""
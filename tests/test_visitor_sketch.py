@@ -0,0 +1,114 @@
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from src.synthetic import generate_stamp_log
+from src.time_filter import build_time_index, time_filter_mask
+from src.visitor_sketch import (
+    SPARSE_ENTRY_BYTES, build_visitor_sketches, estimate, merge_visitor_registers, precision_for_error, query_visitor_sketches,
+    sketch, standard_error, user_hashes, visitor_estimates,
+)
+
+
+def direct_registers(df, points, precision):
+    # 絞り込み後の行から直接作ったレジスタ（最後の行は全ポイント合計）
+    valid = df["user_id"].notna().to_numpy() & df["timestamp"].notna().to_numpy()
+    df = df[valid]
+    ids = pd.Index(points).get_indexer(df["point"])
+    ids[df["point"].isna().to_numpy()] = len(points)
+    hashes = user_hashes(df["user_id"])
+    registers = sketch(ids, hashes, len(points) + 1, precision)
+    registers[len(points)] = sketch(np.zeros(len(df), dtype=np.int64), hashes, 1, precision)[0]
+    return registers
+
+
+@pytest.mark.parametrize("window", [
+    (datetime.time(0, 0), datetime.time(23, 59, 59), []),
+    (datetime.time(9, 17), datetime.time(15, 42, 30), [5, 6]),
+    (datetime.time(10, 0), datetime.time(10, 59, 59), [0, 2]),
+])
+def test_query_equals_sketch_of_filtered_rows(window):
+    df = generate_stamp_log(3000, n_points=15, seed=4)
+    df.loc[df.index[::97], "point"] = None
+    df.loc[df.index[::89], "user_id"] = None
+    time_index = build_time_index(df["timestamp"])
+    sketches = build_visitor_sketches(df, time_index, precision=8)
+
+    start, end, weekdays = window
+    mask = time_filter_mask(time_index, start, end, weekdays)
+    result = query_visitor_sketches(sketches, start, end, weekdays, df=df, time_index=time_index)
+    assert np.array_equal(result["registers"], direct_registers(df[mask], sketches["points"], 8))
+
+
+@pytest.mark.parametrize("precision", [6, 16])
+def test_sparse_and_dense_cells_are_bounded_by_rows(precision):
+    df = generate_stamp_log(3000, n_points=15, seed=5)
+    time_index = build_time_index(df["timestamp"])
+    sketches = build_visitor_sketches(df, time_index, precision=precision)
+
+    # 密なレジスタは、疎な項目で持つより小さくなるセルにだけ割り当てる。行ごとの値は持たない
+    assert set(sketches) == {"precision", "points", "hours", "minutes"}
+    for cells in (sketches["hours"], sketches["minutes"]):
+        entries = len(cells["sparse_rho"]) + np.count_nonzero(cells["dense_registers"])
+        assert cells["dense_registers"].nbytes <= SPARSE_ENTRY_BYTES * entries
+        assert entries <= 2 * len(df)
+    if precision == 6:
+        assert len(sketches["hours"]["dense_point"]) and len(sketches["hours"]["sparse_point"])
+
+    start, end, weekdays = datetime.time(9, 17), datetime.time(15, 42, 30), [5, 6]
+    mask = time_filter_mask(time_index, start, end, weekdays)
+    result = query_visitor_sketches(sketches, start, end, weekdays, df=df, time_index=time_index)
+    assert np.array_equal(result["registers"], direct_registers(df[mask], sketches["points"], precision))
+
+
+def test_merge_across_files_equals_whole():
+    df = generate_stamp_log(2000, n_points=10, seed=6).sort_values("timestamp", kind="stable")
+    halves = [df.iloc[:len(df) // 2], df.iloc[len(df) // 2:].iloc[:, ::-1]]
+    start, end = datetime.time(8, 30), datetime.time(19, 0)
+
+    results = []
+    for part in (df, *halves):
+        index = build_time_index(part["timestamp"])
+        results.append(query_visitor_sketches(build_visitor_sketches(part, index, 10), start, end,
+                                              df=part, time_index=index))
+    merged = merge_visitor_registers(results[1:])
+    assert np.array_equal(merged["points"], results[0]["points"])
+    assert np.array_equal(merged["registers"], results[0]["registers"])
+
+
+def test_estimates_within_error_bound():
+    precision = precision_for_error(0.01)
+    assert standard_error(precision) <= 0.01 < standard_error(precision - 1)
+
+    rng = np.random.default_rng(0)
+    for n in (5, 300, 50_000):
+        users = rng.choice(10 ** 9, size=n, replace=False)
+        # 同じユーザーが何度現れても結果は変わらない
+        hashes = user_hashes(np.concatenate([users, users[: n // 2]]))
+        value = estimate(sketch(np.zeros(len(hashes), dtype=np.int64), hashes, 1, precision))[0]
+        assert abs(value / n - 1) < 4 * standard_error(precision), n
+
+    df = pd.DataFrame({"user_id": ["A", "B", "A", "C"], "point": ["P1", "P1", "P2", None],
+                       "timestamp": pd.to_datetime(["2025-11-01 10:00"] * 4)})
+    index = build_time_index(df["timestamp"])
+    result = query_visitor_sketches(build_visitor_sketches(df, index), datetime.time(0, 0), datetime.time(23, 59, 59))
+    assert visitor_estimates(result) == ({"P1": 2, "P2": 1}, 3)
+
+
+def test_minute_aligned_windows_use_cells_only():
+    df = generate_stamp_log(3000, n_points=15, seed=7)
+    time_index = build_time_index(df["timestamp"])
+    sketches = build_visitor_sketches(df, time_index, precision=8)
+
+    # 分の区切りの範囲は行を参照せずにセルだけで求まり、分の途中で終わる範囲は行が必要
+    start, end = datetime.time(9, 17), datetime.time(15, 42, 59)
+    mask = time_filter_mask(time_index, start, end, [1, 3])
+    result = query_visitor_sketches(sketches, start, end, [1, 3])
+    assert np.array_equal(result["registers"], direct_registers(df[mask], sketches["points"], 8))
+    with pytest.raises(ValueError):
+        query_visitor_sketches(sketches, start, datetime.time(15, 42), [1, 3])